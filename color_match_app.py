@@ -3,14 +3,44 @@
 功能：上传图片，点击选择位置，显示颜色最相近的几个位置及相似程度
 """
 
+import time
 import tkinter as tk
 from tkinter import filedialog, messagebox
-from PIL import Image, ImageTk, ImageDraw
+from PIL import Image, ImageTk
 import numpy as np
-from colormath.color_objects import LabColor, sRGBColor
-from colormath.color_conversions import convert_color
-from colormath.color_diff import delta_e_cie2000
-import cv2
+
+from color_match_cache import LabCache
+from color_match_color import LAB_MODES, METRICS, METRIC_LABELS, srgb_to_lab
+from color_match_engine import ColorSearchEngine
+from color_match_palette import PaletteStore, SwatchPalette
+from color_match_region import RegionSet
+from color_match_trace import TRACER, resident_bytes
+from color_match_view import FrameScheduler, ImagePyramid, render_view, visible_box
+from color_match_worker import BackgroundTask, SearchWorker
+
+
+# 缩放、平移停止后多久用高质量插值重新渲染（毫秒）
+RENDER_SETTLE_MS = 150
+
+# 两次绘制的最短间隔（毫秒），约每秒60帧
+FRAME_INTERVAL_MS = 16
+
+# 后台查找时检查结果和进度的间隔（毫秒）；查找超过 SEARCH_PROGRESS_DELAY 秒才在结果面板显示进度
+SEARCH_POLL_MS = 30
+SEARCH_PROGRESS_DELAY = 0.2
+
+# 大图先显示预览，后台载入全分辨率时检查是否完成的间隔（毫秒）
+LOAD_POLL_MS = 50
+
+# 跟踪开启时状态栏显示最近一次载入、渲染的各步骤耗时（查找显示最近一次查找内的全部步骤）
+LOAD_STAGES = ('decode', 'lab', 'tiles')
+RENDER_STAGES = ('resize', 'photo')
+
+# 色卡选择菜单中“不使用色卡”的选项
+NO_PALETTE = '(无 None)'
+
+# 多目标模式中各目标标记的颜色（循环使用）
+TARGET_MARKER_COLORS = ['#ff1744', '#00e5ff', '#76ff03', '#ffea00', '#d500f9', '#ff9100', '#2979ff', '#ffffff']
 
 
 class ColorSimilarityApp:
@@ -34,6 +64,31 @@ class ColorSimilarityApp:
         self.num_similar = 3  # 显示相似位置数量
         self.min_distance = 20  # 最小像素间距（避免聚集）
 
+        # 颜色搜索引擎（与界面无关的匹配逻辑），重复打开的图片从磁盘缓存加载Lab数据
+        try:
+            cache = LabCache()
+        except OSError:
+            cache = None
+        # 大图点击查找用由粗到细查找，允许 1 ΔE 以内的误差（远小于人眼可分辨的色差）
+        self.engine = ColorSearchEngine(self.num_similar, self.min_distance, cache=cache, coarse_slack=1.0)
+
+        # 查找在后台线程中执行，界面不会卡住；新的取样使之前未完成的查找过期
+        self.search_worker = SearchWorker(self.engine)
+        self._search_done = None  # 最新一次查找完成后在主线程中调用的函数
+        self._poll_job = None  # 检查查找结果的 after 任务
+        self.target_rgb = None  # 最近一次查找的目标颜色（圆形取样时为圆内平均色）
+        self._area_snapshot = None  # 交给后台查找的搜索范围副本
+
+        # 大图先载入缩小的预览（查找在预览上进行），全分辨率的解码和Lab预计算在后台完成后替换
+        self.preview_scale = None  # 预览时为 (原图宽/预览宽, 原图高/预览高)，全分辨率时为None
+        self._full_load = None  # 后台载入全分辨率的 BackgroundTask
+        self._load_poll_job = None
+
+        # 状态栏：最近一次载入、查找、渲染的耗时（毫秒）
+        self.last_load_ms = None
+        self.last_query_ms = None
+        self.last_render_ms = None
+
         # 缩放和平移状态
         self.zoom_level = 1.0  # 当前缩放级别
         self.pan_x = 0  # X轴平移偏移量
@@ -41,6 +96,19 @@ class ColorSimilarityApp:
         self.pan_start = None  # 拖拽起始位置
         self.is_grabbing = False  # 是否正在抓手拖动
 
+        # 视图渲染：只渲染可见部分，缩小用缓存的金字塔层；平移时移动画布内容，露出未渲染部分时才重新渲染
+        self._pyramids = {}  # 'image' / 'labels' -> ImagePyramid
+        self.rendered_bounds = None  # 已渲染部分在画布上的范围 (左, 上, 右, 下)
+        self._settle_job = None  # 停下后高质量渲染的 after 任务
+
+        # 帧调度：缩放、平移、拖动的事件只更新状态，同一帧内的多次变化合并为一次绘制
+        self.frame_scheduler = FrameScheduler(self.root.after, self.root.after_idle, self.root.after_cancel,
+                                              self.draw_frame, interval=FRAME_INTERVAL_MS / 1000)
+        self._pending_render = None  # 下一帧的渲染：None / 'fast' / 'quality'
+        self._pending_pan = (0, 0)  # 下一帧要应用的累计平移
+        self._pending_drag = None  # 下一帧要更新的拖动轮廓（最新的鼠标位置）
+        self._lasso_drawn = 0  # 套索已画出的点数
+
         # 取样模式
         self.sample_mode = 'point'  # 取样模式：'point'=点击取样, 'circle'=圆形取样
         self.circle_start = None  # 圆形取样的起始点
@@ -54,6 +122,22 @@ class ColorSimilarityApp:
         self.comparison_id = None  # 对比区域矩形ID
         self.comparison_lasso_points = []  # 对比区域套索路径点
         self.comparison_lasso_lines = []  # 对比区域套索线段ID列表
+        self.comparison_shape_id = None  # 正在绘制的矩形/圆形范围ID
+
+        # 搜索范围：多个并入/挖去的套索、矩形、圆形按顺序组合（原图坐标）
+        self.search_area = RegionSet()
+
+        # 多目标模式：每次取样（或载入的色卡）追加一个目标，一次查找全部目标
+        self.targets = []  # 取样列表（与命令行取样相同的字典）
+        self.multi_results = None  # 每个目标的查找结果
+        self.label_image = None  # 分类图（每个像素涂成最近目标的颜色）
+
+        # 参考色卡库：选中的色卡用于取样颜色的分类和估计读数，多目标模式下作为目标
+        try:
+            self.palette_store = PaletteStore()
+        except OSError:
+            self.palette_store = None
+        self.palette = None
 
         self.setup_ui()
 
@@ -81,6 +165,44 @@ class ColorSimilarityApp:
         self.min_dist_entry.pack(side=tk.LEFT, padx=5)
         self.min_dist_entry.bind('<Return>', self.update_settings)
 
+        # 结果类型：像素位置 / 连通区域（色差阈值内）
+        result_mode_frame = tk.Frame(control_frame, bg='#f0f0f0')
+        result_mode_frame.pack(side=tk.LEFT, padx=5)
+        self.match_mode_var = tk.StringVar(value=self.engine.match_mode)
+        tk.Radiobutton(result_mode_frame, text="像素 Pixels", variable=self.match_mode_var, value='pixels',
+                       command=self.change_match_mode, bg='#f0f0f0', font=('Arial', 9)).pack(anchor=tk.W)
+        tk.Radiobutton(result_mode_frame, text="区域 Regions", variable=self.match_mode_var, value='regions',
+                       command=self.change_match_mode, bg='#f0f0f0', font=('Arial', 9)).pack(anchor=tk.W)
+        tk.Label(control_frame, text="阈值 ΔE:", bg='#f0f0f0', font=('Arial', 10)).pack(side=tk.LEFT, padx=5)
+        self.threshold_entry = tk.Entry(control_frame, width=5, font=('Arial', 10))
+        self.threshold_entry.insert(0, f"{self.engine.region_threshold:g}")
+        self.threshold_entry.pack(side=tk.LEFT, padx=5)
+        self.threshold_entry.bind('<Return>', self.update_settings)
+
+        # 结果去重：结果之间也保持最小间距
+        self.distinct_var = tk.BooleanVar(value=self.engine.distinct)
+        tk.Checkbutton(control_frame, text="不同区域\nDistinct", variable=self.distinct_var,
+                       command=self.change_distinct, bg='#f0f0f0', font=('Arial', 9)).pack(side=tk.LEFT, padx=5)
+
+        # 邻域平均：圆形取样时按取样圆大小的窗口平均色比较候选位置
+        self.neighborhood_var = tk.BooleanVar(value=self.engine.neighborhood)
+        tk.Checkbutton(control_frame, text="邻域平均\nNeighborhood", variable=self.neighborhood_var,
+                       command=self.change_neighborhood, bg='#f0f0f0', font=('Arial', 9)).pack(side=tk.LEFT, padx=5)
+
+        # 色差公式选择
+        tk.Label(control_frame, text="色差公式 Metric:", bg='#f0f0f0', font=('Arial', 10)).pack(side=tk.LEFT, padx=5)
+        self.metric_var = tk.StringVar(value=self.engine.metric)
+        metric_menu = tk.OptionMenu(control_frame, self.metric_var, *METRICS, command=self.change_metric)
+        metric_menu.config(font=('Arial', 9), width=9)
+        metric_menu.pack(side=tk.LEFT, padx=5)
+
+        # Lab内存模式（大图可用 float16 / uint8 节省内存）
+        tk.Label(control_frame, text="Lab内存 Memory:", bg='#f0f0f0', font=('Arial', 10)).pack(side=tk.LEFT, padx=5)
+        self.lab_mode_var = tk.StringVar(value=self.engine.lab_mode)
+        lab_mode_menu = tk.OptionMenu(control_frame, self.lab_mode_var, *LAB_MODES, command=self.change_lab_mode)
+        lab_mode_menu.config(font=('Arial', 9), width=7)
+        lab_mode_menu.pack(side=tk.LEFT, padx=5)
+
         # 应用设置按钮
         tk.Button(control_frame, text="设置生效 Apply", command=self.update_settings,
                  font=('Arial', 10)).pack(side=tk.LEFT, padx=5)
@@ -103,10 +225,52 @@ class ColorSimilarityApp:
         tk.Radiobutton(sample_mode_frame, text="圆形\nCircle", variable=self.sample_mode_var,
                       value='circle', command=self.change_sample_mode, bg='#f0f0f0', font=('Arial', 9)).pack(side=tk.LEFT, padx=2)
 
+        # 第三列：搜索范围形状、并入/挖去、撤销
+        area_frame = tk.Frame(control_frame, bg='#f0f0f0')
+        area_frame.pack(side=tk.LEFT, padx=5)
+        tk.Label(area_frame, text="搜索范围\nSearch Area", bg='#f0f0f0', font=('Arial', 9)).pack(side=tk.LEFT, padx=2)
+        self.area_shape_var = tk.StringVar(value='lasso')
+        area_shape_menu = tk.OptionMenu(area_frame, self.area_shape_var, 'lasso', 'rect', 'circle')
+        area_shape_menu.config(font=('Arial', 9), width=6)
+        area_shape_menu.pack(side=tk.LEFT, padx=2)
+        self.area_exclude_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(area_frame, text="挖去\nExclude", variable=self.area_exclude_var,
+                       bg='#f0f0f0', font=('Arial', 9)).pack(side=tk.LEFT, padx=2)
+        tk.Button(area_frame, text="撤销范围\nUndo Area", command=self.undo_search_area,
+                  font=('Arial', 9)).pack(side=tk.LEFT, padx=2)
+
+        # 第四列：多目标模式、载入色卡、显示分类图
+        multi_frame = tk.Frame(control_frame, bg='#f0f0f0')
+        multi_frame.pack(side=tk.LEFT, padx=5)
+        self.multi_target_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(multi_frame, text="多目标\nMulti-target", variable=self.multi_target_var,
+                       command=self.change_multi_target, bg='#f0f0f0', font=('Arial', 9)).pack(side=tk.LEFT, padx=2)
+        tk.Button(multi_frame, text="载入色卡\nLoad Swatches", command=self.load_swatch_file,
+                  font=('Arial', 9)).pack(side=tk.LEFT, padx=2)
+        self.palette_var = tk.StringVar(value=NO_PALETTE)
+        self.palette_menu = tk.OptionMenu(multi_frame, self.palette_var, NO_PALETTE)
+        self.palette_menu.config(font=('Arial', 9), width=10)
+        self.palette_menu.pack(side=tk.LEFT, padx=2)
+        self.refresh_palette_menu()
+        self.show_labels_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(multi_frame, text="分类图\nLabel Map", variable=self.show_labels_var,
+                       command=self.display_image_on_canvas, bg='#f0f0f0', font=('Arial', 9)).pack(side=tk.LEFT, padx=2)
+
         # 说明标签
-        tk.Label(control_frame, text="操作提示 Tips: 点击取样 Click to sample | Shift+左键绘制搜索范围 Shift+Left-drag search area | Ctrl+左键平移 Ctrl+Left-drag pan | 滚轮缩放 Wheel zoom",
+        tk.Label(control_frame, text="操作提示 Tips: 点击取样 Click to sample | Shift+左键添加搜索范围 Shift+Left-drag add search area | Ctrl+左键平移 Ctrl+Left-drag pan | 滚轮缩放 Wheel zoom",
                 bg='#f0f0f0', font=('Arial', 8), fg='#666').pack(side=tk.LEFT, padx=20)
 
+        # 底部状态栏：最近一次查找、渲染的耗时和常驻Lab数据大小；可随时开关分阶段跟踪并导出
+        status_frame = tk.Frame(self.root, bg='#f0f0f0')
+        status_frame.pack(side=tk.BOTTOM, fill=tk.X)
+        self.status_label = tk.Label(status_frame, text="", anchor=tk.W, bg='#f0f0f0', font=('Arial', 9), fg='#333')
+        self.status_label.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=10)
+        tk.Button(status_frame, text="导出跟踪 Export Trace", command=self.export_trace,
+                  font=('Arial', 8)).pack(side=tk.RIGHT, padx=5)
+        self.trace_var = tk.BooleanVar(value=TRACER.enabled)
+        tk.Checkbutton(status_frame, text="分阶段跟踪 Trace", variable=self.trace_var, command=self.change_trace,
+                       bg='#f0f0f0', font=('Arial', 8)).pack(side=tk.RIGHT, padx=5)
+
         # 主内容区域
         content_frame = tk.Frame(self.root)
         content_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
@@ -115,6 +279,10 @@ class ColorSimilarityApp:
         self.canvas_frame = tk.Frame(content_frame, bg='#ddd', bd=2, relief=tk.SUNKEN)
         self.canvas_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
+        # 底部：帧耗时统计
+        self.frame_label = tk.Label(self.canvas_frame, text="", anchor=tk.W, font=('Arial', 8), fg='#555', bg='#ddd')
+        self.frame_label.pack(side=tk.BOTTOM, fill=tk.X)
+
         self.canvas = tk.Canvas(self.canvas_frame, bg='white', cursor='crosshair')
         self.canvas.pack(fill=tk.BOTH, expand=True)
         # 绑定左键按下事件
@@ -153,15 +321,165 @@ class ColorSimilarityApp:
         self.result_text.config(yscrollcommand=scrollbar.set)
         scrollbar.config(command=self.result_text.yview)
 
+    def set_engine_options(self, **options):
+        """修改引擎的查找参数：先中止后台查找并等它结束（一次查找中会多次读取这些参数），再写入"""
+        self.search_worker.cancel()
+        self.search_worker.wait_idle()
+        for name, value in options.items():
+            setattr(self.engine, name, value)
+
     def update_settings(self, event=None):
-        """更新设置参数"""
+        """更新设置参数：像素模式由颜色索引直接查询新的前N名，其他情况对已计算的色差重新排序或阈值化"""
         try:
-            self.num_similar = int(self.num_entry.get())
-            self.min_distance = int(self.min_dist_entry.get())
-            if self.image_array is not None and self.click_x is not None:
-                self.find_similar_colors(self.click_x, self.click_y)
+            num_similar = int(self.num_entry.get())
+            min_distance = int(self.min_dist_entry.get())
+            region_threshold = float(self.threshold_entry.get())
         except ValueError:
             messagebox.showerror("错误 Error", "请输入有效的数字 Please enter valid numbers")
+            return
+        self.num_similar, self.min_distance = num_similar, min_distance
+        self.set_engine_options(num_similar=num_similar, min_distance=min_distance,
+                                region_threshold=region_threshold)
+        self.rerun_search()
+
+    def change_metric(self, value=None):
+        """切换色差公式，并重新查找"""
+        self.set_engine_options(metric=self.metric_var.get())
+        self.rerun_search()
+
+    def change_match_mode(self):
+        """切换结果类型（像素/区域），并重新查找"""
+        self.set_engine_options(match_mode=self.match_mode_var.get())
+        self.rerun_search()
+
+    def change_distinct(self):
+        """切换结果去重模式，并重新查找"""
+        self.set_engine_options(distinct=self.distinct_var.get())
+        self.rerun_search()
+
+    def change_neighborhood(self):
+        """切换邻域平均比较，并重新查找"""
+        self.set_engine_options(neighborhood=self.neighborhood_var.get())
+        self.rerun_search()
+
+    def change_lab_mode(self, value=None):
+        """切换Lab存储方式，已加载的图片重新预计算"""
+        self.set_engine_options(lab_mode=self.lab_mode_var.get())
+        if self.image_path is not None:
+            self.load_image()
+
+    def rerun_search(self):
+        """按当前取样重新查找相似颜色"""
+        if self.image_array is not None and self.multi_target_var.get() and self.targets:
+            self.find_multi_targets()
+            return
+        if self.image_array is None or self.click_x is None:
+            return
+        if self.sample_mode == 'circle' and hasattr(self, 'circle_center_x'):
+            self.find_similar_colors_by_circle(self.circle_center_x, self.circle_center_y, self.circle_radius)
+        else:
+            self.find_similar_colors(self.click_x, self.click_y)
+
+    def change_multi_target(self):
+        """切换多目标模式：清除之前的取样和结果，选中的色卡作为目标"""
+        self.clear_markers()
+        if self.multi_target_var.get() and self.palette is not None:
+            self.targets = self.palette.samples()
+            self.find_multi_targets()
+        if self.original_image is not None:
+            self.display_image_on_canvas()
+
+    def refresh_palette_menu(self):
+        """按色卡库重建色卡菜单"""
+        names = self.palette_store.names() if self.palette_store is not None else []
+        menu = self.palette_menu['menu']
+        menu.delete(0, tk.END)
+        for name in [NO_PALETTE] + names:
+            menu.add_command(label=name, command=lambda value=name: self.select_palette(value))
+
+    def select_palette(self, name):
+        """选择色卡：取样结果中显示分类和估计读数；多目标模式下色卡的色块替换之前的色块目标"""
+        self.palette_var.set(name)
+        try:
+            self.palette = None if name == NO_PALETTE else self.palette_store.load(name)
+        except (OSError, ValueError) as e:
+            self.palette = None
+            self.palette_var.set(NO_PALETTE)
+            messagebox.showerror("错误 Error", f"无法读取色卡 Cannot read palette: {e}")
+        if self.multi_target_var.get():
+            self.targets = [sample for sample in self.targets if sample['type'] != 'color']
+            if self.palette is not None:
+                self.targets.extend(self.palette.samples())
+        self.rerun_search()
+
+    def load_swatch_file(self):
+        """载入色卡文件：存入色卡库（下次启动直接选择）并选中，多目标模式下每个色块作为一个目标"""
+        path = filedialog.askopenfilename(filetypes=[("色卡 Swatches", "*.json *.csv"), ("所有文件 All Files", "*.*")])
+        if not path:
+            return
+        try:
+            if self.palette_store is not None:
+                palette = self.palette_store.import_file(path)
+            else:
+                palette = SwatchPalette.read(path)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("错误 Error", f"无法读取色卡 Cannot read swatches: {e}")
+            return
+        if self.palette_store is not None:
+            self.refresh_palette_menu()
+            self.select_palette(palette.name)
+        else:
+            self.palette = palette
+            if self.multi_target_var.get():
+                self.targets.extend(palette.samples())
+            self.rerun_search()
+
+    def describe_palette_match(self):
+        """结果面板中取样颜色对当前色卡的分类和估计读数"""
+        if self.palette is None or self.target_rgb is None:
+            return ""
+        lab = srgb_to_lab(np.asarray(self.target_rgb, dtype=np.float64)).astype(np.float64)
+        nearest = self.palette.classify(lab, self.engine.metric, count=2)
+        text = f"色卡 Palette: {self.palette.name}\n"
+        for match in nearest:
+            text += f"  {match['name']}: ΔE {match['distance']:.2f}\n"
+        estimate = self.palette.estimate(lab, self.engine.metric)
+        if estimate is not None:
+            text += (f"估计读数 Estimate: {estimate['value']:.4g} {self.palette.unit} "
+                     f"({estimate['low']}–{estimate['high']}, ΔE {estimate['distance']:.2f})\n")
+        return text
+
+    def add_target(self, sample):
+        """多目标模式：追加一个取样并重新查找全部目标"""
+        self.targets.append(sample)
+        self.find_multi_targets()
+
+    def find_multi_targets(self):
+        """在后台一次查找全部目标，生成分类图"""
+        if self.image_array is None or not self.targets:
+            return
+        targets, lasso = list(self.targets), self.get_search_lasso()
+
+        def search():
+            results, labels = self.engine.find_multi_target(targets, lasso)
+            # 分类图：每个像素涂成最近目标的颜色，未分类为深灰
+            lut = np.full((len(results) + 1, 3), 48, dtype=np.uint8)
+            for k, (sample, result) in enumerate(zip(targets, results)):
+                rgb = sample.get('rgb') or result['target_rgb']
+                if rgb is not None:
+                    lut[k + 1] = [int(round(c)) for c in rgb]
+            return results, Image.fromarray(lut[labels + 1])
+
+        self.submit_search(search, self.show_multi_targets)
+
+    def show_multi_targets(self, result):
+        """多目标查找完成：显示结果和分类图"""
+        self.multi_results, self.label_image = result
+        self.display_multi_results()
+        if self.show_labels_var.get():
+            self.display_image_on_canvas()
+        else:
+            self.draw_markers()
 
     def change_sample_mode(self):
         """切换取样模式"""
@@ -186,31 +504,111 @@ class ColorSimilarityApp:
             self.load_image()
 
     def load_image(self):
-        """加载并显示图片"""
+        """加载并显示图片：大图先显示缩小的预览，全分辨率在后台载入"""
+        # 先中止后台查找和未完成的载入，再替换引擎中的图片
+        self.cancel_full_load()
+        self.preview_scale = None
+        self.search_worker.cancel()
+        self.search_worker.wait_idle()
         try:
-            # 使用PIL打开图片
-            self.original_image = Image.open(self.image_path)
-
-            # 转换为RGB模式
-            if self.original_image.mode != 'RGB':
-                self.original_image = self.original_image.convert('RGB')
-
-            # 转换为numpy数组
-            self.image_array = np.array(self.original_image)
-
-            # 预计算Lab颜色空间（用于更准确的颜色差异计算）
-            rgb_array = self.image_array.astype(np.float32) / 255.0
-            self.lab_image = cv2.cvtColor(rgb_array, cv2.COLOR_RGB2LAB)
+            # 由引擎解码图片并预计算Lab颜色空间
+            start = time.perf_counter()
+            path = self.image_path
+            factor = self.engine.preview_factor(path)
+            if factor > 1:
+                image, (full_width, full_height), full = self.engine.load_preview(path, factor)
+                self.preview_scale = (full_width / image.width, full_height / image.height)
+                self._full_load = BackgroundTask(
+                    lambda checkpoint: self.engine.prepare_image(path, full, checkpoint), name='color-match-load')
+                self._load_poll_job = self.root.after(LOAD_POLL_MS, self.poll_full_load)
+            else:
+                image = self.engine.load_image(path)
+            self.original_image = image
+            self.last_load_ms = (time.perf_counter() - start) * 1000
+            self.image_array = self.engine.image_array
+            self.lab_image = self.engine.lab_image
 
             # 调整显示尺寸
             self.display_image_on_canvas()
 
-            # 清除之前的标记
+            # 清除之前的标记；载入的色卡保留，对新图片重新查找
+            swatches = [sample for sample in self.targets if sample['type'] == 'color']
             self.clear_markers()
+            if swatches:
+                self.targets = swatches
+                self.find_multi_targets()
 
         except Exception as e:
             messagebox.showerror("错误 Error", f"无法加载图片 Cannot load image: {str(e)}")
 
+    def cancel_full_load(self):
+        """放弃未完成的全分辨率载入"""
+        if self._full_load is not None:
+            self._full_load.cancel()
+            self._full_load = None
+        if self._load_poll_job is not None:
+            self.root.after_cancel(self._load_poll_job)
+            self._load_poll_job = None
+
+    def poll_full_load(self):
+        """全分辨率载入完成后替换预览：取样和搜索范围换算到全分辨率坐标，重新查找"""
+        self._load_poll_job = None
+        finished = self._full_load.poll() if self._full_load is not None else None
+        if finished is None:
+            if self._full_load is not None and not self._full_load.cancelled:
+                self._load_poll_job = self.root.after(LOAD_POLL_MS, self.poll_full_load)
+            self.update_status()
+            return
+        task, self._full_load = self._full_load, None
+        prepared, error = finished
+        if error is not None:
+            # 保留预览，仍可在预览上查找
+            messagebox.showerror("错误 Error", f"无法载入全分辨率图片 Cannot load full resolution: {error}")
+            return
+
+        # 预览上的查找已过期；等它在检查点中止后再替换引擎中的图片
+        self.search_worker.cancel()
+        self.search_worker.wait_idle()
+        scale_x, scale_y = self.preview_scale
+        self.engine.install(prepared)
+        self.original_image = prepared['image']
+        self.image_array = self.engine.image_array
+        self.lab_image = self.engine.lab_image
+        self.preview_scale = None
+        self.last_load_ms = task.elapsed * 1000
+        self.scale_samples(scale_x, scale_y)
+        # 画布按图片适应缩放，缩放级别和平移不变时视图位置不变
+        self.display_image_on_canvas()
+        self.rerun_search()
+
+    def scale_samples(self, scale_x, scale_y):
+        """把取样、多目标和搜索范围从预览坐标换算到全分辨率坐标；预览上的结果清空，由重新查找替换"""
+        img_height, img_width = self.image_array.shape[:2]
+
+        def point(x, y):
+            return (min(int((x + 0.5) * scale_x), img_width - 1), min(int((y + 0.5) * scale_y), img_height - 1))
+
+        radius_scale = (scale_x + scale_y) / 2
+        if self.click_x is not None:
+            self.click_x, self.click_y = point(self.click_x, self.click_y)
+        if hasattr(self, 'circle_center_x'):
+            self.circle_center_x, self.circle_center_y = point(self.circle_center_x, self.circle_center_y)
+            self.circle_radius = int(self.circle_radius * radius_scale)
+        targets = []
+        for sample in self.targets:
+            sample = dict(sample)
+            if sample['type'] != 'color':
+                sample['x'], sample['y'] = point(sample['x'], sample['y'])
+            if sample['type'] == 'circle':
+                sample['radius'] = int(sample['radius'] * radius_scale)
+            targets.append(sample)
+        self.targets = targets
+        self.search_area = self.search_area.scaled(scale_x, scale_y)
+        self._area_snapshot = None
+        self.similar_locations = []
+        self.multi_results = None
+        self.label_image = None
+
     def on_zoom(self, event):
         """处理鼠标滚轮缩放事件"""
         if self.original_image is None:
@@ -256,8 +654,8 @@ class ColorSimilarityApp:
         self.pan_x -= offset_from_center_x * (scale_ratio - 1)
         self.pan_y -= offset_from_center_y * (scale_ratio - 1)
 
-        # 重新显示图片
-        self.display_image_on_canvas()
+        # 下一帧快速渲染（连续滚动合并为一次），停止后高质量重新渲染
+        self.request_render(fast=True)
 
     def on_pan_start(self, event):
         """开始拖拽平移"""
@@ -272,12 +670,8 @@ class ColorSimilarityApp:
 
         dx = event.x - self.pan_start[0]
         dy = event.y - self.pan_start[1]
-
-        self.pan_x += dx
-        self.pan_y += dy
-
         self.pan_start = (event.x, event.y)
-        self.display_image_on_canvas()
+        self.pan_view(dx, dy)
 
     def on_key_press(self, event):
         """按键按下"""
@@ -301,14 +695,19 @@ class ColorSimilarityApp:
             self.pan_start = (event.x, event.y)
             return
 
-        # 检查是否按住了 Shift 键（用于绘制搜索范围套索）
+        # 检查是否按住了 Shift 键（用于添加搜索范围：套索/矩形/圆形）
         if event.state & 0x1:  # Shift 键的掩码
             self.comparison_start = (event.x, event.y)
             self.comparison_lasso_points = [(event.x, event.y)]
-            # 清除之前的搜索范围套索
-            for line_id in self.comparison_lasso_lines:
-                self.canvas.delete(line_id)
             self.comparison_lasso_lines = []
+            self._lasso_drawn = 1
+            color, dash = self.search_area_style(self.area_exclude_var.get())
+            if self.area_shape_var.get() == 'rect':
+                self.comparison_shape_id = self.canvas.create_rectangle(
+                    event.x, event.y, event.x, event.y, outline=color, width=2, dash=dash)
+            elif self.area_shape_var.get() == 'circle':
+                self.comparison_shape_id = self.canvas.create_oval(
+                    event.x, event.y, event.x, event.y, outline=color, width=2, dash=dash)
             return
 
         # 圆形取样模式
@@ -326,6 +725,9 @@ class ColorSimilarityApp:
 
     def on_left_button_release(self, event):
         """左键释放"""
+        # 先画出尚未绘制的拖动轮廓
+        self.flush_drag_outline()
+
         # 搜索范围套索选择结束
         if self.comparison_start:
             self.on_search_area_selection_end(event)
@@ -355,25 +757,21 @@ class ColorSimilarityApp:
         if self.is_grabbing and self.pan_start is not None:
             dx = event.x - self.pan_start[0]
             dy = event.y - self.pan_start[1]
-            self.pan_x += dx
-            self.pan_y += dy
             self.pan_start = (event.x, event.y)
-            self.display_image_on_canvas()
+            self.pan_view(dx, dy)
             return
 
-        # 搜索范围套索绘制（Shift+左键）
+        # 搜索范围绘制（Shift+左键）：轮廓在下一帧按最新位置更新
+        if self.comparison_start and self.comparison_shape_id is not None:
+            self.request_drag_outline(event.x, event.y)
+            return
         if self.comparison_start:
             new_point = (event.x, event.y)
             last_point = self.comparison_lasso_points[-1]
             distance = ((new_point[0] - last_point[0])**2 + (new_point[1] - last_point[1])**2)**0.5
             if distance > 5:
                 self.comparison_lasso_points.append(new_point)
-                line_id = self.canvas.create_line(
-                    last_point[0], last_point[1],
-                    new_point[0], new_point[1],
-                    fill='cyan', width=2
-                )
-                self.comparison_lasso_lines.append(line_id)
+                self.request_drag_outline(event.x, event.y)
             return
 
         # 圆形取样拖动
@@ -388,70 +786,171 @@ class ColorSimilarityApp:
             # 计算半径（两点距离的一半）
             radius = ((current_x - start_x)**2 + (current_y - start_y)**2)**0.5 / 2
 
-            if self.circle_id:
-                self.canvas.coords(
-                    self.circle_id,
-                    center_x - radius, center_y - radius,
-                    center_x + radius, center_y + radius
-                )
             self.circle_rect = {
                 'center_x': center_x,
                 'center_y': center_y,
                 'radius': radius
             }
+            self.request_drag_outline(current_x, current_y)
             return
 
-    def redraw_lasso(self):
-        """重新绘制套索区域"""
-        if not hasattr(self, 'search_lasso_points_original'):
-            return
+    def request_drag_outline(self, x, y):
+        """拖动中的轮廓在下一帧按最新的鼠标位置更新"""
+        self._pending_drag = (x, y)
+        self.frame_scheduler.request()
 
-        # 清除旧的套索线
-        for line_id in self.comparison_lasso_lines:
-            self.canvas.delete(line_id)
-        self.comparison_lasso_lines = []
-
-        # 将原图坐标转换为屏幕坐标并重新绘制
-        for i in range(len(self.search_lasso_points_original)):
-            orig_x, orig_y = self.search_lasso_points_original[i]
-            screen_x = self.display_offset_x + orig_x * self.scale
-            screen_y = self.display_offset_y + orig_y * self.scale
-
-            if i > 0:
-                prev_orig_x, prev_orig_y = self.search_lasso_points_original[i-1]
-                prev_screen_x = self.display_offset_x + prev_orig_x * self.scale
-                prev_screen_y = self.display_offset_y + prev_orig_y * self.scale
-
-                line_id = self.canvas.create_line(
-                    prev_screen_x, prev_screen_y,
-                    screen_x, screen_y,
-                    fill='cyan', width=2
-                )
-                self.comparison_lasso_lines.append(line_id)
-
-        # 闭合路径
-        if len(self.search_lasso_points_original) > 0:
-            first_orig_x, first_orig_y = self.search_lasso_points_original[0]
-            last_orig_x, last_orig_y = self.search_lasso_points_original[-1]
-            first_screen_x = self.display_offset_x + first_orig_x * self.scale
-            first_screen_y = self.display_offset_y + first_orig_y * self.scale
-            last_screen_x = self.display_offset_x + last_orig_x * self.scale
-            last_screen_y = self.display_offset_y + last_orig_y * self.scale
-
-            line_id = self.canvas.create_line(
-                last_screen_x, last_screen_y,
-                first_screen_x, first_screen_y,
-                fill='cyan', width=2
-            )
-            self.comparison_lasso_lines.append(line_id)
+    def flush_drag_outline(self):
+        """更新拖动中的轮廓：搜索范围的矩形/圆形、套索新增的线段、圆形取样"""
+        drag, self._pending_drag = self._pending_drag, None
+        if drag is None:
+            return
+        x, y = drag
+        if self.comparison_start and self.comparison_shape_id is not None:
+            # 矩形为对角拖动，圆形以按下位置为圆心
+            start_x, start_y = self.comparison_start
+            if self.area_shape_var.get() == 'rect':
+                self.canvas.coords(self.comparison_shape_id, start_x, start_y, x, y)
+            else:
+                radius = ((x - start_x) ** 2 + (y - start_y) ** 2) ** 0.5
+                self.canvas.coords(self.comparison_shape_id, start_x - radius, start_y - radius,
+                                   start_x + radius, start_y + radius)
+        elif self.comparison_start:
+            # 上一帧之后新增的点画成一条折线
+            points = self.comparison_lasso_points
+            if len(points) > self._lasso_drawn:
+                color, dash = self.search_area_style(self.area_exclude_var.get())
+                coords = [c for point in points[self._lasso_drawn - 1:] for c in point]
+                self.comparison_lasso_lines.append(self.canvas.create_line(*coords, fill=color, width=2, dash=dash))
+                self._lasso_drawn = len(points)
+        elif self.circle_start and self.circle_id and self.circle_rect:
+            rect = self.circle_rect
+            self.canvas.coords(self.circle_id,
+                               rect['center_x'] - rect['radius'], rect['center_y'] - rect['radius'],
+                               rect['center_x'] + rect['radius'], rect['center_y'] + rect['radius'])
+
+    @staticmethod
+    def search_area_style(exclude):
+        """搜索范围轮廓的颜色与虚线样式：并入为青色实线，挖去为橙色虚线"""
+        return ('orange', (6, 4)) if exclude else ('cyan', ())
+
+    def redraw_search_area(self):
+        """按原图坐标重新绘制所有搜索范围"""
+        self.canvas.delete("search_area")
+        for kind, params, exclude in self.search_area.shapes:
+            color, dash = self.search_area_style(exclude)
+            if kind == 'polygon':
+                # 闭合路径
+                screen_points = []
+                for orig_x, orig_y in params + params[:1]:
+                    screen_points.extend((self.display_offset_x + orig_x * self.scale,
+                                          self.display_offset_y + orig_y * self.scale))
+                self.canvas.create_line(*screen_points, fill=color, width=2, dash=dash, tags="search_area")
+            elif kind == 'rect':
+                x0, y0, x1, y1 = params
+                self.canvas.create_rectangle(
+                    self.display_offset_x + x0 * self.scale, self.display_offset_y + y0 * self.scale,
+                    self.display_offset_x + (x1 + 1) * self.scale, self.display_offset_y + (y1 + 1) * self.scale,
+                    outline=color, width=2, dash=dash, tags="search_area")
+            else:
+                center_x, center_y, radius = params
+                screen_x = self.display_offset_x + center_x * self.scale
+                screen_y = self.display_offset_y + center_y * self.scale
+                self.canvas.create_oval(screen_x - radius * self.scale, screen_y - radius * self.scale,
+                                        screen_x + radius * self.scale, screen_y + radius * self.scale,
+                                        outline=color, width=2, dash=dash, tags="search_area")
+
+    def pyramid_for(self, source):
+        """原图或分类图的金字塔，图片变化时重建"""
+        key = 'labels' if source is self.label_image else 'image'
+        pyramid = self._pyramids.get(key)
+        if pyramid is None or pyramid.image is not source:
+            pyramid = self._pyramids[key] = ImagePyramid(source)
+        return pyramid
+
+    def schedule_settle(self):
+        """交互停止 RENDER_SETTLE_MS 后用高质量插值重新渲染"""
+        if self._settle_job is not None:
+            self.root.after_cancel(self._settle_job)
+        self._settle_job = self.root.after(RENDER_SETTLE_MS, self.settle_render)
+
+    def settle_render(self):
+        self._settle_job = None
+        self.request_render()
+
+    def request_render(self, fast=False):
+        """请求在下一帧渲染：同一帧内的多次请求合并，其中有高质量请求时做高质量渲染"""
+        if self._pending_render != 'quality':
+            self._pending_render = 'fast' if fast else 'quality'
+        self.frame_scheduler.request()
+
+    def draw_frame(self):
+        """每帧最多一次：渲染或应用累计的平移，再更新拖动中的轮廓"""
+        render, self._pending_render = self._pending_render, None
+        (dx, dy), self._pending_pan = self._pending_pan, (0, 0)
+        if render is not None:
+            # 平移量已计入 pan_x / pan_y
+            self.display_image_on_canvas(fast=render == 'fast')
+            if render == 'quality':
+                self.show_frame_stats()
+        elif dx or dy:
+            self.apply_pan(dx, dy)
+        self.flush_drag_outline()
+
+    def show_frame_stats(self):
+        """在画布下方显示最近各帧的耗时和被合并的事件比例"""
+        stats = self.frame_scheduler.stats.summary()
+        if 'p95_ms' not in stats:
+            return
+        self.frame_label.config(
+            text=f"帧 Frames {stats['frames']}  p50 {stats['p50_ms']:.1f} ms  p95 {stats['p95_ms']:.1f} ms  "
+                 f"max {stats['max_ms']:.1f} ms  合并 coalesced {stats['coalesced']:.0%}")
 
-    def display_image_on_canvas(self):
-        """在画布上显示图片"""
+    def pan_view(self, dx, dy):
+        """平移：记录平移量，下一帧一次应用"""
+        self.pan_x += dx
+        self.pan_y += dy
+        pending_x, pending_y = self._pending_pan
+        self._pending_pan = (pending_x + dx, pending_y + dy)
+        self.frame_scheduler.request()
+
+    def apply_pan(self, dx, dy):
+        """应用平移：移动画布上已有的图片和标记，只有露出未渲染的部分时才重新渲染"""
+        if self.rendered_bounds is None:
+            self.display_image_on_canvas(fast=True)
+            return
+        self.canvas.move('all', dx, dy)
+        self.display_offset_x += dx
+        self.display_offset_y += dy
+        left, top, right, bottom = self.rendered_bounds
+        self.rendered_bounds = (left + dx, top + dy, right + dx, bottom + dy)
+
+        # 可见部分是否都已渲染
+        canvas_width, canvas_height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        box = visible_box(self.original_image.size, self.scale, self.display_offset_x, self.display_offset_y,
+                          canvas_width, canvas_height)
+        if box is None:
+            return
+        x0, y0, x1, y1 = box
+        left, top, right, bottom = self.rendered_bounds
+        if (self.display_offset_x + x0 * self.scale < left - 1 or self.display_offset_y + y0 * self.scale < top - 1
+                or self.display_offset_x + x1 * self.scale > right + 1
+                or self.display_offset_y + y1 * self.scale > bottom + 1):
+            self.display_image_on_canvas(fast=True)
+
+    def display_image_on_canvas(self, fast=False):
+        """在画布上显示图片：只渲染可见部分；fast 为交互中的快速插值，停止后自动高质量重新渲染"""
         if self.original_image is None:
             return
+        if fast:
+            self.schedule_settle()
+        elif self._settle_job is not None:
+            self.root.after_cancel(self._settle_job)
+            self._settle_job = None
 
-        # 获取画布尺寸
-        self.canvas.update()
+        # 按当前 pan_x / pan_y 渲染，未应用的平移已包含在内
+        self._pending_pan = (0, 0)
+
+        # 获取画布尺寸（不调用 update，避免在渲染中重新进入事件循环）
         canvas_width = self.canvas.winfo_width()
         canvas_height = self.canvas.winfo_height()
 
@@ -468,30 +967,36 @@ class ColorSimilarityApp:
         # 应用用户缩放级别
         self.scale = base_scale * self.zoom_level
 
-        # 调整图片大小
+        # 图片位置（默认居中，然后应用平移），用于坐标转换
         new_width = int(img_width * self.scale)
         new_height = int(img_height * self.scale)
-        self.display_image = self.original_image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-
-        # 计算图片位置（考虑平移）
-        # 默认居中，然后应用平移
-        center_x = canvas_width // 2 + self.pan_x
-        center_y = canvas_height // 2 + self.pan_y
-
-        # 显示图片
-        self.photo = ImageTk.PhotoImage(self.display_image)
+        self.display_offset_x = canvas_width // 2 + self.pan_x - new_width // 2
+        self.display_offset_y = canvas_height // 2 + self.pan_y - new_height // 2
+
+        # 只渲染可见部分（含边距，小幅平移不必重新渲染）
+        start = time.perf_counter()
+        source = self.original_image
+        if self.show_labels_var.get() and self.label_image is not None:
+            source = self.label_image
+        rendered = render_view(self.pyramid_for(source), self.scale, self.display_offset_x, self.display_offset_y,
+                               canvas_width, canvas_height, fast=fast)
         self.canvas.delete("all")
-        self.canvas.create_image(center_x, center_y, image=self.photo, anchor=tk.CENTER)
-
-        # 保存显示图片的信息（用于坐标转换）
-        self.display_offset_x = center_x - new_width // 2
-        self.display_offset_y = center_y - new_height // 2
-
-        # 重新绘制套索区域（如果存在）
-        self.redraw_lasso()
+        self.rendered_bounds = None
+        if rendered is not None:
+            self.display_image, left, top = rendered
+            with TRACER.span('photo', width=self.display_image.width, height=self.display_image.height):
+                self.photo = ImageTk.PhotoImage(self.display_image)
+                self.canvas.create_image(left, top, image=self.photo, anchor=tk.NW)
+            self.rendered_bounds = (left, top, left + self.display_image.width, top + self.display_image.height)
+        self.last_render_ms = (time.perf_counter() - start) * 1000
+        self.update_status()
+
+        # 重新绘制搜索范围（如果存在）
+        self.redraw_search_area()
 
         # 重新绘制标记（如果存在）
-        if self.click_x is not None or (self.sample_mode == 'circle' and hasattr(self, 'circle_center_x')):
+        if (self.click_x is not None or self.multi_results is not None
+                or (self.sample_mode == 'circle' and hasattr(self, 'circle_center_x'))):
             self.draw_markers()
 
     def point_in_polygon(self, x, y, polygon):
@@ -512,38 +1017,45 @@ class ColorSimilarityApp:
         return inside
 
     def on_search_area_selection_end(self, event):
-        """搜索范围选择结束（套索）"""
-        if len(self.comparison_lasso_points) < 3:
-            return
-
-        # 闭合路径
-        first_point = self.comparison_lasso_points[0]
-        last_point = self.comparison_lasso_points[-1]
-        line_id = self.canvas.create_line(
-            last_point[0], last_point[1],
-            first_point[0], first_point[1],
-            fill='cyan', width=2
-        )
-        self.comparison_lasso_lines.append(line_id)
-
-        # 转换为原图坐标
-        img_height, img_width = self.image_array.shape[:2]
-        original_lasso_points = []
-        for px, py in self.comparison_lasso_points:
-            orig_x = int((px - self.display_offset_x) / self.scale)
-            orig_y = int((py - self.display_offset_y) / self.scale)
-            orig_x = max(0, min(orig_x, img_width - 1))
-            orig_y = max(0, min(orig_y, img_height - 1))
-            original_lasso_points.append((orig_x, orig_y))
-
-        # 保存搜索范围套索路径（套索区域会一直保留）
-        self.search_lasso_points_original = original_lasso_points
-
-        # 如果已经有点击位置或圆形取样，立即重新查找
-        if self.click_x is not None and self.click_y is not None:
-            self.find_similar_colors(self.click_x, self.click_y)
-        elif self.sample_mode == 'circle' and hasattr(self, 'circle_center_x'):
-            self.find_similar_colors_by_circle(self.circle_center_x, self.circle_center_y, self.circle_radius)
+        """搜索范围绘制结束：按原图坐标加入组合范围（套索/矩形/圆形，并入或挖去）"""
+        # 正在绘制的轮廓由 redraw_search_area 统一重画
+        for line_id in self.comparison_lasso_lines:
+            self.canvas.delete(line_id)
+        self.comparison_lasso_lines = []
+        if self.comparison_shape_id is not None:
+            self.canvas.delete(self.comparison_shape_id)
+            self.comparison_shape_id = None
+
+        def to_original(px, py):
+            return (int((px - self.display_offset_x) / self.scale), int((py - self.display_offset_y) / self.scale))
+
+        exclude = self.area_exclude_var.get()
+        shape = self.area_shape_var.get()
+        start_x, start_y = self.comparison_start
+        if shape == 'rect':
+            if start_x == event.x or start_y == event.y:
+                return
+            self.search_area.add_rect(*to_original(start_x, start_y), *to_original(event.x, event.y), exclude=exclude)
+        elif shape == 'circle':
+            radius = ((event.x - start_x) ** 2 + (event.y - start_y) ** 2) ** 0.5 / self.scale
+            if radius < 1:
+                return
+            self.search_area.add_circle(*to_original(start_x, start_y), radius, exclude=exclude)
+        else:
+            if len(self.comparison_lasso_points) < 3:
+                return
+            # 超出图片的点由搜索范围裁剪
+            self.search_area.add_polygon([to_original(px, py) for px, py in self.comparison_lasso_points],
+                                         exclude=exclude)
+        self.redraw_search_area()
+        self.rerun_search()
+
+    def undo_search_area(self):
+        """删除最后添加的搜索范围"""
+        if len(self.search_area):
+            self.search_area.pop()
+            self.redraw_search_area()
+            self.rerun_search()
 
     def on_circle_sample_end(self, event):
         """圆形取样结束"""
@@ -573,6 +1085,10 @@ class ColorSimilarityApp:
             'radius': radius_original
         }
 
+        if self.multi_target_var.get():
+            self.add_target({'type': 'circle', 'x': center_x, 'y': center_y, 'radius': radius_original})
+            return
+
         # 设置 click_x 和 click_y，以便套索等其他功能能正常工作
         self.click_x = center_x
         self.click_y = center_y
@@ -593,75 +1109,49 @@ class ColorSimilarityApp:
         # 检查坐标是否在图片范围内
         img_height, img_width = self.image_array.shape[:2]
         if 0 <= x < img_width and 0 <= y < img_height:
+            if self.multi_target_var.get():
+                self.add_target({'type': 'point', 'x': x, 'y': y})
+                return
             self.click_x = x
             self.click_y = y
             self.find_similar_colors(x, y)
 
-    def rgb_to_lab(self, rgb):
-        """将RGB颜色转换为Lab颜色空间"""
-        r, g, b = rgb[0] / 255.0, rgb[1] / 255.0, rgb[2] / 255.0
-        srgb = sRGBColor(r, g, b)
-        lab = convert_color(srgb, LabColor)
-        return lab
+    def get_search_lasso(self):
+        """获取当前搜索范围（RegionSet 副本，原图坐标），没有则返回None
 
-    def find_similar_colors_by_circle(self, center_x, center_y, radius):
-        """查找与圆形区域平均颜色相似的位置"""
-        if self.image_array is None:
-            return
+        后台查找使用副本，之后增删范围不影响正在进行的查找；范围不变时复用同一个副本（及其组合结果）。
+        """
+        if not len(self.search_area):
+            return None
+        if self._area_snapshot is None or self._area_snapshot.shapes != self.search_area.shapes:
+            self._area_snapshot = self.search_area.snapshot()
+        return self._area_snapshot
 
-        img_height, img_width = self.image_array.shape[:2]
+    def describe_search_area(self):
+        """结果面板中搜索范围的说明"""
+        included, excluded = self.search_area.counts()
+        return f"搜索范围 Search Range: {included} 并入 include, {excluded} 挖去 exclude\n"
 
-        # 创建圆形mask
-        y_indices, x_indices = np.ogrid[:img_height, :img_width]
-        mask_circle = (y_indices - center_y) ** 2 + (x_indices - center_x) ** 2 <= radius ** 2
-
-        # 计算圆内区域的平均颜色
-        pixels_in_circle = self.image_array[mask_circle]
-        if len(pixels_in_circle) == 0:
+    def find_similar_colors_by_circle(self, center_x, center_y, radius):
+        """在后台查找与圆形区域平均颜色相似的位置"""
+        if self.image_array is None:
             return
 
-        avg_color = np.mean(pixels_in_circle, axis=0)
-        target_lab = self.rgb_to_lab(avg_color)
-        target_lab_array = np.array([target_lab.lab_l, target_lab.lab_a, target_lab.lab_b])
-
-        # 计算所有像素与目标颜色的差异
-        diff = np.sqrt(np.sum((self.lab_image - target_lab_array) ** 2, axis=2))
+        lasso = self.get_search_lasso()
 
-        # 基础mask：排除圆形取样区域
-        mask = np.ones_like(diff, dtype=bool)
-        exclusion_radius = radius + self.min_distance
-        mask_exclude_circle = (y_indices - center_y) ** 2 + (x_indices - center_x) ** 2 > exclusion_radius ** 2
-        mask = mask & mask_exclude_circle
+        def search():
+            locations = self.engine.find_similar_colors_by_circle(center_x, center_y, radius, lasso)
+            return locations, self.engine.last_target_rgb
 
-        # 如果有套索区域，添加套索限制
-        if hasattr(self, 'search_lasso_points_original'):
-            search_points = np.array(self.search_lasso_points_original, dtype=np.int32).reshape((-1, 1, 2))
-            mask_in_lasso = np.zeros((img_height, img_width), dtype=np.uint8)
-            cv2.fillPoly(mask_in_lasso, [search_points], 1)
-            mask_in_lasso = mask_in_lasso.astype(bool)
-            mask = mask & mask_in_lasso
+        self.submit_search(search, lambda result: self.show_circle_results(center_x, center_y, radius, result))
 
-        # 找到最相似的N个位置
-        masked_diff = diff.copy()
-        masked_diff[~mask] = np.inf
-
-        # 获取最小的N个值的位置
-        flat_indices = np.argpartition(masked_diff.flatten(), self.num_similar)[:self.num_similar]
-        flat_indices = flat_indices[np.argsort(masked_diff.flatten()[flat_indices])]
-
-        # 转换为坐标
-        self.similar_locations = []
-        for idx in flat_indices:
-            flat_y, flat_x = np.unravel_index(idx, diff.shape)
-            if masked_diff[flat_y, flat_x] < np.inf:
-                similarity = max(0, 100 - diff[flat_y, flat_x] * 2)
-                self.similar_locations.append({
-                    'x': flat_x,
-                    'y': flat_y,
-                    'rgb': tuple(self.image_array[flat_y, flat_x]),
-                    'similarity': similarity,
-                    'distance': diff[flat_y, flat_x]
-                })
+    def show_circle_results(self, center_x, center_y, radius, result):
+        """圆形取样查找完成：显示结果和标记"""
+        locations, target_rgb = result
+        # 圆内没有像素时忽略
+        if target_rgb is None:
+            return
+        self.similar_locations, self.target_rgb = locations, target_rgb
 
         # 保存圆形区域标记位置（用于绘制）
         self.circle_center_x = center_x
@@ -673,65 +1163,109 @@ class ColorSimilarityApp:
         self.draw_markers()
 
     def find_similar_colors(self, x, y):
-        """查找相似颜色位置（单点模式）"""
+        """在后台查找相似颜色位置（单点模式）"""
         if self.image_array is None:
             return
 
-        # 检查是否有套索区域
-        has_lasso = hasattr(self, 'search_lasso_points_original')
+        lasso = self.get_search_lasso()
 
-        # 获取选中的颜色
-        target_rgb = self.image_array[y, x]
-        target_lab = self.rgb_to_lab(target_rgb)
-        target_lab_array = np.array([target_lab.lab_l, target_lab.lab_a, target_lab.lab_b])
+        def search():
+            return self.engine.find_similar_colors(x, y, lasso), self.engine.last_target_rgb
 
-        img_height, img_width = self.image_array.shape[:2]
-
-        # 计算欧氏距离
-        diff = np.sqrt(np.sum((self.lab_image - target_lab_array) ** 2, axis=2))
-
-        # 基础mask：排除点击位置附近的像素
-        mask = np.ones_like(diff, dtype=bool)
-        center_y, center_x = y, x
-        radius = self.min_distance
-        y_indices, x_indices = np.ogrid[:img_height, :img_width]
-        mask_from_center = (y_indices - center_y) ** 2 + (x_indices - center_x) ** 2 >= radius ** 2
-        mask = mask & mask_from_center
-
-        # 如果有套索区域，添加套索限制
-        if has_lasso:
-            search_points = np.array(self.search_lasso_points_original, dtype=np.int32).reshape((-1, 1, 2))
-            mask_in_lasso = np.zeros((img_height, img_width), dtype=np.uint8)
-            cv2.fillPoly(mask_in_lasso, [search_points], 1)
-            mask_in_lasso = mask_in_lasso.astype(bool)
-            mask = mask & mask_in_lasso
-
-        # 找到最相似的N个位置
-        masked_diff = diff.copy()
-        masked_diff[~mask] = np.inf
-
-        # 获取最小的N个值的位置
-        flat_indices = np.argpartition(masked_diff.flatten(), self.num_similar)[:self.num_similar]
-        flat_indices = flat_indices[np.argsort(masked_diff.flatten()[flat_indices])]
-
-        # 转换为坐标
-        self.similar_locations = []
-        for idx in flat_indices:
-            flat_y, flat_x = np.unravel_index(idx, diff.shape)
-            if masked_diff[flat_y, flat_x] < np.inf:
-                similarity = max(0, 100 - diff[flat_y, flat_x] * 2)
-                self.similar_locations.append({
-                    'x': flat_x,
-                    'y': flat_y,
-                    'rgb': tuple(self.image_array[flat_y, flat_x]),
-                    'similarity': similarity,
-                    'distance': diff[flat_y, flat_x]
-                })
+        self.submit_search(search, self.show_similar_colors)
 
-        # 显示结果
+    def show_similar_colors(self, result):
+        """单点查找完成：显示结果和标记"""
+        self.similar_locations, self.target_rgb = result
         self.display_results()
         self.draw_markers()
 
+    def submit_search(self, search, on_done):
+        """在后台线程中执行 search()，完成后在主线程中调用 on_done(结果)；之前未完成的查找被取消"""
+        self._search_done = on_done
+        self.search_worker.submit(search)
+        if self._poll_job is None:
+            self._poll_job = self.root.after(SEARCH_POLL_MS, self.poll_search)
+
+    def poll_search(self):
+        """主线程中取回后台查找的结果；仍在查找时显示进度"""
+        self._poll_job = None
+        finished = self.search_worker.poll()
+        if finished is not None:
+            self.clear_search_progress()
+            result, error = finished
+            if error is not None:
+                messagebox.showerror("错误 Error", f"查找失败 Search failed: {error}")
+            else:
+                self.last_query_ms = self.search_worker.elapsed * 1000
+                self._search_done(result)
+                self.update_status()
+        if self.search_worker.busy:
+            self.show_search_progress()
+            self._poll_job = self.root.after(SEARCH_POLL_MS, self.poll_search)
+        elif finished is None:
+            self.clear_search_progress()
+
+    def show_search_progress(self):
+        """在结果面板第一行显示正在进行的查找的耗时和进度"""
+        progress = self.search_worker.progress()
+        if progress is None or progress[1] < SEARCH_PROGRESS_DELAY:
+            return
+        fraction, elapsed = progress
+        text = f"⏳ 查找中 Searching... {elapsed:.1f} s"
+        if fraction is not None:
+            text += f" ({fraction:.0%})"
+        self.clear_search_progress()
+        self.result_text.insert('1.0', text + "\n", 'progress')
+
+    def clear_search_progress(self):
+        ranges = self.result_text.tag_ranges('progress')
+        if ranges:
+            self.result_text.delete(*ranges)
+
+    def update_status(self):
+        """状态栏：最近一次载入、查找、渲染的耗时，常驻Lab数据和进程内存；跟踪开启时附带各阶段最近一次的耗时"""
+        parts = []
+        for label, value in (("载入 Load", self.last_load_ms), ("查找 Query", self.last_query_ms),
+                             ("渲染 Render", self.last_render_ms)):
+            if value is not None:
+                parts.append(f"{label} {value:.1f} ms")
+        if self.preview_scale is not None:
+            parts.append(f"预览 Preview 1/{round(self.preview_scale[0])}，后台载入全分辨率 Loading full resolution...")
+        if self.engine.has_image:
+            parts.append(f"Lab {self.engine.lab_bytes / 1024 ** 2:.1f} MB")
+        rss = resident_bytes()
+        if rss is not None:
+            parts.append(f"内存 RSS {rss / 1024 ** 2:.0f} MB")
+        if TRACER.enabled:
+            stages = [(name, TRACER.last[name]) for name in LOAD_STAGES + RENDER_STAGES if name in TRACER.last]
+            stages += TRACER.children('query').items()
+            if stages:
+                parts.append("阶段 Stages (ms): " + " ".join(f"{name} {ms:.1f}" for name, ms in stages))
+        self.status_label.config(text="  |  ".join(parts))
+
+    def change_trace(self):
+        """开关分阶段跟踪（立即对之后的载入、查找、渲染生效）"""
+        TRACER.enabled = self.trace_var.get()
+        self.update_status()
+
+    def export_trace(self):
+        """把已记录的阶段导出为 Chrome 跟踪格式（chrome://tracing、Perfetto 打开）"""
+        if not TRACER.events:
+            messagebox.showinfo("提示 Info", "还没有跟踪记录，请先勾选“分阶段跟踪”再操作\n"
+                                           "No trace events yet. Enable Trace first.")
+            return
+        path = filedialog.asksaveasfilename(defaultextension='.json',
+                                            filetypes=[("Chrome跟踪 Chrome Trace", "*.json")])
+        if not path:
+            return
+        try:
+            count = TRACER.export_chrome(path)
+        except OSError as e:
+            messagebox.showerror("错误 Error", f"无法导出跟踪 Cannot export trace: {e}")
+            return
+        messagebox.showinfo("完成 Done", f"已导出 {count} 个事件 Exported {count} events:\n{path}")
+
     def display_results(self):
         """显示结果到右侧面板"""
         self.result_text.delete(1.0, tk.END)
@@ -742,39 +1276,33 @@ class ColorSimilarityApp:
         # 显示选中的颜色信息
         if self.sample_mode == 'circle' and hasattr(self, 'circle_center_x'):
             # 圆形取样模式
-            pixels_in_circle = self.image_array[
-                max(0, self.circle_center_y - self.circle_radius):min(self.image_array.shape[0], self.circle_center_y + self.circle_radius + 1),
-                max(0, self.circle_center_x - self.circle_radius):min(self.image_array.shape[1], self.circle_center_x + self.circle_radius + 1)
-            ]
-            # 创建mask获取圆内像素
-            y_indices, x_indices = np.ogrid[:pixels_in_circle.shape[0], :pixels_in_circle.shape[1]]
-            center_offset_y = self.circle_center_y - max(0, self.circle_center_y - self.circle_radius)
-            center_offset_x = self.circle_center_x - max(0, self.circle_center_x - self.circle_radius)
-            mask = (y_indices - center_offset_y) ** 2 + (x_indices - center_offset_x) ** 2 <= self.circle_radius ** 2
-            avg_color = tuple(np.mean(pixels_in_circle[mask], axis=0).astype(int))
+            avg_color = tuple(int(c) for c in self.target_rgb)
 
             self.result_text.insert(tk.END, "=" * 40 + "\n")
             self.result_text.insert(tk.END, "⭕ 圆形取样模式 Circle Sample Mode\n")
             self.result_text.insert(tk.END, f"圆心 Center: ({self.circle_center_x}, {self.circle_center_y})\n")
             self.result_text.insert(tk.END, f"半径 Radius: {self.circle_radius}\n")
             self.result_text.insert(tk.END, f"平均颜色 Avg Color RGB: {avg_color}\n")
+            if self.engine.neighborhood:
+                window = 2 * self.engine.neighborhood_half_width(self.circle_radius) + 1
+                self.result_text.insert(tk.END, f"邻域平均 Neighborhood: {window}x{window}\n")
+            self.result_text.insert(tk.END, f"色差公式 Metric: {METRIC_LABELS[self.engine.metric]}\n")
 
-            if hasattr(self, 'search_lasso_points_original'):
-                search_num = len(self.search_lasso_points_original)
-                self.result_text.insert(tk.END, f"搜索范围 Search Range: {search_num}-point lasso area\n")
+            if len(self.search_area):
+                self.result_text.insert(tk.END, self.describe_search_area())
             self.result_text.insert(tk.END, "=" * 40 + "\n\n")
         else:
             # 单点取样模式
-            target_rgb = self.image_array[self.click_y, self.click_x]
+            target_rgb = tuple(int(c) for c in self.image_array[self.click_y, self.click_x])
 
-            if hasattr(self, 'search_lasso_points_original'):
+            if len(self.search_area):
                 # 点击+搜索范围模式
-                search_num = len(self.search_lasso_points_original)
                 self.result_text.insert(tk.END, "=" * 40 + "\n")
                 self.result_text.insert(tk.END, "🎯 点击+搜索范围模式 Click + Search Mode\n")
                 self.result_text.insert(tk.END, f"取样位置 Sample Location: ({self.click_x}, {self.click_y})\n")
-                self.result_text.insert(tk.END, f"取样颜色 Sample Color RGB: {tuple(target_rgb)}\n")
-                self.result_text.insert(tk.END, f"搜索范围 Search Range: {search_num}-point lasso area\n")
+                self.result_text.insert(tk.END, f"取样颜色 Sample Color RGB: {target_rgb}\n")
+                self.result_text.insert(tk.END, self.describe_search_area())
+                self.result_text.insert(tk.END, f"色差公式 Metric: {METRIC_LABELS[self.engine.metric]}\n")
                 self.result_text.insert(tk.END, "=" * 40 + "\n\n")
             else:
                 # 单点模式
@@ -782,9 +1310,30 @@ class ColorSimilarityApp:
                 self.result_text.insert(tk.END, "📍 单点选择模式 Single Point Mode\n")
                 self.result_text.insert(tk.END, f"选中的颜色 Selected Color:\n")
                 self.result_text.insert(tk.END, f"  位置 Location: ({self.click_x}, {self.click_y})\n")
-                self.result_text.insert(tk.END, f"  RGB: {tuple(target_rgb)}\n")
+                self.result_text.insert(tk.END, f"  RGB: {target_rgb}\n")
+                self.result_text.insert(tk.END, f"色差公式 Metric: {METRIC_LABELS[self.engine.metric]}\n")
                 self.result_text.insert(tk.END, "=" * 40 + "\n\n")
 
+        # 选中色卡时显示取样颜色的分类和估计读数
+        palette_text = self.describe_palette_match()
+        if palette_text:
+            self.result_text.insert(tk.END, palette_text + "\n")
+
+        # 区域模式：显示相似区域
+        if self.engine.match_mode == 'regions':
+            self.result_text.insert(tk.END, f"找到 Found {len(self.similar_locations)} 个相似区域 regions "
+                                            f"(ΔE ≤ {self.engine.region_threshold:g}):\n\n")
+            for i, region in enumerate(self.similar_locations, 1):
+                left, top, width, height = region['bbox']
+                self.result_text.insert(tk.END, f"{i}. 中心 Centroid: ({region['x']}, {region['y']})\n")
+                self.result_text.insert(tk.END, f"   面积 Area: {region['area']} px\n")
+                self.result_text.insert(tk.END, f"   范围 BBox: ({left}, {top}) {width}×{height}\n")
+                self.result_text.insert(tk.END, f"   平均 Mean RGB: {region['rgb']}\n")
+                self.result_text.insert(tk.END, f"   平均 Mean Lab: {region['mean_lab']}\n")
+                self.result_text.insert(tk.END, f"   平均色差 Mean Diff: {region['distance']:.2f}\n")
+                self.result_text.insert(tk.END, "-" * 30 + "\n")
+            return
+
         # 显示相似位置
         self.result_text.insert(tk.END, f"找到 Found {len(self.similar_locations)} 个相似位置:\n\n")
 
@@ -795,9 +1344,59 @@ class ColorSimilarityApp:
             self.result_text.insert(tk.END, f"   色差 Diff: {loc['distance']:.2f}\n")
             self.result_text.insert(tk.END, "-" * 30 + "\n")
 
+    @staticmethod
+    def target_label(sample):
+        """目标的简短描述"""
+        if sample['type'] == 'color':
+            return f"{sample['name']} RGB{tuple(sample['rgb'])}"
+        if sample['type'] == 'circle':
+            return f"⭕ ({sample['x']}, {sample['y']}) r={sample['radius']}"
+        return f"📍 ({sample['x']}, {sample['y']})"
+
+    def display_multi_results(self):
+        """多目标模式：每个目标的像素占比和最相似的位置"""
+        self.result_text.delete(1.0, tk.END)
+        total = sum(result['pixels'] for result in self.multi_results)
+        self.result_text.insert(tk.END, "=" * 40 + "\n")
+        self.result_text.insert(tk.END, f"🎨 多目标模式 Multi-target Mode: {len(self.targets)} 个目标 targets\n")
+        self.result_text.insert(tk.END, f"色差公式 Metric: {METRIC_LABELS[self.engine.metric]}\n")
+        if len(self.search_area):
+            self.result_text.insert(tk.END, self.describe_search_area())
+        self.result_text.insert(tk.END, "=" * 40 + "\n\n")
+        for k, (sample, result) in enumerate(zip(self.targets, self.multi_results), 1):
+            share = 100 * result['pixels'] / total if total else 0.0
+            self.result_text.insert(tk.END, f"T{k}. {self.target_label(sample)}\n")
+            if result['target_rgb'] is not None and sample['type'] != 'color':
+                self.result_text.insert(tk.END, f"   RGB: {tuple(int(round(c)) for c in result['target_rgb'])}\n")
+            self.result_text.insert(tk.END, f"   像素占比 Share: {share:.1f}% ({result['pixels']} px)\n")
+            for i, loc in enumerate(result['matches'], 1):
+                self.result_text.insert(tk.END, f"   {i}. ({loc['x']}, {loc['y']})  色差 Diff: {loc['distance']:.2f}\n")
+            self.result_text.insert(tk.END, "-" * 30 + "\n")
+
+    def draw_multi_target_markers(self):
+        """多目标模式：每个目标的取样位置及其相似位置，用同一种颜色标出"""
+        for k, (sample, result) in enumerate(zip(self.targets, self.multi_results), 1):
+            color = TARGET_MARKER_COLORS[(k - 1) % len(TARGET_MARKER_COLORS)]
+            if sample['type'] != 'color':
+                x = self.display_offset_x + sample['x'] * self.scale
+                y = self.display_offset_y + sample['y'] * self.scale
+                r = sample['radius'] * self.scale if sample['type'] == 'circle' else 8
+                self.canvas.create_oval(x - r, y - r, x + r, y + r, outline=color, width=3, tags="marker")
+                self.canvas.create_text(x, y - r - 10, text=f"T{k}", fill=color,
+                                        font=('Arial', 10, 'bold'), tags="marker")
+            for i, loc in enumerate(result['matches'], 1):
+                x = self.display_offset_x + loc['x'] * self.scale
+                y = self.display_offset_y + loc['y'] * self.scale
+                self.canvas.create_oval(x - 5, y - 5, x + 5, y + 5, outline=color, width=2, tags="marker")
+                self.canvas.create_text(x, y - 13, text=f"{k}.{i}", fill=color,
+                                        font=('Arial', 8, 'bold'), tags="marker")
+
     def draw_markers(self):
         """在图片上绘制标记"""
         self.canvas.delete("marker")
+        if self.multi_results is not None:
+            self.draw_multi_target_markers()
+            return
 
         # 绘制取样区域
         if self.sample_mode == 'circle' and hasattr(self, 'circle_center_x'):
@@ -827,7 +1426,17 @@ class ColorSimilarityApp:
             intensity = int(255 * (1 - loc['similarity'] / 100))
             color = f'#{255:02x}{255-intensity:02x}{0:02x}'
 
-            r2 = 6
+            if 'bbox' in loc:
+                # 区域：绘制外接矩形和中心点
+                left, top, width, height = loc['bbox']
+                self.canvas.create_rectangle(
+                    self.display_offset_x + left * self.scale, self.display_offset_y + top * self.scale,
+                    self.display_offset_x + (left + width) * self.scale,
+                    self.display_offset_y + (top + height) * self.scale,
+                    outline=color, width=2, tags="marker")
+                r2 = 3
+            else:
+                r2 = 6
             self.canvas.create_oval(x2-r2, y2-r2, x2+r2, y2+r2, outline=color, width=2, tags="marker")
 
             # 添加编号
@@ -837,6 +1446,8 @@ class ColorSimilarityApp:
 
     def clear_markers(self):
         """清除所有标记"""
+        # 未完成的查找不再显示结果
+        self.search_worker.cancel()
         self.canvas.delete("marker")
         # 清除对比区域套索
         for line_id in self.comparison_lasso_lines:
@@ -852,11 +1463,19 @@ class ColorSimilarityApp:
         self.circle_rect = None
 
         self.similar_locations = []
+        self.target_rgb = None
         self.click_x = None
         self.click_y = None
+        # 清除多目标取样和分类图
+        self.targets = []
+        self.multi_results = None
+        had_labels = self.label_image is not None
+        self.label_image = None
+        if had_labels and self.show_labels_var.get() and self.original_image is not None:
+            self.display_image_on_canvas()
         # 清除搜索范围数据
-        if hasattr(self, 'search_lasso_points_original'):
-            delattr(self, 'search_lasso_points_original')
+        self.search_area.clear()
+        self.canvas.delete("search_area")
         if hasattr(self, 'comparison_lasso_points_original'):
             delattr(self, 'comparison_lasso_points_original')
         if hasattr(self, 'comparison_rect_original'):
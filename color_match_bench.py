@@ -0,0 +1,1383 @@
+"""
+颜色比对性能基准
+功能：生成带已知色块的合成图片，测量批处理等路径的耗时与吞吐量（无需显示环境）
+
+示例：
+    python color_match_bench.py batch --images 64 --megapixels 2
+    python color_match_bench.py parity
+    python color_match_bench.py lab-modes --megapixels 24
+    python color_match_bench.py query --megapixels 24
+    python color_match_bench.py coarse --megapixels 48 --slack 0 1
+    python color_match_bench.py threads --megapixels 50 --threads 1 2 4 8 16
+    python color_match_bench.py distinct
+    python color_match_bench.py palette --megapixels 12
+    python color_match_bench.py multi --megapixels 12 --targets 1 4 16 64
+    python color_match_bench.py swatches --swatches 24 96
+    python color_match_bench.py view --megapixels 20 --zoom 1 2 5 10
+    python color_match_bench.py frames --megapixels 20 --rate 250 1000
+    python color_match_bench.py stream --megapixels 100 --budget-mb 128
+    python color_match_bench.py trace --megapixels 1 12 --export trace.json
+    python color_match_bench.py -o startup.json startup --repeat 9
+    python color_match_bench.py -o baseline.json suite --megapixels 1 10 50 100
+    python color_match_bench.py compare baseline.json current.json --threshold 0.15
+"""
+
+import argparse
+import compileall
+import heapq
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+import PIL
+from PIL import Image
+
+from color_match_cli import peak_rss_mb, run_batch
+from color_match_color import LAB_MODES, METRICS, delta_e, srgb_to_lab
+from color_match_engine import ColorSearchEngine
+from color_match_palette import PaletteStore, SwatchPalette
+from color_match_stream import stream_search
+from color_match_trace import Tracer
+from color_match_view import FrameScheduler, ImagePyramid, choose_level, render_view
+
+# 合成图片中的已知色块（RGB）
+PATCH_COLORS = [
+    (200, 30, 30), (30, 160, 60), (40, 60, 200), (230, 210, 40),
+    (250, 180, 200), (120, 70, 20), (128, 128, 128), (20, 20, 20),
+]
+
+
+def synthetic_image(megapixels, seed=0, patch_size=None):
+    """生成带噪声背景和已知色块的RGB图片数组（宽高比 3:2）"""
+    pixels = int(megapixels * 1_000_000)
+    height = max(8, int((pixels * 2 / 3) ** 0.5))
+    width = max(8, pixels // height)
+    rng = np.random.default_rng(seed)
+
+    # 平滑背景 + 少量噪声
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    gradient = np.linspace(60, 190, width, dtype=np.float32)
+    for channel in range(3):
+        image[:, :, channel] = (gradient * (0.8 + 0.2 * channel))[None, :].clip(0, 255).astype(np.uint8)
+    image += rng.integers(0, 12, size=image.shape, dtype=np.uint8)
+
+    # 已知色块：每种颜色两块，位置固定
+    if patch_size is None:
+        patch_size = max(4, min(height, width) // 12)
+    for i, color in enumerate(PATCH_COLORS):
+        for j in range(2):
+            y = (i * 2 + j) * height // (len(PATCH_COLORS) * 2)
+            x = ((i * 37 + j * 53) % 80) * (width - patch_size) // 80
+            image[y:y + patch_size, x:x + patch_size] = color
+    return image
+
+
+def write_synthetic_images(directory, count, megapixels, fmt='png'):
+    """写出一组合成图片，返回路径列表"""
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"synthetic_{i:04d}.{fmt}")
+        Image.fromarray(synthetic_image(megapixels, seed=i)).save(path)
+        paths.append(path)
+    return paths
+
+
+def worker_counts(max_workers):
+    """1, 2, 4, ... 直到 max_workers"""
+    counts = []
+    n = 1
+    while n < max_workers:
+        counts.append(n)
+        n *= 2
+    counts.append(max_workers)
+    return counts
+
+
+def bench_batch(args):
+    """批处理多进程扩展性：不同工作进程数下的吞吐量与加速比"""
+    max_workers = args.max_workers or os.cpu_count() or 1
+    samples = [{'type': 'point', 'x': 5, 'y': 5},
+               {'type': 'circle', 'x': 20, 'y': 20, 'radius': 4}]
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_synthetic_images(directory, args.images, args.megapixels, args.format)
+        baseline = None
+        for workers in worker_counts(max_workers):
+            start = time.perf_counter()
+            for _ in run_batch(paths, samples, workers=workers, ordered=not args.unordered):
+                pass
+            elapsed = time.perf_counter() - start
+            rate = len(paths) / elapsed
+            baseline = baseline or rate
+            speedup = rate / baseline
+            results.append({'workers': workers, 'seconds': elapsed, 'images_per_second': rate,
+                            'speedup': speedup, 'efficiency': speedup / workers})
+            print(f"workers={workers:3d}  {elapsed:8.2f}s  {rate:8.2f} images/s  "
+                  f"speedup x{speedup:5.2f}  efficiency {speedup / workers:6.1%}", file=sys.stderr)
+    return {'benchmark': 'batch', 'images': args.images, 'megapixels': args.megapixels,
+            'results': results}
+
+
+def bench_parity(args):
+    """sRGB→Lab 一致性：srgb_to_lab 与 cv2.cvtColor 在8位sRGB色域上的差异及速度"""
+    levels = np.arange(0, 256, args.step, dtype=np.uint8)
+    rgb = np.stack(np.meshgrid(levels, levels, levels, indexing='ij'), axis=-1).reshape(1, -1, 3)
+
+    start = time.perf_counter()
+    ours = srgb_to_lab(rgb)
+    ours_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    reference = cv2.cvtColor(rgb.astype(np.float32) / 255.0, cv2.COLOR_RGB2LAB)
+    cv2_seconds = time.perf_counter() - start
+
+    diff = np.sqrt(np.sum((ours.astype(np.float64) - reference) ** 2, axis=-1)).ravel()
+    worst = rgb.reshape(-1, 3)[np.argmax(diff)]
+
+    # 取样颜色按点击时的路径转换（引擎的 rgb_to_lab，float64 输入，圆形取样的平均色也是浮点），
+    # 结果必须与整图（uint8 输入）中的同一像素完全相同
+    engine = ColorSearchEngine()
+    picked = slice(None, None, max(1, rgb.shape[1] // 997))
+    single = np.array([engine.rgb_to_lab(c.astype(np.float64)) for c in rgb.reshape(-1, 3)[picked]])
+    consistent = bool(np.array_equal(single, ours.reshape(-1, 3)[picked]))
+
+    report = {'benchmark': 'parity', 'colors': int(rgb.shape[1]),
+              'max_delta_e': float(diff.max()), 'mean_delta_e': float(diff.mean()),
+              'worst_rgb': [int(c) for c in worst],
+              'tolerance_max': args.tolerance_max, 'tolerance_mean': args.tolerance_mean,
+              'sample_image_consistent': consistent,
+              'srgb_to_lab_seconds': ours_seconds, 'cv2_seconds': cv2_seconds}
+    report['passed'] = (report['max_delta_e'] <= args.tolerance_max
+                        and report['mean_delta_e'] <= args.tolerance_mean and consistent)
+
+    print(f"colors={report['colors']}  max ΔE76={report['max_delta_e']:.4f} (<= {args.tolerance_max})  "
+          f"mean ΔE76={report['mean_delta_e']:.4f} (<= {args.tolerance_mean})  "
+          f"worst RGB={tuple(report['worst_rgb'])}", file=sys.stderr)
+    print(f"srgb_to_lab {ours_seconds * 1000:.1f} ms, cv2 {cv2_seconds * 1000:.1f} ms, "
+          f"sample/image consistent: {consistent}", file=sys.stderr)
+    print("PASS" if report['passed'] else "FAIL", file=sys.stderr)
+    return report
+
+
+def _measure_lab_mode(path, lab_mode, samples):
+    """在独立进程中加载图片并查询，返回耗时与峰值内存"""
+    engine = ColorSearchEngine(num_similar=20, min_distance=0, lab_mode=lab_mode)
+    start = time.perf_counter()
+    engine.load_image(path)
+    load_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for x, y in samples:
+        engine.find_similar_colors(x, y)
+    query_seconds = (time.perf_counter() - start) / len(samples)
+    return {'load_seconds': load_seconds, 'query_seconds': query_seconds,
+            'lab_mb': engine.lab_bytes / 1024 ** 2, 'peak_rss_mb': peak_rss_mb()}
+
+
+def bench_lab_modes(args):
+    """Lab存储方式：各方式相对float32的ΔE误差、top-N排名误差、查询耗时与峰值内存"""
+    image = synthetic_image(args.megapixels, seed=args.seed)
+    img_height, img_width = image.shape[:2]
+    rng = np.random.default_rng(args.seed)
+    samples = [(int(x), int(y)) for x, y in zip(rng.integers(0, img_width, args.samples),
+                                                rng.integers(0, img_height, args.samples))]
+
+    engines = {}
+    for mode in LAB_MODES:
+        engine = ColorSearchEngine(num_similar=args.top, min_distance=0, lab_mode=mode)
+        engine.set_image(image)
+        engines[mode] = engine
+    reference = engines['float32']
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'synthetic.png')
+        Image.fromarray(image).save(path)
+        # 每种方式在新进程中测量，峰值内存互不影响
+        context = multiprocessing.get_context('spawn')
+        measured = {}
+        for mode in LAB_MODES:
+            with context.Pool(1) as pool:
+                measured[mode] = pool.apply(_measure_lab_mode, (path, mode, samples))
+
+    for mode in LAB_MODES:
+        engine = engines[mode]
+        max_error = 0.0
+        error_sum = 0.0
+        excess = 0.0
+        for x, y in samples:
+            target = reference.rgb_to_lab(image[y, x])
+            ref_dist = reference.distances(target)
+            mode_dist = engine.distances(target)
+            error = np.abs(mode_dist - ref_dist)
+            max_error = max(max_error, float(error.max()))
+            error_sum += float(error.mean())
+
+            # 排名误差：压缩方式返回的第k个结果的真实ΔE 与 精确第k名ΔE 之差
+            ref_top = reference.find_similar_colors(x, y)
+            mode_top = engine.find_similar_colors(x, y)
+            for ref_loc, mode_loc in zip(ref_top, mode_top):
+                excess = max(excess, float(ref_dist[mode_loc['y'], mode_loc['x']]) - ref_loc['distance'])
+
+        row = dict(measured[mode], mode=mode, max_delta_e_error=max_error,
+                   mean_delta_e_error=error_sum / len(samples), max_rank_excess_delta_e=excess)
+        results.append(row)
+        print(f"{mode:8s} Lab {row['lab_mb']:8.1f} MB  peak RSS {row['peak_rss_mb'] or 0:8.1f} MB  "
+              f"load {row['load_seconds']:6.2f}s  query {row['query_seconds'] * 1000:7.1f} ms  "
+              f"ΔE err max {max_error:.3f} mean {row['mean_delta_e_error']:.3f}  "
+              f"top-{args.top} rank excess ΔE {excess:.3f}", file=sys.stderr)
+    return {'benchmark': 'lab-modes', 'megapixels': args.megapixels, 'results': results}
+
+
+def legacy_find_similar_colors(lab_image, x, y, num_similar, min_distance, lasso_points=None):
+    """原 find_similar_colors 的查找过程（仅作对比基准）：每次查询分配多个整幅临时数组"""
+    img_height, img_width = lab_image.shape[:2]
+    target_lab_array = lab_image[y, x].astype(np.float64)
+    diff = np.sqrt(np.sum((lab_image - target_lab_array) ** 2, axis=2))
+    mask = np.ones_like(diff, dtype=bool)
+    y_indices, x_indices = np.ogrid[:img_height, :img_width]
+    mask = mask & ((y_indices - y) ** 2 + (x_indices - x) ** 2 >= min_distance ** 2)
+    if lasso_points:
+        search_points = np.array(lasso_points, dtype=np.int32).reshape((-1, 1, 2))
+        mask_in_lasso = np.zeros((img_height, img_width), dtype=np.uint8)
+        cv2.fillPoly(mask_in_lasso, [search_points], 1)
+        mask = mask & mask_in_lasso.astype(bool)
+    masked_diff = diff.copy()
+    masked_diff[~mask] = np.inf
+    flat_indices = np.argpartition(masked_diff.flatten(), num_similar)[:num_similar]
+    flat_indices = flat_indices[np.argsort(masked_diff.flatten()[flat_indices])]
+    return [(int(i % img_width), int(i // img_width), float(diff.flat[i])) for i in flat_indices
+            if masked_diff.flat[i] < np.inf]
+
+
+def measure(func, repeat=3):
+    """运行 func：返回 (最短耗时秒, 峰值临时内存字节, 结果)；先预热一次"""
+    result = func()
+    best = float('inf')
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return best, peak, result
+
+
+def bench_query(args):
+    """单次查询：原实现与预分配缓冲区内核的耗时、峰值临时内存对比，并核对结果色差一致"""
+    image = synthetic_image(args.megapixels, seed=args.seed)
+    img_height, img_width = image.shape[:2]
+    pixels = img_height * img_width
+    # 只测整图查找内核（不用颜色索引和由粗到细查找）
+    engine = ColorSearchEngine(num_similar=args.top, min_distance=args.min_distance, coarse_to_fine=False,
+                               palette_index=False)
+    engine.set_image(image)
+    x, y = img_width // 3, img_height // 3
+    lasso = None
+    if args.lasso:
+        # 以图片中心为中心、边长为图片宽高 args.lasso 倍的三角形
+        half_w, half_h = img_width * args.lasso / 2, img_height * args.lasso / 2
+        lasso = [(int(img_width / 2 - half_w), int(img_height / 2 - half_h)),
+                 (int(img_width / 2 + half_w), int(img_height / 2 - half_h)),
+                 (img_width // 2, int(img_height / 2 + half_h))]
+
+    legacy_seconds, legacy_peak, legacy = measure(
+        lambda: legacy_find_similar_colors(engine.lab_image, x, y, args.top, args.min_distance, lasso),
+        args.repeat)
+
+    def kernel_query():
+        # 同一查询会复用缓冲区中的色差，每次都重新计算
+        engine.forget_distances()
+        return engine.find_similar_colors(x, y, lasso)
+
+    kernel_seconds, kernel_peak, kernel = measure(kernel_query, args.repeat)
+
+    # 同色差可能对应不同位置，比较排序后的色差序列
+    legacy_dist = [d for _, _, d in legacy]
+    kernel_dist = [loc['distance'] for loc in kernel]
+    agree = len(legacy_dist) == len(kernel_dist) and np.allclose(legacy_dist, kernel_dist, atol=1e-3)
+
+    report = {'benchmark': 'query', 'megapixels': pixels / 1e6, 'top': args.top, 'lasso': args.lasso,
+              'legacy_ms': legacy_seconds * 1000, 'kernel_ms': kernel_seconds * 1000,
+              'legacy_temp_bytes_per_pixel': legacy_peak / pixels,
+              'kernel_temp_bytes_per_pixel': kernel_peak / pixels,
+              'results_agree': bool(agree), 'passed': bool(agree)}
+    print(f"{pixels / 1e6:.1f} MP, top-{args.top}{f' + lasso {args.lasso:g}' if lasso else ''}", file=sys.stderr)
+    print(f"legacy  {report['legacy_ms']:8.1f} ms  peak temporaries "
+          f"{report['legacy_temp_bytes_per_pixel']:6.2f} B/px", file=sys.stderr)
+    print(f"kernel  {report['kernel_ms']:8.1f} ms  peak temporaries "
+          f"{report['kernel_temp_bytes_per_pixel']:6.2f} B/px  (x{legacy_seconds / kernel_seconds:.2f} faster)",
+          file=sys.stderr)
+    print(f"results agree: {agree}", file=sys.stderr)
+    return report
+
+
+def bench_threads(args):
+    """单张图片内按行条带多线程的整图查找：不同线程数的每次点击耗时与加速比，核对结果与单线程完全相同"""
+    image = synthetic_image(args.megapixels, seed=args.seed)
+    img_height, img_width = image.shape[:2]
+    clicks, lasso = _query_clicks(image, args.samples, args.seed)
+    # 只测整图查找（颜色索引和由粗到细查找不经过条带）
+    engine = ColorSearchEngine(num_similar=args.top, min_distance=args.min_distance, metric=args.metric,
+                               distinct=args.distinct, coarse_to_fine=False, palette_index=False)
+    engine.set_image(image)
+
+    results = []
+    baseline = None
+    passed = True
+    for threads in args.threads:
+        engine.threads = threads
+        times, outputs = [], []
+        for x, y in clicks:
+            for lasso_points in (None, lasso):
+                engine.forget_distances()
+                begin = time.perf_counter()
+                outputs.append(engine.find_similar_colors(x, y, lasso_points))
+                times.append(time.perf_counter() - begin)
+        if baseline is None:
+            baseline = (outputs, float(np.median(times)))
+        identical = outputs == baseline[0]
+        passed &= identical
+        row = {'threads': threads, 'bands': len(engine._bands(img_height, img_width)), 'queries': len(times),
+               'median_ms': float(np.median(times)) * 1000, 'max_ms': max(times) * 1000,
+               'speedup': baseline[1] / float(np.median(times)), 'identical': bool(identical)}
+        results.append(row)
+        print(f"threads {threads:3d}  bands {row['bands']:3d}  median {row['median_ms']:8.1f} ms"
+              f"  max {row['max_ms']:8.1f} ms  x{row['speedup']:5.2f}  {'ok' if identical else 'FAIL'}",
+              file=sys.stderr)
+    return {'benchmark': 'threads', 'megapixels': img_height * img_width / 1e6, 'metric': args.metric,
+            'top': args.top, 'cpu_count': os.cpu_count(), 'results': results, 'passed': bool(passed)}
+
+
+def bench_distinct(args):
+    """不同位置模式：与对完整排序结果贪心选取的参考结果逐个核对（含 num_similar=0 和超过可选数量的情况）"""
+    rng = np.random.default_rng(args.seed)
+    # 小图随机像素，另加大块纯色（同色差按位置排序）
+    image = rng.integers(0, 256, (args.height, args.width, 3), dtype=np.uint8)
+    image[:args.height // 3, :args.width // 3] = PATCH_COLORS[0]
+    clicks = [tuple(int(v) for v in rng.integers(0, (args.width, args.height))) for _ in range(args.samples)]
+    clicks.append((0, 0))
+    lasso = [(0, 0), (args.width - 1, args.height // 4), (args.width // 3, args.height - 1)]
+
+    # 参考：整图查找的完整排序（按色差平方，同值按位置），再贪心跳过与已选位置距离小于 min_distance 的
+    reference_engine = ColorSearchEngine(num_similar=args.width * args.height, coarse_to_fine=False,
+                                         palette_index=False)
+    reference_engine.set_image(image)
+    engine = ColorSearchEngine(distinct=True)
+    engine.set_image(image)
+
+    checked = failed = 0
+    for min_distance in args.min_distance:
+        reference_engine.min_distance = engine.min_distance = min_distance
+        for x, y in clicks:
+            for lasso_points in (None, lasso):
+                ranked = [(m['x'], m['y']) for m in reference_engine.find_similar_colors(x, y, lasso_points)]
+                chosen = []
+                for px, py in ranked:
+                    if all((px - cx) ** 2 + (py - cy) ** 2 >= min_distance ** 2 for cx, cy in chosen):
+                        chosen.append((px, py))
+                for num in args.top:
+                    engine.num_similar = num
+                    result = [(m['x'], m['y']) for m in engine.find_similar_colors(x, y, lasso_points)]
+                    checked += 1
+                    if result != chosen[:num]:
+                        failed += 1
+                        print(f"FAIL min_distance={min_distance} top={num} click=({x}, {y}) "
+                              f"lasso={lasso_points is not None}: {len(result)} vs {len(chosen[:num])} locations",
+                              file=sys.stderr)
+    print(f"{checked - failed} / {checked} distinct searches match the greedy reference "
+          f"({args.width}x{args.height}, top {args.top}, min distance {args.min_distance})", file=sys.stderr)
+    return {'benchmark': 'distinct', 'size': [args.width, args.height], 'top': args.top,
+            'min_distance': args.min_distance, 'checked': checked, 'failed': failed, 'passed': failed == 0}
+
+
+def _query_clicks(image, samples, seed):
+    """查询基准用的取样点（随机点 + 已知色块内的点）与三角形套索"""
+    img_height, img_width = image.shape[:2]
+    rng = np.random.default_rng(seed)
+    clicks = [(int(rng.integers(img_width)), int(rng.integers(img_height))) for _ in range(samples)]
+    patch = max(4, min(img_height, img_width) // 12)
+    clicks += [(((i * 37) % 80) * (img_width - patch) // 80 + patch // 2,
+                i * 2 * img_height // (len(PATCH_COLORS) * 2) + patch // 2) for i in range(len(PATCH_COLORS))]
+    lasso = [(img_width // 10, img_height // 10), (img_width * 9 // 10, img_height // 10),
+             (img_width // 2, img_height * 9 // 10)]
+    return clicks, lasso
+
+
+def bench_coarse(args):
+    """由粗到细查找：与整图查找的耗时对比，并核对结果（slack=0 完全相同，否则色差误差不超过 slack）"""
+    image = synthetic_image(args.megapixels, seed=args.seed)
+    img_height, img_width = image.shape[:2]
+    start = time.perf_counter()
+    engine = ColorSearchEngine(num_similar=args.top, min_distance=args.min_distance, lab_mode=args.lab_mode,
+                               palette_index=False)
+    engine.set_image(image)
+    load_seconds = time.perf_counter() - start
+    exhaustive = ColorSearchEngine(num_similar=args.top, min_distance=args.min_distance, lab_mode=args.lab_mode,
+                                   coarse_to_fine=False, palette_index=False)
+    exhaustive.set_image(image)
+
+    clicks, lasso = _query_clicks(image, args.samples, args.seed)
+
+    results = []
+    passed = True
+    for slack in args.slack:
+        engine.coarse_slack = slack
+        coarse_times, full_times = [], []
+        max_excess = 0.0
+        identical = True
+        for x, y in clicks:
+            for lasso_points in (None, lasso):
+                begin = time.perf_counter()
+                coarse = engine.find_similar_colors(x, y, lasso_points)
+                coarse_times.append(time.perf_counter() - begin)
+                begin = time.perf_counter()
+                full = exhaustive.find_similar_colors(x, y, lasso_points)
+                full_times.append(time.perf_counter() - begin)
+
+                identical &= [(r['x'], r['y']) for r in coarse] == [(r['x'], r['y']) for r in full]
+                if len(coarse) != len(full):
+                    max_excess = float('inf')
+                    continue
+                for c, f in zip(coarse, full):
+                    max_excess = max(max_excess, c['distance'] - f['distance'])
+        ok = (identical if slack == 0 else max_excess <= slack + 1e-4)
+        passed &= ok
+        row = {'slack': slack, 'queries': len(coarse_times),
+               'coarse_median_ms': float(np.median(coarse_times)) * 1000,
+               'coarse_max_ms': max(coarse_times) * 1000,
+               'exhaustive_median_ms': float(np.median(full_times)) * 1000,
+               'identical': bool(identical), 'max_rank_excess_delta_e': max_excess, 'passed': bool(ok)}
+        results.append(row)
+        print(f"slack {slack:4.1f}  coarse median {row['coarse_median_ms']:7.1f} ms  max {row['coarse_max_ms']:7.1f} ms"
+              f"  exhaustive median {row['exhaustive_median_ms']:7.1f} ms  identical {identical}"
+              f"  rank excess ΔE {max_excess:.3f}  {'ok' if ok else 'FAIL'}", file=sys.stderr)
+
+    return {'benchmark': 'coarse', 'megapixels': img_height * img_width / 1e6, 'lab_mode': args.lab_mode,
+            'top': args.top, 'load_seconds': load_seconds, 'tiles_bytes': engine._tiles.nbytes,
+            'results': results, 'passed': bool(passed)}
+
+
+def bench_palette(args):
+    """颜色索引：构建耗时与每次查询耗时，与整图查找对比并核对结果完全相同"""
+    image = synthetic_image(args.megapixels, seed=args.seed)
+    img_height, img_width = image.shape[:2]
+    clicks, lasso = _query_clicks(image, args.samples, args.seed)
+
+    results = []
+    passed = True
+    for metric in args.metric:
+        engine = ColorSearchEngine(num_similar=args.top, min_distance=args.min_distance, metric=metric,
+                                   lab_mode=args.lab_mode, coarse_to_fine=False)
+        engine.set_image(image)
+        exhaustive = ColorSearchEngine(num_similar=args.top, min_distance=args.min_distance, metric=metric,
+                                       lab_mode=args.lab_mode, coarse_to_fine=False, palette_index=False)
+        exhaustive.set_image(image)
+        start = time.perf_counter()
+        engine.color_table()
+        engine.palette()
+        build_seconds = time.perf_counter() - start
+
+        palette_times, full_times = [], []
+        identical = True
+        for x, y in clicks:
+            for lasso_points in (None, lasso):
+                begin = time.perf_counter()
+                indexed = engine.find_similar_colors(x, y, lasso_points)
+                palette_times.append(time.perf_counter() - begin)
+                begin = time.perf_counter()
+                full = exhaustive.find_similar_colors(x, y, lasso_points)
+                full_times.append(time.perf_counter() - begin)
+                identical &= ([(r['x'], r['y'], r['distance']) for r in indexed] ==
+                              [(r['x'], r['y'], r['distance']) for r in full])
+        passed &= identical
+        row = {'metric': metric, 'queries': len(palette_times), 'colors': len(engine.color_table()),
+               'build_seconds': build_seconds, 'index_bytes': engine.palette().nbytes,
+               'palette_median_ms': float(np.median(palette_times)) * 1000,
+               'palette_max_ms': max(palette_times) * 1000,
+               'exhaustive_median_ms': float(np.median(full_times)) * 1000,
+               'identical': bool(identical)}
+        results.append(row)
+        print(f"{metric:9s}  build {build_seconds:5.2f} s  palette median {row['palette_median_ms']:7.2f} ms"
+              f"  max {row['palette_max_ms']:7.1f} ms  exhaustive median {row['exhaustive_median_ms']:7.1f} ms"
+              f"  {'ok' if identical else 'FAIL'}", file=sys.stderr)
+
+    return {'benchmark': 'palette', 'megapixels': img_height * img_width / 1e6, 'lab_mode': args.lab_mode,
+            'top': args.top, 'results': results, 'passed': bool(passed)}
+
+
+def bench_multi(args):
+    """多目标查找：一次查找K个目标与逐个整图查找K次的耗时对比，核对分类图和每个目标的前N名"""
+    image = synthetic_image(args.megapixels, seed=args.seed)
+    img_height, img_width = image.shape[:2]
+    rng = np.random.default_rng(args.seed)
+    engine = ColorSearchEngine(num_similar=args.top, min_distance=args.min_distance, metric=args.metric,
+                               lab_mode=args.lab_mode, coarse_to_fine=False)
+    engine.set_image(image)
+    exhaustive = ColorSearchEngine(num_similar=args.top, min_distance=args.min_distance, metric=args.metric,
+                                   lab_mode=args.lab_mode, coarse_to_fine=False, palette_index=False)
+    exhaustive.set_image(image)
+    start = time.perf_counter()
+    engine.palette()
+    build_seconds = time.perf_counter() - start
+
+    results = []
+    passed = True
+    dist = np.empty((img_height, img_width), dtype=np.float32)
+    scratch = np.empty_like(dist)
+    for count in args.targets:
+        # 已知色块颜色在前，其余为随机颜色
+        colors = (PATCH_COLORS + [tuple(int(c) for c in rng.integers(0, 256, 3)) for _ in range(count)])[:count]
+        samples = [{'type': 'color', 'rgb': color} for color in colors]
+        begin = time.perf_counter()
+        multi, labels = engine.find_multi_target(samples)
+        multi_seconds = time.perf_counter() - begin
+
+        # 逐个目标整图查找，同时逐像素求最近目标
+        begin = time.perf_counter()
+        expected = np.zeros((img_height, img_width), dtype=np.int16)
+        best = np.full((img_height, img_width), np.inf, dtype=np.float32)
+        identical = True
+        for k, sample in enumerate(samples):
+            target_lab_array = exhaustive.rgb_to_lab(sample['rgb'])
+            full = exhaustive._rank(target_lab_array, (0, 0, 0, False))
+            exhaustive._squared_distances(target_lab_array, dist, scratch)
+            closer = dist < best
+            best[closer] = dist[closer]
+            expected[closer] = k
+            identical &= ([(r['x'], r['y'], r['distance']) for r in multi[k]['matches']] ==
+                          [(r['x'], r['y'], r['distance']) for r in full])
+        exhaustive_seconds = time.perf_counter() - begin
+        identical &= bool(np.array_equal(labels, expected))
+        passed &= identical
+        row = {'targets': count, 'multi_ms': multi_seconds * 1000, 'exhaustive_ms': exhaustive_seconds * 1000,
+               'identical': bool(identical)}
+        results.append(row)
+        print(f"K={count:3d}  multi {row['multi_ms']:8.1f} ms  exhaustive {row['exhaustive_ms']:8.1f} ms"
+              f"  (x{exhaustive_seconds / multi_seconds:.1f})  {'ok' if identical else 'FAIL'}", file=sys.stderr)
+
+    return {'benchmark': 'multi', 'megapixels': img_height * img_width / 1e6, 'metric': args.metric,
+            'lab_mode': args.lab_mode, 'top': args.top, 'colors': len(engine.color_table()),
+            'build_seconds': build_seconds, 'results': results, 'passed': bool(passed)}
+
+
+def bench_swatches(args):
+    """参考色卡库：保存、冷加载、分类与估计读数的耗时，并核对分类结果与逐个色块计算相同"""
+    rng = np.random.default_rng(args.seed)
+    results = []
+    passed = True
+    with tempfile.TemporaryDirectory() as directory:
+        for count in args.swatches:
+            rgb = rng.integers(0, 256, (count, 3))
+            palette = SwatchPalette('bench', [str(i) for i in range(count)], rgb, values=np.arange(count) / count)
+            store = PaletteStore(directory)
+            store.save(palette)
+            # 每次用新的色卡库对象加载，不复用内存中的结果
+            load_times = []
+            for _ in range(args.repeat):
+                begin = time.perf_counter()
+                PaletteStore(directory).load('bench')
+                load_times.append(time.perf_counter() - begin)
+            load_seconds = float(np.median(load_times))
+            loaded = PaletteStore(directory).load('bench')
+            queries = srgb_to_lab(rng.integers(0, 256, (args.queries, 3)).astype(np.float64)).astype(np.float64)
+            row = {'swatches': count, 'load_ms': load_seconds * 1000}
+            for metric in METRICS:
+                begin = time.perf_counter()
+                nearest = [loaded.classify(lab, metric, count=1)[0]['index'] for lab in queries]
+                row[f'{metric}_classify_us'] = (time.perf_counter() - begin) / len(queries) * 1e6
+                begin = time.perf_counter()
+                for lab in queries:
+                    loaded.estimate(lab, metric)
+                row[f'{metric}_estimate_us'] = (time.perf_counter() - begin) / len(queries) * 1e6
+                expected = [int(np.argmin([float(delta_e(lab, reference, metric)) for reference in palette.lab]))
+                            for lab in queries[:50]]
+                passed &= nearest[:50] == expected
+            passed &= np.array_equal(loaded.lab, palette.lab)
+            results.append(row)
+            print(f"{count:4d} swatches  load {row['load_ms']:6.2f} ms  classify "
+                  + "  ".join(f"{m} {row[f'{m}_classify_us']:6.1f} us" for m in METRICS), file=sys.stderr)
+    return {'benchmark': 'swatches', 'results': results, 'passed': bool(passed)}
+
+
+def bench_view(args):
+    """视图渲染：整图 LANCZOS 缩放（原来的做法）与只渲染可见部分（快速 / 高质量）的每帧耗时"""
+    image = Image.fromarray(synthetic_image(args.megapixels, seed=args.seed))
+    img_width, img_height = image.size
+    view_width, view_height = args.viewport
+    base_scale = min(view_width / img_width, view_height / img_height) * 0.95
+    pyramid = ImagePyramid(image)
+    results = []
+    for zoom in args.zoom:
+        scale = base_scale * zoom
+        new_width, new_height = int(img_width * scale), int(img_height * scale)
+        offset_x = view_width // 2 - new_width // 2
+        offset_y = view_height // 2 - new_height // 2
+        begin = time.perf_counter()
+        image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        row = {'zoom': zoom, 'full_resize_ms': (time.perf_counter() - begin) * 1000}
+        for name, fast in (('fast', True), ('quality', False)):
+            # 第一次构建金字塔层，之后的帧复用
+            render_view(pyramid, scale, offset_x, offset_y, view_width, view_height, fast)
+            times = []
+            for step in range(args.repeat):
+                begin = time.perf_counter()
+                render_view(pyramid, scale, offset_x + step * 7, offset_y + step * 5, view_width, view_height, fast)
+                times.append(time.perf_counter() - begin)
+            row[f'{name}_ms'] = float(np.median(times)) * 1000
+        results.append(row)
+        print(f"zoom {zoom:5.1f}  full resize {row['full_resize_ms']:8.1f} ms  viewport fast {row['fast_ms']:6.1f} ms"
+              f"  quality {row['quality_ms']:6.1f} ms", file=sys.stderr)
+    return {'benchmark': 'view', 'megapixels': img_width * img_height / 1e6, 'viewport': [view_width, view_height],
+            'results': results}
+
+
+class _SimulatedLoop:
+    """模拟 Tk 事件循环（先处理到达的输入事件，再处理到期的 after，最后处理 after_idle），
+    时钟按事件到达时间和回调的实际耗时推进"""
+
+    def __init__(self):
+        self.now = 0.0
+        self._timers = []  # (到期时间, 序号, 函数)
+        self._idle = []
+        self._cancelled = set()
+        self._ids = itertools.count()
+
+    def clock(self):
+        return self.now
+
+    def after(self, ms, func):
+        job = next(self._ids)
+        heapq.heappush(self._timers, (self.now + ms / 1000, job, func))
+        return job
+
+    def after_idle(self, func):
+        job = next(self._ids)
+        self._idle.append((job, func))
+        return job
+
+    def cancel(self, job):
+        self._cancelled.add(job)
+
+    def _call(self, job, func):
+        if job in self._cancelled:
+            return
+        begin = time.perf_counter()
+        func()
+        self.now += time.perf_counter() - begin
+
+    def run(self, events, handler):
+        """按时间处理 events（到达时间列表），每个事件调用 handler(序号)"""
+        pending = 0
+        while True:
+            if pending < len(events) and events[pending] <= self.now:
+                self._call(None, lambda i=pending: handler(i))
+                pending += 1
+            elif self._timers and self._timers[0][0] <= self.now:
+                _, job, func = heapq.heappop(self._timers)
+                self._call(job, func)
+            elif self._idle:
+                idle, self._idle = self._idle, []
+                for job, func in idle:
+                    self._call(job, func)
+            else:
+                upcoming = [t for t in (events[pending] if pending < len(events) else None,
+                                        self._timers[0][0] if self._timers else None) if t is not None]
+                if not upcoming:
+                    return
+                self.now = max(self.now, min(upcoming))
+
+
+def bench_frames(args):
+    """帧调度：以给定频率到达的拖动平移事件，逐个事件渲染与按帧合并渲染的绘制次数、总耗时和最后一帧的延迟"""
+    image = Image.fromarray(synthetic_image(args.megapixels, seed=args.seed))
+    img_width, img_height = image.size
+    view_width, view_height = args.viewport
+    scale = min(view_width / img_width, view_height / img_height) * 0.95 * args.zoom
+    pyramid = ImagePyramid(image)
+    render_view(pyramid, scale, 0, 0, view_width, view_height, fast=True)
+
+    results = []
+    for rate in args.rate:
+        events = [i / rate for i in range(int(args.seconds * rate))]
+        for mode in ('per-event', 'coalesced'):
+            loop = _SimulatedLoop()
+            view = {'x': 0.0, 'frames': 0, 'last': 0.0}
+
+            def draw():
+                # 平移后可见部分全部重新渲染（最坏情况）
+                render_view(pyramid, scale, -view['x'], -view['x'], view_width, view_height, fast=True, margin=0)
+                view['frames'] += 1
+                view['last'] = loop.now
+
+            scheduler = FrameScheduler(loop.after, loop.after_idle, loop.cancel, draw,
+                                       interval=args.frame_ms / 1000, clock=loop.clock)
+
+            def handler(i):
+                view['x'] += 3
+                if mode == 'per-event':
+                    draw()
+                else:
+                    scheduler.request()
+
+            loop.run(events, handler)
+            row = {'rate': rate, 'mode': mode, 'events': len(events), 'frames': view['frames'],
+                   'elapsed_s': loop.now, 'latency_ms': (loop.now - events[-1]) * 1000}
+            results.append(row)
+            print(f"{rate:6d} events/s  {mode:9s}  frames {row['frames']:5d} / {row['events']:5d} events  "
+                  f"elapsed {row['elapsed_s']:6.2f} s  last-event latency {row['latency_ms']:8.1f} ms", file=sys.stderr)
+    return {'benchmark': 'frames', 'megapixels': img_width * img_height / 1e6, 'viewport': [view_width, view_height],
+            'frame_ms': args.frame_ms, 'results': results}
+
+
+def _proc_status_mb(field):
+    """/proc/self/status 中的内存字段（MB），不支持时返回None"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    """重置本进程的峰值常驻内存（Linux clear_refs），成功返回True"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _measure_stream(path, samples, engine_options, memory_budget):
+    """在独立进程中流式查找，返回耗时与查找期间峰值内存相对查找前常驻内存的增量
+
+    ru_maxrss 会保留 exec 之前父进程的峰值，这里使用 /proc 的 VmRSS / VmHWM 并先重置峰值。
+    """
+    engine = ColorSearchEngine(**engine_options)
+    baseline_mb = _proc_status_mb('VmRSS')
+    if baseline_mb is None or not _reset_peak_rss():
+        baseline_mb = peak_rss_mb()
+    start = time.perf_counter()
+    results = stream_search(engine, path, samples, memory_budget=memory_budget)
+    seconds = time.perf_counter() - start
+    peak_mb = _proc_status_mb('VmHWM') or peak_rss_mb()
+    return {'seconds': seconds, 'baseline_rss_mb': baseline_mb, 'peak_rss_mb': peak_mb, 'results': results}
+
+
+# 基准套件结果格式的版本（阶段名称或测量方式改变时加1，不同版本的结果不比较）
+SUITE_VERSION = 1
+
+
+def _stage(report, name, func, repeat=1, per=1):
+    """运行 func repeat 次，记录每次耗时的中位数（除以 per，如查询次数）和峰值常驻内存相对开始前的增量
+
+    峰值用 /proc 的 VmHWM（先重置），不支持时 peak_mb 为None。返回最后一次的结果。
+    """
+    baseline_mb = _proc_status_mb('VmRSS')
+    reset = baseline_mb is not None and _reset_peak_rss()
+    times = []
+    result = None
+    for _ in range(repeat):
+        result = None
+        begin = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - begin)
+    peak_mb = _proc_status_mb('VmHWM') if reset else None
+    report[name] = {'ms': float(np.median(times)) * 1000 / per,
+                    'peak_mb': None if peak_mb is None else max(0.0, peak_mb - baseline_mb)}
+    return result
+
+
+def _suite_case(jpeg_path, png_path, samples, repeat, seed, viewport):
+    """在独立进程中测量一种尺寸的各阶段：解码、Lab转换、加载、查询、缩放渲染"""
+    report = {}
+    rgb = _stage(report, 'decode_jpeg', lambda: np.asarray(Image.open(jpeg_path).convert('RGB')), repeat)
+    _stage(report, 'decode_png', lambda: np.asarray(Image.open(png_path).convert('RGB')), repeat)
+    _stage(report, 'lab_float32', lambda rgb=rgb: srgb_to_lab(rgb, 'float32'), repeat)
+    del rgb
+
+    # 界面打开大图时先显示的预览（JPEG 草稿模式缩小解码 + 预览的Lab）
+    preview_engine = ColorSearchEngine()
+    _stage(report, 'preview_jpeg',
+           lambda engine=preview_engine: engine.load_preview(jpeg_path, engine.preview_factor(jpeg_path)), repeat)
+    del preview_engine
+
+    # 加载（解码 + Lab + 块上下界），之后的查询在同一个引擎上进行
+    engine = ColorSearchEngine(num_similar=10, min_distance=20)
+    image = _stage(report, 'load', lambda: engine.load_image(png_path))
+    img_height, img_width = engine.image_array.shape[:2]
+    clicks, lasso = _query_clicks(engine.image_array, samples, seed)
+    radius = max(3, min(img_height, img_width) // 200)
+    _stage(report, 'index_build', lambda: engine.palette())
+
+    # indexed 为默认查找（颜色索引、由粗到细），scan 为整图查找（按行条带多线程）
+    for mode, indexed in (('indexed', True), ('scan', False)):
+        engine.palette_index = engine.coarse_to_fine = indexed
+        for kind in ('point', 'circle'):
+            for lasso_points in (None, lasso):
+                def queries():
+                    for x, y in clicks:
+                        engine.forget_distances()
+                        if kind == 'point':
+                            engine.find_similar_colors(x, y, lasso_points)
+                        else:
+                            engine.find_similar_colors_by_circle(x, y, radius, lasso_points)
+                name = f"{mode}_{kind}" + ('_lasso' if lasso_points else '')
+                _stage(report, name, queries, per=len(clicks))
+
+    # 渲染：原来的整图 LANCZOS 缩放，以及只渲染可见部分（适应画布与放大4倍，快速 / 高质量）
+    view_width, view_height = viewport
+    base_scale = min(view_width / img_width, view_height / img_height) * 0.95
+    _stage(report, 'resize_full', lambda: image.resize((int(img_width * base_scale), int(img_height * base_scale)),
+                                                       Image.Resampling.LANCZOS), repeat)
+    pyramid = ImagePyramid(image)
+    _stage(report, 'pyramid_build', lambda: pyramid.level(choose_level(base_scale, pyramid.max_level())))
+    for zoom in (1, 4):
+        scale = base_scale * zoom
+        offset_x = view_width // 2 - int(img_width * scale) // 2
+        offset_y = view_height // 2 - int(img_height * scale) // 2
+        for name, fast in (('fast', True), ('quality', False)):
+            _stage(report, f'render_{name}_zoom{zoom}',
+                   lambda: render_view(pyramid, scale, offset_x, offset_y, view_width, view_height, fast), repeat)
+    report['process_peak_rss_mb'] = {'ms': None, 'peak_mb': peak_rss_mb()}
+    return report
+
+
+def _environment():
+    """影响结果的环境信息（比较时不同会给出提示）"""
+    return {'platform': platform.platform(), 'python': platform.python_version(), 'numpy': np.__version__,
+            'opencv': cv2.__version__, 'pillow': PIL.__version__, 'cpu_count': os.cpu_count()}
+
+
+def bench_suite(args):
+    """基准套件：每种尺寸的合成图片在独立进程中测量各阶段耗时与峰值内存，结果可用 compare 对比"""
+    context = multiprocessing.get_context('spawn')
+    cases = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for megapixels in args.megapixels:
+            image = Image.fromarray(synthetic_image(megapixels, seed=args.seed))
+            jpeg_path = os.path.join(directory, 'suite.jpg')
+            png_path = os.path.join(directory, 'suite.png')
+            image.save(jpeg_path, quality=90)
+            image.save(png_path, compress_level=1)
+            del image
+            with context.Pool(1) as pool:
+                stages = pool.apply(_suite_case, (jpeg_path, png_path, args.samples, args.repeat, args.seed,
+                                                  args.viewport))
+            cases[f'{megapixels:g}'] = stages
+            print(f"{megapixels:g} MP", file=sys.stderr)
+            for name, value in stages.items():
+                ms = '' if value['ms'] is None else f"{value['ms']:10.1f} ms"
+                peak = '' if value['peak_mb'] is None else f"{value['peak_mb']:9.1f} MB"
+                print(f"  {name:22s} {ms:13s} {peak}", file=sys.stderr)
+    return {'benchmark': 'suite', 'version': SUITE_VERSION, 'environment': _environment(),
+            'settings': {'samples': args.samples, 'repeat': args.repeat, 'seed': args.seed,
+                         'viewport': list(args.viewport)},
+            'cases': cases}
+
+
+def bench_compare(args):
+    """对比两次 suite 的结果：耗时或峰值内存超过阈值（且超过绝对噪声下限）的阶段记为退化"""
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.current, encoding='utf-8') as f:
+        current = json.load(f)
+    if baseline.get('version') != current.get('version'):
+        raise SystemExit(f"结果版本不同 Suite versions differ: {baseline.get('version')} vs {current.get('version')}")
+    for key, value in current.get('environment', {}).items():
+        if baseline.get('environment', {}).get(key) != value:
+            print(f"warning: environment differs: {key} {baseline['environment'].get(key)!r} -> {value!r}",
+                  file=sys.stderr)
+
+    rows = []
+    for size, stages in current['cases'].items():
+        for name, new in stages.items():
+            old = baseline['cases'].get(size, {}).get(name)
+            if old is None:
+                continue
+            row = {'megapixels': size, 'stage': name, 'baseline_ms': old['ms'], 'current_ms': new['ms'],
+                   'baseline_peak_mb': old['peak_mb'], 'current_peak_mb': new['peak_mb'], 'regressions': []}
+            if old['ms'] is not None and new['ms'] is not None:
+                row['time_ratio'] = new['ms'] / old['ms'] if old['ms'] > 0 else None
+                if new['ms'] > old['ms'] * (1 + args.threshold) and new['ms'] - old['ms'] > args.min_ms:
+                    row['regressions'].append('time')
+            if old['peak_mb'] is not None and new['peak_mb'] is not None:
+                if (new['peak_mb'] > old['peak_mb'] * (1 + args.memory_threshold)
+                        and new['peak_mb'] - old['peak_mb'] > args.min_mb):
+                    row['regressions'].append('memory')
+            rows.append(row)
+            ratio = f"x{row['time_ratio']:.2f}" if row.get('time_ratio') else ''
+            flag = ' '.join(r.upper() for r in row['regressions']) or 'ok'
+            old_ms = '' if old['ms'] is None else f"{old['ms']:9.1f}"
+            new_ms = '' if new['ms'] is None else f"{new['ms']:9.1f}"
+            # 套件按图片尺寸分组，startup 的结果只有一组 'startup'
+            case = f"{size} MP" if size.replace('.', '', 1).isdigit() else size
+            print(f"{case:>8s}  {name:22s} {old_ms:>9s} -> {new_ms:>9s} ms {ratio:>7s}  {flag}", file=sys.stderr)
+
+    regressions = sum(1 for row in rows if row['regressions'])
+    print(f"{regressions} regression(s) in {len(rows)} stages "
+          f"(time +{args.threshold:.0%} and > {args.min_ms:g} ms, memory +{args.memory_threshold:.0%} "
+          f"and > {args.min_mb:g} MB)", file=sys.stderr)
+    return {'benchmark': 'compare', 'baseline': args.baseline, 'current': args.current,
+            'threshold': args.threshold, 'memory_threshold': args.memory_threshold,
+            'results': rows, 'regressions': regressions, 'passed': regressions == 0}
+
+
+def bench_stream(args):
+    """流式查找：小图上核对与整图查找结果一致，大图（未压缩PPM）上检查峰值内存增量不超过预算"""
+    samples = [{'type': 'point', 'x': 100, 'y': 120}, {'type': 'circle', 'x': 600, 'y': 400, 'radius': 9}]
+    budget = args.budget_mb * 1024 ** 2
+    context = multiprocessing.get_context('spawn')
+    passed = True
+    report = {'benchmark': 'stream', 'budget_mb': args.budget_mb}
+
+    with tempfile.TemporaryDirectory() as directory:
+        # 结果一致性（条带很矮，跨越多个条带边界）
+        image = synthetic_image(2.0, seed=args.seed)
+        path = os.path.join(directory, 'small.ppm')
+        Image.fromarray(image).save(path)
+        agree = True
+        for match_mode in ('pixels', 'regions'):
+            engine = ColorSearchEngine(num_similar=args.top, min_distance=20, match_mode=match_mode,
+                                       coarse_to_fine=False)
+            engine.set_image(image)
+            expected = [engine.find_similar_colors(100, 120), engine.find_similar_colors_by_circle(600, 400, 9)]
+            streamed = stream_search(engine, path, samples, memory_budget=12 * 1024 ** 2)
+            for full, strip in zip(expected, streamed):
+                agree &= ([(m['x'], m['y'], m.get('area')) for m in full] ==
+                          [(m['x'], m['y'], m.get('area')) for m in strip['matches']])
+                agree &= np.allclose([m['distance'] for m in full], [m['distance'] for m in strip['matches']],
+                                     atol=1e-4)
+        print(f"streamed results agree with in-memory search: {agree}", file=sys.stderr)
+        report['results_agree'] = bool(agree)
+        passed &= agree
+        del image, engine
+
+        # 内存预算：大图写为PPM后释放，在新进程中流式查找
+        image = synthetic_image(args.megapixels, seed=args.seed)
+        path = os.path.join(directory, 'large.ppm')
+        Image.fromarray(image).save(path)
+        image_mb = image.nbytes / 1024 ** 2
+        del image
+        rows = []
+        for match_mode in ('pixels', 'regions'):
+            options = {'num_similar': args.top, 'min_distance': 20, 'match_mode': match_mode}
+            with context.Pool(1) as pool:
+                measured = pool.apply(_measure_stream, (path, samples, options, budget))
+            growth = measured['peak_rss_mb'] - measured['baseline_rss_mb']
+            ok = growth <= args.budget_mb
+            passed &= ok
+            rows.append({'match_mode': match_mode, 'seconds': measured['seconds'],
+                         'rss_growth_mb': growth, 'within_budget': bool(ok)})
+            print(f"{match_mode:7s} {args.megapixels:.0f} MP (decoded {image_mb:.0f} MB)  "
+                  f"{measured['seconds']:6.2f}s  RSS growth {growth:7.1f} MB / budget {args.budget_mb} MB  "
+                  f"{'ok' if ok else 'OVER BUDGET'}", file=sys.stderr)
+        report['results'] = rows
+
+    report['megapixels'] = args.megapixels
+    report['passed'] = bool(passed)
+    return report
+
+
+def bench_trace(args):
+    """分阶段跟踪的开销：同一组点击在跟踪关闭、只计时、计时加内存三种设置下交替执行，核对结果相同"""
+    results = []
+    passed = True
+    for megapixels in args.megapixels:
+        settings = [('off', Tracer(enabled=False)), ('timing', Tracer(enabled=True, memory=False)),
+                    ('memory', Tracer(enabled=True, memory=True))]
+        image = synthetic_image(megapixels, seed=args.seed)
+        clicks, lasso = _query_clicks(image, args.samples, args.seed)
+        engine = ColorSearchEngine(num_similar=args.top, min_distance=args.min_distance, coarse_slack=1.0)
+        engine.set_image(image)
+        # 先构建颜色索引等按需数据，只测查找本身
+        engine.find_similar_colors(*clicks[0])
+        times = {name: [] for name, _ in settings}
+        outputs = {name: [] for name, _ in settings}
+        for _ in range(args.repeat):
+            for x, y in clicks:
+                for lasso_points in (None, lasso):
+                    for name, tracer in settings:
+                        engine.tracer = tracer
+                        engine.forget_distances()
+                        begin = time.perf_counter()
+                        outputs[name].append(engine.find_similar_colors(x, y, lasso_points))
+                        times[name].append(time.perf_counter() - begin)
+        base = float(np.median(times['off']))
+        print(f"{megapixels:g} MP, {len(times['off'])} queries", file=sys.stderr)
+        for name, tracer in settings:
+            identical = outputs[name] == outputs['off']
+            passed &= identical
+            median = float(np.median(times[name]))
+            row = {'megapixels': megapixels, 'setting': name, 'queries': len(times[name]),
+                   'median_ms': median * 1000, 'overhead': median / base - 1,
+                   'events': len(tracer.events), 'identical': bool(identical)}
+            results.append(row)
+            print(f"  {name:<7} median {row['median_ms']:8.3f} ms  overhead {row['overhead']:+7.1%}"
+                  f"  events {row['events']:6d}  {'ok' if identical else 'FAIL'}", file=sys.stderr)
+        stages = settings[1][1].summary()
+        for stage, stats in stages.items():
+            print(f"    {stage:<14} x{stats['count']:<5d} mean {stats['mean_ms']:8.3f} ms", file=sys.stderr)
+        if args.export:
+            settings[2][1].export_chrome(args.export)
+    return {'benchmark': 'trace', 'top': args.top, 'results': results, 'passed': bool(passed)}
+
+
+# 启动测量的子进程脚本：只导入被测模块（不导入本文件），报告导入耗时、就绪时刻（距父进程启动子进程）、
+# 就绪时的常驻内存，以及已载入的重依赖。mode：import=导入模块，query=引擎载入图片并完成第一次查询，
+# window=创建界面窗口直到显示出来（没有显示环境时报告错误）
+_STARTUP_PROBE = r"""
+import json, os, sys, time
+launched, mode, target, heavy = float(sys.argv[1]), sys.argv[2], sys.argv[3], sys.argv[4].split(',')
+begin = time.perf_counter()
+report = {}
+try:
+    if mode == 'import':
+        for name in target.split(','):
+            __import__(name)
+        report['import_ms'] = (time.perf_counter() - begin) * 1000
+    elif mode == 'query':
+        from color_match_engine import ColorSearchEngine
+        report['import_ms'] = (time.perf_counter() - begin) * 1000
+        engine = ColorSearchEngine(num_similar=10, min_distance=20)
+        start = time.perf_counter()
+        engine.load_image(target)
+        report['load_ms'] = (time.perf_counter() - start) * 1000
+        x, y = engine.size[0] // 2, engine.size[1] // 2
+        start = time.perf_counter()
+        engine.find_similar_colors(x, y)
+        report['query_ms'] = (time.perf_counter() - start) * 1000
+        report['ready_s'] = time.time() - launched
+        engine.forget_distances()
+        start = time.perf_counter()
+        engine.find_similar_colors(x, y)
+        report['second_query_ms'] = (time.perf_counter() - start) * 1000
+    elif mode == 'window':
+        import tkinter as tk
+        import color_match_app
+        report['import_ms'] = (time.perf_counter() - begin) * 1000
+        root = tk.Tk()
+        app = color_match_app.ColorSimilarityApp(root)
+        deadline = time.perf_counter() + 10
+        root.update()
+        while not root.winfo_viewable() and time.perf_counter() < deadline:
+            root.update()
+        report['ready_s'] = time.time() - launched
+        root.destroy()
+except Exception as exc:
+    report['error'] = f"{type(exc).__name__}: {exc}"
+report.setdefault('ready_s', time.time() - launched)
+try:
+    with open('/proc/self/statm') as f:
+        report['rss_mb'] = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+except (OSError, ValueError, AttributeError):
+    report['rss_mb'] = None
+report['modules'] = [name for name in heavy if name in sys.modules]
+print(json.dumps(report), flush=True)
+os._exit(0)
+"""
+
+# 启动时不应载入的重依赖：导入后出现在 sys.modules 中即为退化（colormath 曾在界面顶层导入，已不再使用）
+STARTUP_HEAVY = ('tkinter', 'cv2', 'colormath')
+STARTUP_FORBIDDEN = {
+    'color_match_engine': ('tkinter', 'cv2', 'colormath'),
+    'color_match_stream': ('tkinter', 'cv2', 'colormath'),
+    'color_match_cli': ('tkinter', 'cv2', 'colormath'),
+    'color_match_app': ('cv2', 'colormath'),
+}
+
+# 导入耗时的测量：(阶段名, 导入的模块, 作为对照的依赖阶段)；本仓库模块的耗时减去必需依赖的耗时即为自身的开销
+STARTUP_IMPORTS = (
+    ('import_deps', 'numpy,PIL.Image', None),
+    ('import_engine', 'color_match_engine', 'import_deps'),
+    ('import_stream', 'color_match_stream', 'import_deps'),
+    ('import_cli', 'color_match_cli', 'import_deps'),
+    ('import_tk_deps', 'tkinter,numpy,PIL.ImageTk', None),
+    ('import_app', 'color_match_app', 'import_tk_deps'),
+)
+
+
+def _startup_probe(mode, target):
+    """在新的 Python 进程中运行启动测量脚本，返回其报告（失败时含 'error'）"""
+    launched = time.time()
+    process = subprocess.run([sys.executable, '-c', _STARTUP_PROBE, repr(launched), mode, target,
+                              ','.join(STARTUP_HEAVY)],
+                             cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True,
+                             timeout=300)
+    lines = process.stdout.strip().splitlines()
+    if process.returncode != 0 or not lines:
+        message = (process.stderr.strip().splitlines() or ['exit status %d' % process.returncode])[-1]
+        return {'error': message}
+    return json.loads(lines[-1])
+
+
+def bench_startup(args):
+    """冷启动：新进程中各模块的导入耗时、从启动进程到窗口显示、到第一次查询完成的时间
+
+    检查导入引擎、流式查找、命令行时没有载入 tkinter / cv2，且各模块自身的导入开销（减去必需依赖）
+    不超过 --max-overhead-ms。各阶段取 --repeat 次的中位数（各测量交替进行），peak_mb 为就绪时的常驻内存；
+    结果可用 compare 对比。先编译 .pyc，测的是有字节码缓存时（安装后）的启动。
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    compileall.compile_dir(here, maxlevels=0, quiet=1)
+    passed = True
+    stages = {}
+    checks = []
+
+    def record(name, reports, key, scale=1.0):
+        values = [r[key] * scale for r in reports if r.get(key) is not None]
+        rss = [r['rss_mb'] for r in reports if r.get('rss_mb') is not None]
+        stages[name] = {'ms': float(np.median(values)) if values else None,
+                        'peak_mb': float(np.median(rss)) if rss else None}
+
+    # 导入：每轮依次启动各个进程，减小机器负载变化对对照的影响
+    reports = {name: [] for name, _, _ in STARTUP_IMPORTS}
+    for _ in range(args.repeat):
+        for name, modules, _ in STARTUP_IMPORTS:
+            reports[name].append(_startup_probe('import', modules))
+    for name, modules, deps in STARTUP_IMPORTS:
+        errors = [r['error'] for r in reports[name] if 'error' in r]
+        if errors:
+            print(f"  {name:22s} skipped: {errors[0]}", file=sys.stderr)
+            continue
+        record(name, reports[name], 'import_ms')
+        forbidden = sorted(set(reports[name][-1]['modules']) & set(STARTUP_FORBIDDEN.get(modules, ())))
+        overhead = None
+        if deps in stages and stages[deps]['ms'] is not None:
+            overhead = stages[name]['ms'] - stages[deps]['ms']
+        ok = not forbidden and (overhead is None or overhead <= args.max_overhead_ms)
+        passed &= ok
+        checks.append({'stage': name, 'modules': modules, 'loaded_heavy': reports[name][-1]['modules'],
+                       'forbidden': forbidden, 'overhead_ms': overhead, 'passed': bool(ok)})
+        extra = '' if overhead is None else f"  own {overhead:+7.1f} ms"
+        loaded = ','.join(reports[name][-1]['modules']) or '-'
+        print(f"  {name:22s} {stages[name]['ms']:8.1f} ms{extra:18s} RSS {stages[name]['peak_mb']:6.1f} MB  "
+              f"heavy: {loaded:16s} {'ok' if ok else 'FAIL'}", file=sys.stderr)
+    # 从启动进程到引擎导入完成（含解释器自身的启动）
+    record('process_import_engine', reports['import_engine'], 'ready_s', 1000)
+    print(f"  {'process_import_engine':22s} {stages['process_import_engine']['ms']:8.1f} ms", file=sys.stderr)
+
+    # 从启动进程到第一次查询完成（引擎载入合成图片并在图片中心查询一次）
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'startup.png')
+        Image.fromarray(synthetic_image(args.megapixels, seed=args.seed)).save(path, compress_level=1)
+        queries = [_startup_probe('query', path) for _ in range(args.repeat)]
+    errors = [r['error'] for r in queries if 'error' in r]
+    if errors:
+        passed = False
+        print(f"  first query failed: {errors[0]}", file=sys.stderr)
+    else:
+        for name, key, scale in (('time_to_first_query', 'ready_s', 1000), ('first_load', 'load_ms', 1),
+                                 ('first_query', 'query_ms', 1), ('second_query', 'second_query_ms', 1)):
+            record(name, queries, key, scale)
+            print(f"  {name:22s} {stages[name]['ms']:8.1f} ms", file=sys.stderr)
+
+    # 从启动进程到界面窗口显示（需要显示环境）
+    windows = [_startup_probe('window', 'color_match_app') for _ in range(args.repeat)]
+    errors = [r['error'] for r in windows if 'error' in r]
+    if errors:
+        print(f"  {'time_to_window':22s} skipped: {errors[0]}", file=sys.stderr)
+    else:
+        record('time_to_window', windows, 'ready_s', 1000)
+        print(f"  {'time_to_window':22s} {stages['time_to_window']['ms']:8.1f} ms", file=sys.stderr)
+
+    print(f"startup checks {'passed' if passed else 'FAILED'} (own import overhead <= {args.max_overhead_ms:g} ms, "
+          f"no tkinter/cv2 without the GUI or a query)", file=sys.stderr)
+    return {'benchmark': 'startup', 'version': SUITE_VERSION, 'environment': _environment(),
+            'settings': {'repeat': args.repeat, 'megapixels': args.megapixels,
+                         'max_overhead_ms': args.max_overhead_ms},
+            'cases': {'startup': stages}, 'checks': checks, 'passed': bool(passed)}
+
+
+def build_parser():
+    """命令行参数"""
+    parser = argparse.ArgumentParser(description="颜色比对性能基准 Color match benchmarks")
+    parser.add_argument('-o', '--output', default=None, help="结果JSON文件 Write results as JSON")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    batch = subparsers.add_parser('batch', help="多进程批处理扩展性 Batch scaling across processes")
+    batch.add_argument('--images', type=int, default=64, help="图片数量 (default: 64)")
+    batch.add_argument('--megapixels', type=float, default=2.0, help="每张图片百万像素 (default: 2)")
+    batch.add_argument('--format', default='png', choices=('png', 'jpg', 'bmp'))
+    batch.add_argument('--max-workers', type=int, default=0, help="最大工作进程数，0=全部核心")
+    batch.add_argument('--unordered', action='store_true', help="按完成顺序取结果")
+    batch.set_defaults(func=bench_batch)
+
+    parity = subparsers.add_parser('parity', help="sRGB→Lab 与 cv2 一致性 Lab parity against cv2")
+    parity.add_argument('--step', type=int, default=1, help="RGB取值步长，1=全部1677万色 (default: 1)")
+    parity.add_argument('--tolerance-max', type=float, default=0.6, help="最大 ΔE76 容差 (default: 0.6)")
+    parity.add_argument('--tolerance-mean', type=float, default=0.2, help="平均 ΔE76 容差 (default: 0.2)")
+    parity.set_defaults(func=bench_parity)
+
+    lab_modes = subparsers.add_parser('lab-modes', help="Lab存储方式的误差与内存 Lab storage modes")
+    lab_modes.add_argument('--megapixels', type=float, default=8.0, help="图片百万像素 (default: 8)")
+    lab_modes.add_argument('--samples', type=int, default=5, help="随机取样点数量 (default: 5)")
+    lab_modes.add_argument('--top', type=int, default=20, help="比较的 top-N (default: 20)")
+    lab_modes.add_argument('--seed', type=int, default=0)
+    lab_modes.set_defaults(func=bench_lab_modes)
+
+    query = subparsers.add_parser('query', help="单次查询内核 Query kernel time and temporaries")
+    query.add_argument('--megapixels', type=float, default=12.0, help="图片百万像素 (default: 12)")
+    query.add_argument('--top', type=int, default=20, help="相似位置数量 (default: 20)")
+    query.add_argument('--min-distance', type=int, default=20)
+    query.add_argument('--lasso', type=float, nargs='?', const=0.8, default=None, metavar='SIZE',
+                       help="加上三角形套索范围，SIZE 为相对图片宽高的大小 (default: 0.8)")
+    query.add_argument('--repeat', type=int, default=3)
+    query.add_argument('--seed', type=int, default=0)
+    query.set_defaults(func=bench_query)
+
+    coarse = subparsers.add_parser('coarse', help="由粗到细查找 Coarse-to-fine search vs exhaustive")
+    coarse.add_argument('--megapixels', type=float, default=24.0, help="图片百万像素 (default: 24)")
+    coarse.add_argument('--top', type=int, default=20, help="相似位置数量 (default: 20)")
+    coarse.add_argument('--min-distance', type=int, default=20)
+    coarse.add_argument('--slack', type=float, nargs='+', default=[0.0, 1.0],
+                        help="允许的色差误差 ΔE，0=精确 (default: 0 1)")
+    coarse.add_argument('--lab-mode', choices=LAB_MODES, default='float32')
+    coarse.add_argument('--samples', type=int, default=8, help="随机取样点数量 (default: 8)")
+    coarse.add_argument('--seed', type=int, default=0)
+    coarse.set_defaults(func=bench_coarse)
+
+    threads = subparsers.add_parser('threads', help="条带多线程 Thread-parallel row bands within one image")
+    threads.add_argument('--megapixels', type=float, default=50.0, help="图片百万像素 (default: 50)")
+    threads.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8, 16],
+                         help="线程数，第一个作为基准 Thread counts, the first is the baseline (default: 1 2 4 8 16)")
+    threads.add_argument('--samples', type=int, default=4, help="随机取样点数量 (default: 4)")
+    threads.add_argument('--top', type=int, default=10)
+    threads.add_argument('--min-distance', type=int, default=20)
+    threads.add_argument('--metric', choices=METRICS, default='cie76')
+    threads.add_argument('--distinct', action='store_true')
+    threads.add_argument('--seed', type=int, default=0)
+    threads.set_defaults(func=bench_threads)
+
+    distinct = subparsers.add_parser('distinct', help="不同位置模式的正确性 Distinct mode vs greedy reference")
+    distinct.add_argument('--width', type=int, default=60)
+    distinct.add_argument('--height', type=int, default=40)
+    distinct.add_argument('--top', type=int, nargs='+', default=[0, 1, 5, 20, 5000],
+                          help="相似位置数量，含0和超过可选数量 (default: 0 1 5 20 5000)")
+    distinct.add_argument('--min-distance', type=int, nargs='+', default=[0, 1, 3, 8],
+                          help="最小间距 (default: 0 1 3 8)")
+    distinct.add_argument('--samples', type=int, default=4, help="随机取样点数量 (default: 4)")
+    distinct.add_argument('--seed', type=int, default=0)
+    distinct.set_defaults(func=bench_distinct)
+
+    palette = subparsers.add_parser('palette', help="颜色索引 Palette index vs exhaustive")
+    palette.add_argument('--megapixels', type=float, default=12.0, help="图片百万像素 (default: 12)")
+    palette.add_argument('--top', type=int, default=20, help="相似位置数量 (default: 20)")
+    palette.add_argument('--min-distance', type=int, default=20)
+    palette.add_argument('--metric', choices=METRICS, nargs='+', default=list(METRICS),
+                         help="色差公式 (default: 全部)")
+    palette.add_argument('--lab-mode', choices=LAB_MODES, default='float32')
+    palette.add_argument('--samples', type=int, default=16, help="随机取样点数量 (default: 16)")
+    palette.add_argument('--seed', type=int, default=0)
+    palette.set_defaults(func=bench_palette)
+
+    multi = subparsers.add_parser('multi', help="多目标查找 Multi-target search vs one search per target")
+    multi.add_argument('--megapixels', type=float, default=12.0, help="图片百万像素 (default: 12)")
+    multi.add_argument('--targets', type=int, nargs='+', default=[1, 4, 16, 64], help="目标数量 (default: 1 4 16 64)")
+    multi.add_argument('--top', type=int, default=10, help="每个目标的相似位置数量 (default: 10)")
+    multi.add_argument('--min-distance', type=int, default=20)
+    multi.add_argument('--metric', choices=METRICS, default='cie76')
+    multi.add_argument('--lab-mode', choices=LAB_MODES, default='float32')
+    multi.add_argument('--seed', type=int, default=0)
+    multi.set_defaults(func=bench_multi)
+
+    swatches = subparsers.add_parser('swatches', help="参考色卡库 Palette store load and classify time")
+    swatches.add_argument('--swatches', type=int, nargs='+', default=[24, 96], help="色块数量 (default: 24 96)")
+    swatches.add_argument('--queries', type=int, default=500, help="分类的颜色数量 (default: 500)")
+    swatches.add_argument('--repeat', type=int, default=20)
+    swatches.add_argument('--seed', type=int, default=0)
+    swatches.set_defaults(func=bench_swatches)
+
+    view = subparsers.add_parser('view', help="视图渲染 Viewport rendering vs full-image resize")
+    view.add_argument('--megapixels', type=float, default=20.0, help="图片百万像素 (default: 20)")
+    view.add_argument('--zoom', type=float, nargs='+', default=[1, 2, 5, 10], help="缩放级别 (default: 1 2 5 10)")
+    view.add_argument('--viewport', type=int, nargs=2, default=[1000, 750], metavar=('W', 'H'))
+    view.add_argument('--repeat', type=int, default=5)
+    view.add_argument('--seed', type=int, default=0)
+    view.set_defaults(func=bench_view)
+
+    frames = subparsers.add_parser('frames', help="帧调度 Per-event rendering vs one render per frame")
+    frames.add_argument('--megapixels', type=float, default=20.0, help="图片百万像素 (default: 20)")
+    frames.add_argument('--rate', type=int, nargs='+', default=[250, 1000], help="每秒事件数 (default: 250 1000)")
+    frames.add_argument('--seconds', type=float, default=1.0, help="拖动时长 (default: 1)")
+    frames.add_argument('--frame-ms', type=float, default=16.0, help="最短帧间隔 ms (default: 16)")
+    frames.add_argument('--zoom', type=float, default=2.0)
+    frames.add_argument('--viewport', type=int, nargs=2, default=[1000, 750], metavar=('W', 'H'))
+    frames.add_argument('--seed', type=int, default=0)
+    frames.set_defaults(func=bench_frames)
+
+    suite = subparsers.add_parser('suite', help="基准套件 Load/query/render stages per image size, for compare")
+    suite.add_argument('--megapixels', type=float, nargs='+', default=[1, 10, 50, 100],
+                       help="图片百万像素 (default: 1 10 50 100)")
+    suite.add_argument('--samples', type=int, default=2, help="随机取样点数量（另加每个色块一个）(default: 2)")
+    suite.add_argument('--repeat', type=int, default=3, help="解码、转换、渲染的重复次数 (default: 3)")
+    suite.add_argument('--viewport', type=int, nargs=2, default=[1000, 750], metavar=('W', 'H'))
+    suite.add_argument('--seed', type=int, default=0)
+    suite.set_defaults(func=bench_suite)
+
+    compare = subparsers.add_parser('compare', help="对比两次套件结果 Compare two suite results for regressions")
+    compare.add_argument('baseline', help="基准结果JSON Baseline suite JSON")
+    compare.add_argument('current', help="当前结果JSON Current suite JSON")
+    compare.add_argument('--threshold', type=float, default=0.15,
+                         help="耗时增加超过此比例记为退化 Relative time regression threshold (default: 0.15)")
+    compare.add_argument('--min-ms', type=float, default=5.0,
+                         help="耗时增加的绝对下限（噪声）Ignore time changes below this (default: 5 ms)")
+    compare.add_argument('--memory-threshold', type=float, default=0.10,
+                         help="峰值内存增加超过此比例记为退化 Relative memory regression threshold (default: 0.10)")
+    compare.add_argument('--min-mb', type=float, default=16.0,
+                         help="峰值内存增加的绝对下限 Ignore memory changes below this (default: 16 MB)")
+    compare.set_defaults(func=bench_compare)
+
+    stream = subparsers.add_parser('stream', help="流式查找的内存预算 Streaming search within a memory budget")
+    stream.add_argument('--megapixels', type=float, default=64.0, help="大图百万像素 (default: 64)")
+    stream.add_argument('--budget-mb', type=int, default=128, help="内存预算 MB (default: 128)")
+    stream.add_argument('--top', type=int, default=10, help="相似位置数量 (default: 10)")
+    stream.add_argument('--seed', type=int, default=0)
+    stream.set_defaults(func=bench_stream)
+
+    trace = subparsers.add_parser('trace', help="分阶段跟踪的开销 Per-stage tracing overhead on queries")
+    trace.add_argument('--megapixels', type=float, nargs='+', default=[1.0, 12.0],
+                       help="图片百万像素 (default: 1 12)")
+    trace.add_argument('--samples', type=int, default=8, help="随机取样点数量 (default: 8)")
+    trace.add_argument('--repeat', type=int, default=3)
+    trace.add_argument('--top', type=int, default=10)
+    trace.add_argument('--min-distance', type=int, default=20)
+    trace.add_argument('--export', default=None, metavar='FILE',
+                       help="把最后一种图片大小的跟踪写为 Chrome 跟踪文件 Write the last trace as a Chrome trace")
+    trace.add_argument('--seed', type=int, default=0)
+    trace.set_defaults(func=bench_trace)
+
+    startup = subparsers.add_parser('startup', help="冷启动 Import cost, time to window and to first query")
+    startup.add_argument('--repeat', type=int, default=7, help="每项测量的进程数 (default: 7)")
+    startup.add_argument('--megapixels', type=float, default=1.0, help="第一次查询的图片百万像素 (default: 1)")
+    startup.add_argument('--max-overhead-ms', type=float, default=25.0,
+                         help="模块自身导入开销的上限 Max own import time beyond required deps (default: 25 ms)")
+    startup.add_argument('--seed', type=int, default=0)
+    startup.set_defaults(func=bench_startup)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    report = args.func(args)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 0 if report.get('passed', True) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""
+Lab预计算磁盘缓存
+功能：按图片内容哈希和解码设置缓存解码后的RGB、Lab图像等逐图预计算数据，
+      再次打开同一图片时以内存映射方式加载；缓存总大小超限时按最近使用时间淘汰
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+# 缓存格式版本，预计算算法变化时递增使旧缓存失效
+CACHE_VERSION = 1
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+def default_cache_dir():
+    """默认缓存目录（遵循 XDG_CACHE_HOME）"""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'color-match')
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class LabCache:
+    """逐图预计算数据的磁盘缓存（每个条目是一个目录，内含若干 .npy 文件）"""
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, path, settings=None):
+        """缓存键：文件内容哈希 + 解码设置 + 缓存版本"""
+        payload = json.dumps({'version': CACHE_VERSION, 'settings': settings or {}}, sort_keys=True)
+        digest = hashlib.sha256(file_digest(path).encode('ascii'))
+        digest.update(payload.encode('utf-8'))
+        return digest.hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.directory, key)
+
+    def load(self, key, names=None):
+        """以内存映射方式加载缓存条目，返回 {名称: 数组}；条目不存在时返回None"""
+        entry = self._entry_dir(key)
+        if not os.path.isdir(entry):
+            return None
+        try:
+            files = names or [f[:-4] for f in os.listdir(entry) if f.endswith('.npy')]
+            arrays = {name: np.load(os.path.join(entry, name + '.npy'), mmap_mode='r') for name in files}
+        except (OSError, ValueError):
+            # 条目损坏或正在被淘汰
+            return None
+        # 更新使用时间（用于LRU淘汰）
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        return arrays
+
+    def store(self, key, arrays):
+        """写入缓存条目（先写临时目录再原子重命名），随后按大小淘汰旧条目"""
+        size = sum(np.asarray(a).nbytes for a in arrays.values())
+        if size > self.max_bytes:
+            return False
+
+        tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=self.directory)
+        try:
+            for name, array in arrays.items():
+                np.save(os.path.join(tmp_dir, name + '.npy'), np.asarray(array))
+            os.replace(tmp_dir, self._entry_dir(key))
+        except OSError:
+            # 其他进程已写入同一条目
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return False
+
+        self.evict()
+        return True
+
+    def update(self, key, arrays):
+        """向已存在的缓存条目追加数组（如按需构建的颜色表）"""
+        entry = self._entry_dir(key)
+        if not os.path.isdir(entry):
+            return False
+        for name, array in arrays.items():
+            fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', suffix='.npy', dir=entry)
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, np.asarray(array))
+            os.replace(tmp_path, os.path.join(entry, name + '.npy'))
+        self.evict()
+        return True
+
+    def entries(self):
+        """列出缓存条目 [(最近使用时间, 大小, 路径)]"""
+        result = []
+        for name in os.listdir(self.directory):
+            entry = os.path.join(self.directory, name)
+            if name.startswith('.tmp-') or not os.path.isdir(entry):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+                result.append((os.path.getmtime(entry), size, entry))
+            except OSError:
+                continue
+        return result
+
+    def total_bytes(self):
+        """缓存总大小"""
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """总大小超过上限时，按最近使用时间从旧到新删除条目"""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """清空缓存"""
+        for _, _, entry in self.entries():
+            shutil.rmtree(entry, ignore_errors=True)
+
+    def __repr__(self):
+        return f"LabCache({self.directory!r}, max_bytes={self.max_bytes})"
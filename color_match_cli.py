@@ -0,0 +1,518 @@
+"""
+颜色比对批处理命令行
+功能：对文件夹或通配符匹配的图片批量取样（点/圆形），将相似位置结果写入JSON或CSV，
+      结束时输出吞吐量（图片/秒）；--trace 时输出各阶段耗时并写出 Chrome 跟踪文件
+
+示例：
+    python color_match_cli.py strips/ --point 120,80 --circle 300,200,15 -o results.json
+    python color_match_cli.py "scans/*.jpg" --point 10,10 --lasso "0,0 500,0 500,300" -o results.csv
+    python color_match_cli.py cards/ --point 40,40 --rect 0,0,600,400 --exclude-rect 100,150,500,220 -o results.json
+    python color_match_cli.py strips/ --point 120,80 -j 0 --unordered -o results.json
+    python color_match_cli.py strips/ --multi --swatches scale.json --max-distance 15 --label-dir labels/ -o results.csv
+    python color_match_cli.py strips/ --circle 120,80,12 --palette formaldehyde --metric ciede2000 -o results.csv
+    python color_match_cli.py panorama.tif --point 5000,1200 --memory-budget-mb 256 -o results.json
+    python color_match_cli.py strips/ --point 120,80 -j 4 --trace trace.json -o results.json
+"""
+
+import argparse
+import csv
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+# OpenCV 在函数内用到时才导入（见 color_match_engine 开头的说明）
+
+from color_match_cache import LabCache
+from color_match_color import LAB_MODES, METRICS, srgb_to_lab
+from color_match_engine import ColorSearchEngine
+from color_match_palette import PaletteStore, SwatchPalette
+from color_match_region import RegionSet
+from color_match_stream import stream_search
+from color_match_trace import TRACER
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tif', '.tiff', '.webp')
+
+CSV_FIELDS = ['image', 'sample', 'sample_x', 'sample_y', 'sample_radius', 'sample_pixels',
+              'palette_match', 'palette_distance', 'estimate', 'rank',
+              'x', 'y', 'r', 'g', 'b', 'similarity', 'distance',
+              'area', 'bbox_x', 'bbox_y', 'bbox_w', 'bbox_h', 'mean_L', 'mean_a', 'mean_b', 'error']
+
+
+def parse_numbers(text, count, option):
+    """解析逗号分隔的整数坐标"""
+    try:
+        values = [int(round(float(v))) for v in text.split(',')]
+    except ValueError:
+        values = []
+    if len(values) != count:
+        raise argparse.ArgumentTypeError(f"{option} 需要 {count} 个逗号分隔的数字: {text!r}")
+    return values
+
+
+def parse_point(text):
+    """解析 --point X,Y"""
+    x, y = parse_numbers(text, 2, '--point')
+    return {'type': 'point', 'x': x, 'y': y}
+
+
+def parse_circle(text):
+    """解析 --circle X,Y,R"""
+    x, y, radius = parse_numbers(text, 3, '--circle')
+    return {'type': 'circle', 'x': x, 'y': y, 'radius': radius}
+
+
+def parse_lasso(text, option='--lasso'):
+    """解析 --lasso "X,Y X,Y X,Y ..." """
+    points = [tuple(parse_numbers(p, 2, option)) for p in text.replace(';', ' ').split()]
+    if len(points) < 3:
+        raise argparse.ArgumentTypeError(f"{option} 至少需要3个点")
+    return points
+
+
+def region_parser(kind, exclude, option):
+    """搜索范围形状的解析函数，返回 (形状, 参数, 是否挖去)，按命令行顺序组合"""
+    def parse(text):
+        if kind == 'polygon':
+            params = parse_lasso(text, option)
+        else:
+            params = parse_numbers(text, 3 if kind == 'circle' else 4, option)
+        return kind, params, exclude
+    return parse
+
+
+def resolve_palette(name_or_path):
+    """色卡文件路径或色卡库中的名称 -> SwatchPalette"""
+    if os.path.isfile(name_or_path):
+        return SwatchPalette.read(name_or_path)
+    return PaletteStore().resolve(name_or_path)
+
+
+def classify_samples(records, palette, metric):
+    """每个取样的目标颜色对色卡分类，有标称值时附带插值估计读数（在主进程中计算，代价可忽略）"""
+    for record in records:
+        for sample in record['samples']:
+            if sample['type'] == 'color' or sample.get('target_rgb') is None:
+                continue
+            lab = srgb_to_lab(np.asarray(sample['target_rgb'], dtype=np.float64)).astype(np.float64)
+            sample['palette'] = palette.classify(lab, metric)
+            estimate = palette.estimate(lab, metric)
+            if estimate is not None:
+                sample['estimate'] = dict(estimate, unit=palette.unit)
+
+
+def collect_images(inputs):
+    """展开文件夹、通配符和文件列表，返回排序去重后的图片路径"""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for name in sorted(os.listdir(item)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    paths.append(os.path.join(item, name))
+        elif os.path.isfile(item):
+            paths.append(item)
+        else:
+            paths.extend(p for p in sorted(glob.glob(item)) if p.lower().endswith(IMAGE_EXTENSIONS))
+
+    seen = set()
+    unique = []
+    for path in paths:
+        if path not in seen:
+            seen.add(path)
+            unique.append(path)
+    return unique
+
+
+def peak_rss_mb():
+    """当前进程的峰值常驻内存（MB），平台不支持时返回None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为KB，macOS 为字节
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def write_label_map(labels, path, label_dir):
+    """分类图写为PNG：像素值为最近目标的编号+1，0 表示未分类（搜索范围外或超过 --max-distance）"""
+    import cv2
+    os.makedirs(label_dir, exist_ok=True)
+    dtype = 'uint8' if labels.max(initial=-1) < 255 else 'uint16'
+    out = os.path.join(label_dir, os.path.splitext(os.path.basename(path))[0] + '.labels.png')
+    cv2.imwrite(out, (labels + 1).astype(dtype))
+    return out
+
+
+def match_image_multi(engine, path, samples, lasso_points=None, max_distance=None, label_dir=None):
+    """多目标查找：全部取样一次查找，每个取样附带分到它的像素数"""
+    record = {'image': path, 'samples': [], 'error': None}
+    try:
+        engine.load_image(path)
+    except Exception as e:
+        record['error'] = f"无法加载图片 Cannot load image: {e}"
+        return record
+
+    img_width, img_height = engine.size
+    valid = [sample for sample in samples
+             if sample['type'] == 'color' or (0 <= sample['x'] < img_width and 0 <= sample['y'] < img_height)]
+    results, labels = engine.find_multi_target(valid, lasso_points, max_distance)
+    results = iter(results)
+    for sample in samples:
+        result = dict(sample)
+        if sample['type'] != 'color' and not (0 <= sample['x'] < img_width and 0 <= sample['y'] < img_height):
+            result.update(error="取样位置超出图片范围 Sample outside image", matches=[], pixels=0)
+        else:
+            found = next(results)
+            target_rgb = found['target_rgb']
+            # 圆形取样的平均色保留两位小数
+            result.update(found, target_rgb=None if target_rgb is None else
+                          [c if isinstance(c, int) else round(c, 2) for c in target_rgb])
+        record['samples'].append(result)
+    if label_dir:
+        record['label_map'] = write_label_map(labels, path, label_dir)
+    record['lab_mb'] = round(engine.lab_bytes / 1024 ** 2, 2)
+    record['peak_rss_mb'] = peak_rss_mb()
+    return record
+
+
+def match_image(engine, path, samples, lasso_points=None, memory_budget=None, multi=None):
+    """对单张图片执行全部取样查询，返回结果记录
+
+    memory_budget（字节）不为None时按行条带流式查找，不加载整幅图片。
+    multi 为多目标查找的参数 {'max_distance', 'label_dir'}，不为None时全部取样一次查找。
+    """
+    if multi is not None:
+        return match_image_multi(engine, path, samples, lasso_points, **multi)
+    record = {'image': path, 'samples': [], 'error': None}
+    if memory_budget is not None:
+        try:
+            results = stream_search(engine, path, samples, lasso_points, memory_budget)
+        except Exception as e:
+            record['error'] = f"无法处理图片 Cannot process image: {e}"
+            return record
+        record['samples'] = [dict(sample, **result) for sample, result in zip(samples, results)]
+        record['lab_mb'] = 0.0
+        record['peak_rss_mb'] = peak_rss_mb()
+        return record
+
+    try:
+        engine.load_image(path)
+    except Exception as e:
+        record['error'] = f"无法加载图片 Cannot load image: {e}"
+        return record
+
+    img_width, img_height = engine.size
+    for sample in samples:
+        result = dict(sample)
+        if not (0 <= sample['x'] < img_width and 0 <= sample['y'] < img_height):
+            result['error'] = "取样位置超出图片范围 Sample outside image"
+            result['matches'] = []
+        elif sample['type'] == 'circle':
+            result['matches'] = engine.find_similar_colors_by_circle(
+                sample['x'], sample['y'], sample['radius'], lasso_points)
+            avg_color = engine.last_target_rgb
+            result['target_rgb'] = None if avg_color is None else [round(float(c), 2) for c in avg_color]
+        else:
+            result['target_rgb'] = [int(c) for c in engine.image_array[sample['y'], sample['x']]]
+            result['matches'] = engine.find_similar_colors(sample['x'], sample['y'], lasso_points)
+        record['samples'].append(result)
+    record['lab_mb'] = round(engine.lab_bytes / 1024 ** 2, 2)
+    record['peak_rss_mb'] = peak_rss_mb()
+    return record
+
+
+# 工作进程内的引擎与查询参数（由 _init_worker 设置）
+_worker_engine = None
+_worker_job = None
+
+
+def _init_worker(engine_options, samples, lasso_points, memory_budget=None, multi=None, trace=False):
+    """工作进程初始化：每个进程持有自己的引擎"""
+    global _worker_engine, _worker_job
+    import cv2
+    # 并行由进程池负责，避免每个进程内OpenCV再开线程造成超额订阅
+    cv2.setNumThreads(1)
+    TRACER.enabled = trace
+    _worker_engine = ColorSearchEngine(**engine_options)
+    _worker_job = (samples, lasso_points, memory_budget, multi)
+
+
+def _match_in_worker(path):
+    """工作进程任务：解码、Lab转换、查找，只返回小的结果记录"""
+    samples, lasso_points, memory_budget, multi = _worker_job
+    record = match_image(_worker_engine, path, samples, lasso_points, memory_budget, multi)
+    # 释放像素数组，避免常驻内存
+    _worker_engine.clear_image()
+    if TRACER.enabled:
+        # 跟踪事件随结果传回主进程合并（run_batch 取出，不写入结果）
+        record['trace'] = TRACER.take_events()
+    return record
+
+
+def run_batch(paths, samples, lasso_points=None, engine_options=None, workers=1, ordered=True,
+              memory_budget=None, multi=None):
+    """批量匹配，逐个产出结果记录
+
+    engine_options 为传给 ColorSearchEngine 的参数（num_similar、min_distance、metric 等）。
+    memory_budget 为每个进程的内存预算（字节），设置时按行条带流式查找。
+    multi 为多目标查找的参数（见 match_image）。
+    workers 为 1 时在当前进程中顺序执行；大于 1 时使用进程池，
+    ordered 为 False 时按完成顺序产出结果。
+    全局跟踪器 TRACER 开启时工作进程也开启，其跟踪事件并入当前进程的 TRACER。
+    """
+    engine_options = dict(engine_options or {})
+    if workers <= 1 or len(paths) <= 1:
+        engine = ColorSearchEngine(**engine_options)
+        for path in paths:
+            yield match_image(engine, path, samples, lasso_points, memory_budget, multi)
+        return
+
+    workers = min(workers, len(paths))
+    # 每批任务数：保证负载均衡的同时减少进程间通信次数
+    chunksize = max(1, len(paths) // (workers * 8))
+    with multiprocessing.Pool(workers, initializer=_init_worker,
+                              initargs=(engine_options, samples, lasso_points, memory_budget, multi,
+                                        TRACER.enabled)) as pool:
+        if ordered:
+            results = pool.imap(_match_in_worker, paths, chunksize)
+        else:
+            results = pool.imap_unordered(_match_in_worker, paths, chunksize)
+        for record in results:
+            TRACER.add_events(record.pop('trace', ()))
+            yield record
+
+
+def sample_label(sample):
+    """取样的简短描述，如 point:10,20 / circle:10,20,5 / color:名称"""
+    if sample['type'] == 'color':
+        return f"color:{sample['name']}"
+    if sample['type'] == 'circle':
+        return f"circle:{sample['x']},{sample['y']},{sample['radius']}"
+    return f"point:{sample['x']},{sample['y']}"
+
+
+def iter_csv_rows(records):
+    """将结果记录展开为CSV行（每个相似位置一行）"""
+    for record in records:
+        if record['error']:
+            yield {'image': record['image'], 'error': record['error']}
+            continue
+        for sample in record['samples']:
+            base = {
+                'image': record['image'],
+                'sample': sample_label(sample),
+                'sample_x': sample.get('x', ''),
+                'sample_y': sample.get('y', ''),
+                'sample_radius': sample.get('radius', ''),
+                'sample_pixels': sample.get('pixels', ''),
+            }
+            if sample.get('palette'):
+                base['palette_match'] = sample['palette'][0]['name']
+                base['palette_distance'] = round(sample['palette'][0]['distance'], 4)
+            if sample.get('estimate'):
+                base['estimate'] = round(sample['estimate']['value'], 6)
+            if sample.get('error') or not sample['matches']:
+                yield dict(base, error=sample.get('error', ''))
+                continue
+            for rank, match in enumerate(sample['matches'], 1):
+                r, g, b = match['rgb']
+                row = dict(base, rank=rank, x=match['x'], y=match['y'], r=r, g=g, b=b,
+                           similarity=round(match['similarity'], 3),
+                           distance=round(match['distance'], 4))
+                if 'area' in match:
+                    row['area'] = match['area']
+                    row['bbox_x'], row['bbox_y'], row['bbox_w'], row['bbox_h'] = match['bbox']
+                    row['mean_L'], row['mean_a'], row['mean_b'] = match['mean_lab']
+                yield row
+
+
+def write_results(records, output, fmt):
+    """写出结果（JSON或CSV），output为None时写到标准输出"""
+    stream = sys.stdout if output is None else open(output, 'w', newline='', encoding='utf-8')
+    try:
+        if fmt == 'csv':
+            writer = csv.DictWriter(stream, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+            writer.writerows(iter_csv_rows(records))
+        else:
+            json.dump(records, stream, ensure_ascii=False, indent=2)
+            stream.write('\n')
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+
+
+def print_trace_summary(summary):
+    """各阶段耗时表（按总耗时从大到小）输出到标准错误"""
+    print(f"{'阶段 stage':<18}{'count':>7}{'total ms':>12}{'mean ms':>10}{'max ms':>10}", file=sys.stderr)
+    for name, stats in summary.items():
+        print(f"{name:<18}{stats['count']:>7}{stats['total_ms']:>12.1f}{stats['mean_ms']:>10.2f}"
+              f"{stats['max_ms']:>10.1f}", file=sys.stderr)
+
+
+def build_parser():
+    """命令行参数"""
+    parser = argparse.ArgumentParser(
+        description="批量查找图片中的相似颜色位置 Batch color similarity matching")
+    parser.add_argument('inputs', nargs='+',
+                        help="图片文件、文件夹或通配符 Image files, folders or glob patterns")
+    parser.add_argument('--point', dest='samples', action='append', type=parse_point, default=[],
+                        metavar='X,Y', help="单点取样位置（可重复）Point sample (repeatable)")
+    parser.add_argument('--circle', dest='samples', action='append', type=parse_circle,
+                        metavar='X,Y,R', help="圆形取样（可重复）Circle sample (repeatable)")
+    parser.add_argument('--swatches', default=None, metavar='FILE|NAME',
+                        help="色卡文件（JSON/CSV）或色卡库中的名称，每个色块作为一个目标颜色 One target per swatch")
+    parser.add_argument('--palette', default=None, metavar='FILE|NAME',
+                        help="对每个取样的颜色按色卡分类并估计读数 Classify each sample against this palette")
+    parser.add_argument('--multi', action='store_true',
+                        help="多目标查找：全部取样一次查找并统计每个目标的像素数 Match all samples in one pass")
+    parser.add_argument('--max-distance', type=float, default=None,
+                        help="多目标查找时色差超过此值的像素不分类 Leave pixels farther than this ΔE unassigned")
+    parser.add_argument('--label-dir', default=None,
+                        help="多目标查找的分类图输出目录（PNG，值为目标编号+1）Write per-image label maps here")
+    # 搜索范围：按出现顺序并入或挖去，第一个是挖去时从整幅图片开始
+    parser.add_argument('--lasso', dest='search_area', action='append', default=[],
+                        type=region_parser('polygon', False, '--lasso'), metavar='"X,Y X,Y ..."',
+                        help="并入搜索范围的多边形（原图坐标，可重复）Add a polygon to the search area")
+    parser.add_argument('--exclude-lasso', dest='search_area', action='append',
+                        type=region_parser('polygon', True, '--exclude-lasso'), metavar='"X,Y X,Y ..."',
+                        help="从搜索范围挖去多边形 Cut a polygon out of the search area")
+    parser.add_argument('--rect', dest='search_area', action='append',
+                        type=region_parser('rect', False, '--rect'), metavar='X0,Y0,X1,Y1',
+                        help="并入矩形（含两端）Add a rectangle")
+    parser.add_argument('--exclude-rect', dest='search_area', action='append',
+                        type=region_parser('rect', True, '--exclude-rect'), metavar='X0,Y0,X1,Y1',
+                        help="挖去矩形 Cut a rectangle out")
+    parser.add_argument('--include-circle', dest='search_area', action='append',
+                        type=region_parser('circle', False, '--include-circle'), metavar='X,Y,R',
+                        help="并入圆形 Add a circle")
+    parser.add_argument('--exclude-circle', dest='search_area', action='append',
+                        type=region_parser('circle', True, '--exclude-circle'), metavar='X,Y,R',
+                        help="挖去圆形 Cut a circle out")
+    parser.add_argument('-n', '--count', type=int, default=3,
+                        help="相似位置数量 Number of matches per sample (default: 3)")
+    parser.add_argument('--min-distance', type=int, default=20,
+                        help="最小像素间距 Min distance from the sample (default: 20)")
+    parser.add_argument('--regions', action='store_true',
+                        help="返回连通区域而不是像素 Return connected regions within --threshold")
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help="区域模式的色差阈值 Region ΔE threshold (default: 10)")
+    parser.add_argument('--min-area', type=int, default=4,
+                        help="区域最小面积 Minimum region area in pixels (default: 4)")
+    parser.add_argument('--distinct', action='store_true',
+                        help="结果之间也保持最小间距 Matches must be --min-distance apart from each other")
+    parser.add_argument('--neighborhood', action='store_true',
+                        help="圆形取样按同面积窗口的平均色比较 Compare circle samples against window means")
+    parser.add_argument('--coarse-slack', type=float, default=0.0,
+                        help="大图由粗到细查找允许的色差误差，0=与整图查找相同 Coarse-to-fine ΔE slack (default: 0)")
+    parser.add_argument('--palette-index', action='store_true',
+                        help="建立颜色索引，每张图片取样点较多或配合 --cache-dir 时更快 Build a per-image color index")
+    parser.add_argument('--metric', choices=METRICS, default='cie76',
+                        help="色差公式 Color difference formula (default: cie76)")
+    parser.add_argument('--lab-mode', choices=LAB_MODES, default='float32',
+                        help="Lab图像存储方式（float16/uint8 节省内存）Lab storage (default: float32)")
+    parser.add_argument('--cache-dir', default=None,
+                        help="Lab预计算磁盘缓存目录（默认不缓存）Cache precomputed Lab data in this directory")
+    parser.add_argument('--cache-size-mb', type=int, default=2048,
+                        help="缓存大小上限 Cache size limit in MB (default: 2048)")
+    parser.add_argument('--memory-budget-mb', type=int, default=None,
+                        help="按行条带流式查找，每个进程的内存预算 Stream images in row strips within this budget (MB)")
+    parser.add_argument('-o', '--output', default=None,
+                        help="输出文件（.json/.csv），默认标准输出 Output file, default stdout")
+    parser.add_argument('--format', choices=('json', 'csv'), default=None,
+                        help="输出格式，默认按扩展名判断 Output format (default: from extension)")
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help="工作进程数，0 表示全部CPU核心 Worker processes, 0 = all cores (default: 1)")
+    parser.add_argument('--threads', type=int, default=None,
+                        help="每张图片整图查找的线程数，0 表示全部CPU核心；默认 -j 1 时用全部核心，多进程时为1 "
+                             "Threads per image search, 0 = all cores (default: all cores with -j 1, else 1)")
+    parser.add_argument('--unordered', action='store_true',
+                        help="按完成顺序输出结果 Emit results in completion order")
+    parser.add_argument('--trace', default=None, metavar='FILE',
+                        help="记录各阶段耗时与内存，写出 Chrome 跟踪文件（chrome://tracing、Perfetto 打开） "
+                             "Record per-stage timing and memory, write a Chrome trace file")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    palette = None
+    try:
+        if args.swatches:
+            args.samples.extend(resolve_palette(args.swatches).samples())
+        if args.palette:
+            palette = resolve_palette(args.palette)
+    except (OSError, ValueError) as e:
+        parser.error(f"无法读取色卡 Cannot read palette: {e}")
+    if args.swatches:
+        # 色卡没有取样位置，只能多目标查找
+        args.multi = True
+    if not args.samples:
+        parser.error("至少需要一个 --point、--circle 取样或 --swatches 色卡")
+    if args.multi and args.memory_budget_mb:
+        parser.error("--multi 不支持 --memory-budget-mb 流式查找")
+    if (args.max_distance is not None or args.label_dir) and not args.multi:
+        parser.error("--max-distance / --label-dir 需要 --multi")
+    fmt = args.format
+    if fmt is None:
+        fmt = 'csv' if args.output and args.output.lower().endswith('.csv') else 'json'
+
+    paths = collect_images(args.inputs)
+    if not paths:
+        parser.error("没有找到图片 No images found")
+
+    workers = args.workers if args.workers > 0 else os.cpu_count() or 1
+    # 多进程时每个进程默认单线程，避免超额订阅
+    threads = args.threads if args.threads is not None else (0 if workers <= 1 else 1)
+    if args.trace:
+        TRACER.enabled = True
+    start = time.perf_counter()
+    engine_options = {'num_similar': args.count, 'min_distance': args.min_distance,
+                      'metric': args.metric, 'lab_mode': args.lab_mode, 'distinct': args.distinct,
+                      'neighborhood': args.neighborhood, 'coarse_slack': args.coarse_slack,
+                      'palette_index': args.palette_index,
+                      'match_mode': 'regions' if args.regions else 'pixels',
+                      'region_threshold': args.threshold, 'region_min_area': args.min_area,
+                      'threads': threads or None}
+    if args.cache_dir:
+        engine_options['cache'] = LabCache(args.cache_dir, args.cache_size_mb * 1024 ** 2)
+    memory_budget = args.memory_budget_mb * 1024 ** 2 if args.memory_budget_mb else None
+    search_area = RegionSet(args.search_area) if args.search_area else None
+    multi = {'max_distance': args.max_distance, 'label_dir': args.label_dir} if args.multi else None
+    records = list(run_batch(paths, args.samples, search_area, engine_options,
+                             workers, ordered=not args.unordered, memory_budget=memory_budget, multi=multi))
+    if palette is not None:
+        classify_samples(records, palette, args.metric)
+    elapsed = time.perf_counter() - start
+
+    write_results(records, args.output, fmt)
+
+    failed = sum(1 for record in records if record['error'])
+    rate = len(records) / elapsed if elapsed > 0 else float('inf')
+    print(f"处理 Processed {len(records)} 张图片 images ({failed} failed) "
+          f"in {elapsed:.2f}s with {workers} worker(s): {rate:.2f} images/s", file=sys.stderr)
+    peaks = [record['peak_rss_mb'] for record in records if record.get('peak_rss_mb')]
+    if peaks:
+        print(f"峰值内存 Peak RSS per process: {max(peaks):.1f} MB", file=sys.stderr)
+    if args.trace:
+        print_trace_summary(TRACER.summary())
+        try:
+            count = TRACER.export_chrome(args.trace)
+        except OSError as e:
+            print(f"无法写出跟踪文件 Cannot write trace: {e}", file=sys.stderr)
+        else:
+            print(f"跟踪 Trace: {count} 个事件 events -> {args.trace}", file=sys.stderr)
+    return 1 if failed == len(records) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,389 @@
+"""
+颜色空间与色差公式
+功能：向量化的 sRGB→Lab 转换（图片与取样颜色共用），CIE76 / CIE94 / CIEDE2000 色差计算，
+      以及按图片预计算的颜色表
+"""
+
+import numpy as np
+
+# 可选的色差公式
+METRICS = ('cie76', 'cie94', 'ciede2000')
+
+METRIC_LABELS = {
+    'cie76': 'CIE76 (ΔE*ab)',
+    'cie94': 'CIE94 (ΔE*94)',
+    'ciede2000': 'CIEDE2000 (ΔE00)',
+}
+
+
+# sRGB（D65）→ XYZ 矩阵，各行已除以D65白点，转换结果直接是 X/Xn, Y/Yn, Z/Zn
+_D65_WHITE = np.array([0.950456, 1.0, 1.088754])
+_RGB_TO_XYZ_WHITE = (np.array([[0.412453, 0.357580, 0.180423],
+                               [0.212671, 0.715160, 0.072169],
+                               [0.019334, 0.119193, 0.950227]]) / _D65_WHITE[:, None]).astype(np.float32)
+
+# CIE 标准常数：ε = 216/24389，κ = 24389/27
+_LAB_EPSILON = 216 / 24389
+_LAB_SLOPE = 24389 / 27 / 116
+
+# 8位sRGB值的线性化查找表
+_SRGB_LINEAR_LUT = np.where(np.arange(256) / 255 <= 0.04045,
+                            np.arange(256) / 255 / 12.92,
+                            ((np.arange(256) / 255 + 0.055) / 1.055) ** 2.4).astype(np.float32)
+
+# 分块大小（像素），限制转换时的临时内存
+_CONVERT_CHUNK = 1 << 20
+
+# Lab图像的存储方式：
+#   float32 - 精确值（12字节/像素）
+#   float16 - 半精度（6字节/像素），L/a/b 量化误差 ≤ 0.031，ΔE76 误差 ≤ 0.054
+#   uint8   - 与 cv2 8位Lab相同的编码 L*255/100, a+128, b+128（3字节/像素），
+#             量化误差 L ≤ 0.196, a/b ≤ 0.5，ΔE76 误差 ≤ 0.73
+LAB_MODES = ('float32', 'float16', 'uint8')
+
+# 编码值 = Lab * scale + offset
+LAB_ENCODINGS = {
+    'float32': (np.array([1.0, 1.0, 1.0]), np.array([0.0, 0.0, 0.0])),
+    'float16': (np.array([1.0, 1.0, 1.0]), np.array([0.0, 0.0, 0.0])),
+    'uint8': (np.array([255 / 100, 1.0, 1.0]), np.array([0.0, 128.0, 128.0])),
+}
+
+
+def _linearize(rgb):
+    """sRGB（0-255）→ 线性RGB（0-1）"""
+    if rgb.dtype == np.uint8:
+        return _SRGB_LINEAR_LUT[rgb]
+    # 与查找表相同的精度计算，整数值输入时结果与查找表完全一致
+    v = rgb.astype(np.float64) / 255
+    return np.where(v <= 0.04045, v / 12.92, ((np.maximum(v, 0) + 0.055) / 1.055) ** 2.4).astype(np.float32)
+
+
+def _srgb_to_lab_chunk(rgb, out):
+    """转换一块 (n, 3) 像素，结果写入 out"""
+    # 逐元素计算矩阵乘法，结果与块大小无关（单个颜色与整幅图片逐位一致）
+    lin = _linearize(rgb)
+    m = _RGB_TO_XYZ_WHITE
+    t = np.empty_like(lin)
+    for k in range(3):
+        t[:, k] = lin[:, 0] * m[k, 0] + lin[:, 1] * m[k, 1] + lin[:, 2] * m[k, 2]
+    f = np.where(t > _LAB_EPSILON, np.cbrt(t), _LAB_SLOPE * t + 16 / 116)
+    out[:, 0] = 116 * f[:, 1] - 16
+    out[:, 1] = 500 * (f[:, 0] - f[:, 1])
+    out[:, 2] = 200 * (f[:, 1] - f[:, 2])
+
+
+def encode_lab(lab, mode):
+    """将float Lab编码为指定存储方式"""
+    if mode == 'float32':
+        return np.asarray(lab, dtype=np.float32)
+    if mode == 'float16':
+        return np.asarray(lab).astype(np.float16)
+    if mode == 'uint8':
+        scale, offset = LAB_ENCODINGS[mode]
+        encoded = np.asarray(lab, dtype=np.float32) * scale.astype(np.float32) + offset.astype(np.float32)
+        return np.clip(np.rint(encoded), 0, 255).astype(np.uint8)
+    raise ValueError(f"未知的Lab存储方式 Unknown Lab mode: {mode!r}, expected one of {LAB_MODES}")
+
+
+def decode_lab(lab, mode):
+    """将存储的Lab解码为float32"""
+    scale, offset = LAB_ENCODINGS[mode]
+    if mode == 'uint8':
+        return ((lab.astype(np.float32) - offset.astype(np.float32)) / scale.astype(np.float32))
+    return np.asarray(lab, dtype=np.float32)
+
+
+def srgb_to_lab(rgb, mode='float32'):
+    """sRGB（0-255，uint8或浮点）→ CIE Lab（D65），支持任意形状 (..., 3)
+
+    图片的Lab预计算与取样颜色的转换都使用此函数，保证两者公式和白点一致。
+    与 cv2.cvtColor(float32, COLOR_RGB2LAB) 相比，8位sRGB全色域内最大差异 ΔE76 < 0.6，
+    平均差异 < 0.2（OpenCV 内部使用插值近似，本函数使用精确公式）。
+    mode 为存储方式（见 LAB_MODES），分块编码，不会产生整幅float32临时数组。
+    """
+    rgb = np.asarray(rgb)
+    if mode not in LAB_MODES:
+        raise ValueError(f"未知的Lab存储方式 Unknown Lab mode: {mode!r}, expected one of {LAB_MODES}")
+    out = np.empty(rgb.shape, dtype=mode)
+    flat_rgb = rgb.reshape(-1, 3)
+    flat_out = out.reshape(-1, 3)
+    chunk = np.empty((min(_CONVERT_CHUNK, len(flat_rgb)), 3), dtype=np.float32)
+    for start in range(0, len(flat_rgb), _CONVERT_CHUNK):
+        stop = min(start + _CONVERT_CHUNK, len(flat_rgb))
+        if mode == 'float32':
+            _srgb_to_lab_chunk(flat_rgb[start:stop], flat_out[start:stop])
+        else:
+            _srgb_to_lab_chunk(flat_rgb[start:stop], chunk[:stop - start])
+            flat_out[start:stop] = encode_lab(chunk[:stop - start], mode)
+    return out
+
+
+def _split(lab):
+    """拆分 (..., 3) 的Lab数组为 L, a, b（float64）"""
+    lab = np.asarray(lab, dtype=np.float64)
+    return lab[..., 0], lab[..., 1], lab[..., 2]
+
+
+def delta_e_cie76(lab, target):
+    """CIE76 色差（Lab欧氏距离），lab 为 (..., 3)，target 为 [L, a, b]（或可与 lab 广播的 (..., 3)）"""
+    L, a, b = _split(lab)
+    tL, ta, tb = _split(target)
+    return np.sqrt((L - tL) ** 2 + (a - ta) ** 2 + (b - tb) ** 2)
+
+
+def delta_e_cie94(lab, target, kL=1.0, K1=0.045, K2=0.015):
+    """CIE94 色差（图形艺术参数），以 target 作为参考色"""
+    L, a, b = _split(lab)
+    tL, ta, tb = _split(target)
+
+    C_ref = np.hypot(ta, tb)
+    C = np.hypot(a, b)
+    dL = tL - L
+    dC = C_ref - C
+    # ΔH² = Δa² + Δb² - ΔC²（数值误差可能略小于0）
+    dH_sq = np.maximum((ta - a) ** 2 + (tb - b) ** 2 - dC ** 2, 0)
+
+    SC = 1 + K1 * C_ref
+    SH = 1 + K2 * C_ref
+    return np.sqrt((dL / kL) ** 2 + (dC / SC) ** 2 + dH_sq / SH ** 2)
+
+
+def delta_e_ciede2000(lab, target, kL=1.0, kC=1.0, kH=1.0):
+    """CIEDE2000 色差（Sharma 等人的实现），lab 为 (..., 3)，target 为 [L, a, b]"""
+    L1, a1, b1 = _split(lab)
+    L2, a2, b2 = _split(target)
+
+    C1 = np.hypot(a1, b1)
+    C2 = np.hypot(a2, b2)
+    C_bar7 = ((C1 + C2) / 2) ** 7
+    G = 0.5 * (1 - np.sqrt(C_bar7 / (C_bar7 + 25.0 ** 7)))
+
+    a1p = (1 + G) * a1
+    a2p = (1 + G) * a2
+    C1p = np.hypot(a1p, b1)
+    C2p = np.hypot(a2p, b2)
+    h1p = np.degrees(np.arctan2(b1, a1p)) % 360
+    h2p = np.degrees(np.arctan2(b2, a2p)) % 360
+
+    # 色相差（任一彩度为0时为0）
+    Cp_prod = C1p * C2p
+    zero_chroma = Cp_prod == 0
+    dhp = h2p - h1p
+    dhp = np.where(dhp > 180, dhp - 360, np.where(dhp < -180, dhp + 360, dhp))
+    dhp = np.where(zero_chroma, 0, dhp)
+
+    dLp = L2 - L1
+    dCp = C2p - C1p
+    dHp = 2 * np.sqrt(Cp_prod) * np.sin(np.radians(dhp) / 2)
+
+    # 平均值
+    Lp_bar = (L1 + L2) / 2
+    Cp_bar = (C1p + C2p) / 2
+    h_sum = h1p + h2p
+    hp_bar = np.where(np.abs(h1p - h2p) <= 180, h_sum / 2,
+                      np.where(h_sum < 360, (h_sum + 360) / 2, (h_sum - 360) / 2))
+    hp_bar = np.where(zero_chroma, h_sum, hp_bar)
+
+    T = (1 - 0.17 * np.cos(np.radians(hp_bar - 30))
+         + 0.24 * np.cos(np.radians(2 * hp_bar))
+         + 0.32 * np.cos(np.radians(3 * hp_bar + 6))
+         - 0.20 * np.cos(np.radians(4 * hp_bar - 63)))
+    d_theta = 30 * np.exp(-((hp_bar - 275) / 25) ** 2)
+    Cp_bar7 = Cp_bar ** 7
+    RC = 2 * np.sqrt(Cp_bar7 / (Cp_bar7 + 25.0 ** 7))
+    SL = 1 + 0.015 * (Lp_bar - 50) ** 2 / np.sqrt(20 + (Lp_bar - 50) ** 2)
+    SC = 1 + 0.045 * Cp_bar
+    SH = 1 + 0.015 * Cp_bar * T
+    RT = -np.sin(np.radians(2 * d_theta)) * RC
+
+    tL = dLp / (kL * SL)
+    tC = dCp / (kC * SC)
+    tH = dHp / (kH * SH)
+    return np.sqrt(np.maximum(tL ** 2 + tC ** 2 + tH ** 2 + RT * tC * tH, 0))
+
+
+DELTA_E_FUNCTIONS = {
+    'cie76': delta_e_cie76,
+    'cie94': delta_e_cie94,
+    'ciede2000': delta_e_ciede2000,
+}
+
+
+def delta_e(lab, target, metric='cie76'):
+    """按指定公式计算色差"""
+    try:
+        func = DELTA_E_FUNCTIONS[metric]
+    except KeyError:
+        raise ValueError(f"未知的色差公式 Unknown metric: {metric!r}, expected one of {METRICS}")
+    return func(lab, target)
+
+
+class ColorTable:
+    """图片的颜色表：去重后的颜色及每个像素对应的颜色编号
+
+    CIE94 / CIEDE2000 中的三角函数、开方等昂贵运算只需在去重后的颜色上计算，
+    再通过 inverse 查表一次得到整幅图片的色差，每次查询的代价与欧氏距离相当。
+    """
+
+    def __init__(self, image_array=None):
+        if image_array is None:
+            return
+        img_height, img_width = image_array.shape[:2]
+        rgb = image_array.reshape(-1, 3)
+
+        # 24位颜色编码
+        codes = (rgb[:, 0].astype(np.uint32) << 16) | (rgb[:, 1].astype(np.uint32) << 8) | rgb[:, 2]
+
+        # 标记出现过的颜色，并建立 编码 -> 颜色编号 的查找表
+        present = np.zeros(1 << 24, dtype=bool)
+        present[codes] = True
+        unique_codes = np.flatnonzero(present).astype(np.uint32)
+        del present
+        lookup = np.zeros(1 << 24, dtype=np.int32)
+        lookup[unique_codes] = np.arange(len(unique_codes), dtype=np.int32)
+        self.inverse = lookup[codes].reshape(img_height, img_width)
+        del lookup
+
+        # 去重颜色的Lab值
+        unique_rgb = np.stack([(unique_codes >> 16) & 0xFF,
+                               (unique_codes >> 8) & 0xFF,
+                               unique_codes & 0xFF], axis=-1).astype(np.uint8)
+        self.lab = srgb_to_lab(unique_rgb)
+
+    @classmethod
+    def from_arrays(cls, inverse, lab):
+        """由已有数组（如磁盘缓存）构造"""
+        table = cls()
+        table.inverse = inverse
+        table.lab = lab
+        return table
+
+    def __len__(self):
+        return len(self.lab)
+
+    def delta_e(self, target, metric, squared=False):
+        """每种去重颜色与目标的色差（float32），通过 table[inverse] 得到整幅图片的色差"""
+        table = delta_e(self.lab, target, metric)
+        if squared:
+            table = table ** 2
+        return table.astype(np.float32)
+
+
+def _csr_order(keys, num_keys):
+    """按键分组的稳定排列（CSR）：返回 (order, offsets)，order[offsets[k]:offsets[k + 1]] 为键 k 的元素（下标递增）
+
+    分块计数排序：块内稳定排序后按每个键的游标写入，临时数组只与块大小有关。
+    """
+    count = len(keys)
+    offsets = np.zeros(num_keys + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=num_keys), out=offsets[1:])
+    order = np.empty(count, dtype=np.int32 if count < 2 ** 31 else np.int64)
+    cursor = offsets[:-1].copy()
+    for start in range(0, count, _CONVERT_CHUNK):
+        chunk = keys[start:start + _CONVERT_CHUNK]
+        local = np.argsort(chunk, kind='stable')
+        sorted_keys = chunk[local]
+        first = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        rank = np.arange(len(chunk)) - np.repeat(first, np.diff(np.r_[first, len(chunk)]))
+        order[cursor[sorted_keys] + rank] = start + local
+        cursor += np.bincount(chunk, minlength=num_keys)
+    return order, offsets
+
+
+class PaletteIndex:
+    """图片的颜色索引：Lab三维直方图 → 去重颜色 → 像素列表
+
+    去重颜色（ColorTable）按Lab量化到格子，格子内的颜色与每种颜色的像素都按CSR连续存放：
+        bin_colors[bin_offsets[k]:bin_offsets[k + 1]]     格子 k 中的颜色编号
+        pixel_order[pixel_offsets[c]:pixel_offsets[c + 1]] 颜色 c 的像素（扁平索引，按位置递增）
+    查询时按目标到格子的色差下界从小到大访问格子，只对其中的颜色计算色差，
+    同一颜色的像素色差相同，只需按位置取出前几个未被排除的像素。
+    """
+
+    # 格子大小（L 4，a/b 6）与原点，格子数 26 x 43 x 43
+    BIN_SIZE = np.array([4.0, 6.0, 6.0])
+    ORIGIN = np.array([0.0, -128.0, -128.0])
+    SHAPE = (26, 43, 43)
+
+    def __init__(self, color_table=None):
+        if color_table is None:
+            return
+        self.pixel_order, self.pixel_offsets = _csr_order(color_table.inverse.ravel(), len(color_table))
+        self.bin_colors, self.bin_offsets = _csr_order(self.bin_of(color_table.lab), int(np.prod(self.SHAPE)))
+
+    @classmethod
+    def from_arrays(cls, pixel_order, pixel_offsets, bin_colors, bin_offsets):
+        """由已有数组（如磁盘缓存）构造"""
+        index = cls()
+        index.pixel_order = pixel_order
+        index.pixel_offsets = pixel_offsets
+        index.bin_colors = bin_colors
+        index.bin_offsets = bin_offsets
+        return index
+
+    def arrays(self):
+        """全部数组（用于磁盘缓存）"""
+        return {'pixel_order': self.pixel_order, 'pixel_offsets': self.pixel_offsets,
+                'bin_colors': self.bin_colors, 'bin_offsets': self.bin_offsets}
+
+    @classmethod
+    def bin_of(cls, lab):
+        """Lab值所在的格子编号，范围外的值归入边缘格子"""
+        cells = np.floor((np.asarray(lab, dtype=np.float64) - cls.ORIGIN) / cls.BIN_SIZE).astype(np.int64)
+        np.clip(cells, 0, np.array(cls.SHAPE) - 1, out=cells)
+        return (cells[:, 0] * cls.SHAPE[1] + cells[:, 1]) * cls.SHAPE[2] + cells[:, 2]
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self.arrays().values())
+
+    def occupied_bins(self):
+        """非空格子的编号"""
+        return np.flatnonzero(np.diff(self.bin_offsets))
+
+    def gaps(self, bins, target):
+        """目标颜色到各格子（Lab包围盒）在 L、a、b 方向上的距离，形状 (格子数, 3)
+
+        边缘格子向外延伸到无穷远（范围外的值也归入其中）。
+        """
+        cells = np.stack(np.unravel_index(bins, self.SHAPE), axis=1)
+        low = self.ORIGIN + cells * self.BIN_SIZE
+        high = low + self.BIN_SIZE
+        low[cells == 0] = -np.inf
+        high[cells == np.array(self.SHAPE) - 1] = np.inf
+        target = np.asarray(target, dtype=np.float64)
+        return np.maximum(low - target, 0) + np.maximum(target - high, 0)
+
+    def colors(self, bins):
+        """指定格子中的全部颜色编号"""
+        return np.concatenate([self.bin_colors[self.bin_offsets[k]:self.bin_offsets[k + 1]] for k in bins])
+
+    def _search(self, begins, ends, value):
+        """在每种颜色的像素段 pixel_order[begins:ends] 中同时二分查找第一个不小于 value 的位置"""
+        low = begins.copy()
+        high = ends.copy()
+        while True:
+            active = low < high
+            if not active.any():
+                return low
+            middle = (low + high) // 2
+            below = active & (self.pixel_order[np.minimum(middle, len(self.pixel_order) - 1)] < value)
+            low = np.where(below, middle + 1, low)
+            high = np.where(active & ~below, middle, high)
+
+    def segments(self, colors, first=0, last=None):
+        """每种颜色中扁平索引在 [first, last) 内的像素在 pixel_order 中的范围 (起, 止)"""
+        begins = self.pixel_offsets[colors]
+        ends = self.pixel_offsets[np.asarray(colors) + 1]
+        if first > 0:
+            begins = self._search(begins, ends, first)
+        if last is not None:
+            ends = self._search(begins, ends, last)
+        return begins, ends
+
+    def take(self, begins, ends, count):
+        """从每个范围的起点按位置顺序取至多 count 个像素，返回 (像素, 所属范围的下标, 每个范围取出的数量)"""
+        counts = np.minimum(ends - begins, count)
+        owner = np.repeat(np.arange(len(counts)), counts)
+        positions = np.arange(counts.sum()) + np.repeat(begins - (np.cumsum(counts) - counts), counts)
+        return self.pixel_order[positions], owner, counts
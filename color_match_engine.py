@@ -0,0 +1,1270 @@
+"""
+颜色相似度搜索引擎
+功能：不依赖Tk的取样与相似颜色查找逻辑，可在无显示环境（服务器、批处理）中使用
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from PIL import ExifTags, Image
+import numpy as np
+# OpenCV 在函数内第一次用到时才导入（首次导入需十几到上百毫秒，视版本而定）：
+# 只导入本模块、打开界面或查看 --help 时不必等待，color_match_bench.py startup 检查这一点
+
+from color_match_color import (LAB_ENCODINGS, LAB_MODES, METRICS, ColorTable, PaletteIndex, decode_lab, delta_e,
+                               srgb_to_lab)
+from color_match_region import RegionSet, SearchRegion
+from color_match_trace import TRACER
+
+# 结果类型：'pixels'=最相似的像素位置，'regions'=色差阈值内的连通区域
+MATCH_MODES = ('pixels', 'regions')
+
+# EXIF 方向（Orientation 标签值）对应的转置，与 PIL.ImageOps.exif_transpose 相同；5~8 转置后宽高互换
+_EXIF_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT, 3: Image.Transpose.ROTATE_180, 4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE, 6: Image.Transpose.ROTATE_270, 7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+class SearchCancelled(Exception):
+    """查找被取消（由引擎的 checkpoint 回调抛出）"""
+
+
+def exif_orientation(image):
+    """图片的 EXIF 方向（1~8），没有或无效时为1"""
+    try:
+        orientation = image.getexif().get(ExifTags.Base.Orientation, 1)
+    except (OSError, SyntaxError, ValueError):  # 损坏的EXIF
+        return 1
+    return orientation if orientation in _EXIF_TRANSPOSE else 1
+
+
+def decode_image(path, factor=1, tracer=TRACER):
+    """解码图片为按 EXIF 方向摆正的RGB图片；factor > 1 时长宽各缩小 factor 倍（2的幂，预览用）
+
+    JPEG 用草稿模式：解码器直接输出RGB，并按 1/2、1/4、1/8 缩小解码（只解码需要的DCT系数）；
+    其他格式整幅解码后缩小。只在不是RGB时转换，只在有 EXIF 方向时转置。
+    返回 (图片, 原图尺寸, 整幅图片)：原图尺寸为摆正后的 (宽, 高)；缩小前已整幅解码时（非JPEG）
+    整幅图片为摆正后的全分辨率RGB图片，否则为None。
+    """
+    with tracer.span('decode', factor=factor) as span:
+        image = Image.open(path)
+        width, height = image.size
+        orientation = exif_orientation(image)
+        span.set(format=image.format, width=width, height=height, orientation=orientation)
+        if image.format == 'JPEG':
+            draft = min(factor, 8)
+            image.draft('RGB', (max(1, width // draft), max(1, height // draft)))
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        full = None
+        remaining = factor * image.width // width
+        if remaining > 1:
+            full = image
+            image = image.reduce(remaining)
+        if orientation != 1:
+            image = image.transpose(_EXIF_TRANSPOSE[orientation])
+            if full is not None:
+                full = full.transpose(_EXIF_TRANSPOSE[orientation])
+        if orientation >= 5:
+            width, height = height, width
+        image.load()
+    return image, (width, height), full
+
+
+def _encoded_squared_distances(lab, target_encoded, scale, out, scratch):
+    """在（可能是压缩存储的）Lab数组上逐通道计算与目标颜色的色差平方，写入 out
+
+    整图查找与分块细化都用此函数，保证同一像素得到完全相同的值。
+    """
+    for c in range(3):
+        channel = out if c == 0 else scratch
+        np.subtract(lab[..., c], np.float32(target_encoded[c]), out=channel, dtype=np.float32)
+        if scale[c] != 1:
+            channel *= np.float32(1 / scale[c])
+        np.square(channel, out=channel)
+        if c > 0:
+            out += channel
+    return out
+
+
+class LabTileBounds:
+    """Lab图像的粗层：每个 tile x tile 块各通道的最小、最大值（编码后的存储值）
+
+    块内任一像素与目标颜色的色差不小于目标到块的包围盒的距离，
+    由此可以跳过不可能进入前N名的块，只在全分辨率下细化剩下的块。
+    """
+
+    def __init__(self, lab_image, tile=16):
+        import cv2
+        self.tile = tile
+        self.shape = lab_image.shape[:2]
+        # 按行带处理：腐蚀/膨胀（锚点在左上角）得到每个位置起始的 tile x tile 窗口最值，再按块间隔取样；
+        # 图片边缘以外的部分不参与（形态学运算的默认边界值）
+        kernel = np.ones((tile, tile), dtype=np.uint8)
+        band_rows = tile * 64
+        lows, highs = [], []
+        for start in range(0, self.shape[0], band_rows):
+            band = lab_image[start:start + band_rows]
+            if band.dtype == np.float16:
+                band = band.astype(np.float32)
+            band = np.ascontiguousarray(band)
+            lows.append(cv2.erode(band, kernel, anchor=(0, 0))[::tile, ::tile])
+            highs.append(cv2.dilate(band, kernel, anchor=(0, 0))[::tile, ::tile])
+        self.lo = np.concatenate(lows)
+        self.hi = np.concatenate(highs)
+
+    @property
+    def grid(self):
+        """块的行数、列数"""
+        return self.lo.shape[:2]
+
+    @property
+    def nbytes(self):
+        return self.lo.nbytes + self.hi.nbytes
+
+    def lower_bounds(self, target_encoded, scale):
+        """每块色差平方的下界（CIE76），形状 (行块数, 列块数)"""
+        bound = np.zeros(self.grid, dtype=np.float64)
+        for c in range(3):
+            t = target_encoded[c]
+            gap = np.maximum(self.lo[..., c] - t, 0) + np.maximum(t - self.hi[..., c], 0)
+            bound += (gap / scale[c]) ** 2
+        return bound
+
+
+class ColorSearchEngine:
+    """颜色相似度搜索引擎（持有图片数组与预计算的Lab图像）"""
+
+    # 非极大值抑制时每次向量化过滤的候选数
+    NMS_CHUNK = 4096
+
+    # 由粗到细查找：像素数不少于此值的图片在加载时构建块上下界，块边长为 TILE
+    COARSE_MIN_PIXELS = 2_000_000
+    TILE = 16
+    # 需要细化的像素超过图片的此比例时，改为整图计算更快
+    COARSE_MAX_FRACTION = 0.15
+    # 颜色索引查找需要计算的像素超过图片的此比例时，改用分块或整图查找
+    PALETTE_MAX_FRACTION = 0.1
+    # 颜色索引查找每批处理的颜色数上限
+    PALETTE_COLOR_CHUNK = 1024
+    # 多目标查找时每批计算最近目标的去重颜色数
+    MULTI_COLOR_CHUNK = 1 << 16
+    # 预览：像素数超过此值的图片先载入长宽缩小 2^k 倍、不超过此像素数的预览
+    PREVIEW_PIXELS = 2_000_000
+    # 整图查找按行条带并行：每个条带至少这么多像素，条带数最多为线程数的 BANDS_PER_THREAD 倍（负载均衡）
+    PARALLEL_BAND_PIXELS = 1 << 18
+    BANDS_PER_THREAD = 2
+
+    def __init__(self, num_similar=3, min_distance=20, metric='cie76', cache=None, lab_mode='float32',
+                 distinct=False, match_mode='pixels', region_threshold=10.0, region_min_area=4,
+                 neighborhood=False, coarse_to_fine=True, coarse_slack=0.0, palette_index=True, threads=None,
+                 tracer=None):
+        self.image_path = None
+        self.image_array = None
+        self.lab_image = None
+        self._color_table = None  # 去重颜色表（CIE94/CIEDE2000及颜色索引用，按需构建）
+        self._buffers = None  # 查询用的预分配缓冲区
+        self._integrals = {}  # 积分图（求和面积表），按颜色空间按需构建
+        self._neighborhood_lab = None  # 邻域平均后的Lab图像 (窗口半宽, 数组)
+        self._tiles = None  # 由粗到细查找用的块上下界（LabTileBounds）
+        self._palette = None  # 颜色索引（PaletteIndex，第一次查询时构建）
+        self._region = None  # 最近一次查询的套索范围（SearchRegion）
+        # 缓冲区 dist 中色差对应的 (目标与公式, 邻域平均Lab, 搜索范围)；只改数量、间距、阈值时直接重新排序
+        # （像素模式下颜色索引或由粗到细查找先于缓冲区，命中时直接查询新的前N名，比重新排序整幅图片快）
+        self._distance_key = None
+
+        # 分批计算之间调用 checkpoint(进度)（进度为0~1，无法估计时为None），抛出 SearchCancelled 可中止查找
+        self.checkpoint = None
+
+        # 整图查找（色差、屏蔽、选前N名）按行条带在线程池中并行，None 为全部CPU核心，1 为不开线程
+        self.threads = threads
+        self._pool = None  # (线程数, ThreadPoolExecutor)，第一次并行时创建
+
+        # 分阶段耗时跟踪（Tracer），默认为全局的 TRACER（关闭时几乎没有开销）
+        self.tracer = TRACER if tracer is None else tracer
+
+        # 预计算磁盘缓存（LabCache，可选）
+        self.cache = cache
+        self._cache_key = None
+
+        # 最近一次查询的目标颜色（RGB，圆形取样时为圆内平均色；取样区域为空时为None）
+        self.last_target_rgb = None
+
+        # 参数控制
+        self.num_similar = num_similar  # 返回相似位置数量
+        self.min_distance = min_distance  # 最小像素间距（避免聚集）
+        self.metric = metric  # 色差公式
+        self.distinct = distinct  # 结果之间也保持最小间距（不同区域，而不是相邻像素）
+        # 邻域平均：圆形取样时，每个候选位置用与取样圆面积相同的方窗平均色比较，而不是单个像素
+        self.neighborhood = neighborhood
+        # 由粗到细查找（CIE76像素模式）：先用块的色差下界排除不可能的块，再在全分辨率下细化其余块。
+        # coarse_slack 为允许的色差误差（ΔE）：0 与整图查找结果完全相同，
+        # 大于0时每个结果的色差不超过整图查找同名次结果加 coarse_slack，细化的块更少
+        self.coarse_to_fine = coarse_to_fine
+        self.coarse_slack = coarse_slack
+        # 颜色索引：第一次查询时按去重颜色把像素分组、按Lab把颜色分到格子，之后的查询只计算
+        # 色差下界不超过第N名的格子中的颜色，结果与整图查找完全相同
+        self.palette_index = palette_index
+
+        # 区域模式：色差不超过阈值的像素按8连通分组，返回面积不小于下限的区域
+        if match_mode not in MATCH_MODES:
+            raise ValueError(f"未知的结果类型 Unknown match mode: {match_mode!r}, expected one of {MATCH_MODES}")
+        self.match_mode = match_mode
+        self.region_threshold = region_threshold  # 区域色差阈值（ΔE）
+        self.region_min_area = region_min_area  # 区域最小面积（像素）
+
+        # Lab图像存储方式：'float32' / 'float16' / 'uint8'（修改后对下一次加载生效）
+        if lab_mode not in LAB_MODES:
+            raise ValueError(f"未知的Lab存储方式 Unknown Lab mode: {lab_mode!r}, expected one of {LAB_MODES}")
+        self.lab_mode = lab_mode
+        self._loaded_lab_mode = lab_mode  # 当前 lab_image 实际使用的存储方式
+
+    @property
+    def metric(self):
+        """色差公式：'cie76' / 'cie94' / 'ciede2000'"""
+        return self._metric
+
+    @metric.setter
+    def metric(self, value):
+        if value not in METRICS:
+            raise ValueError(f"未知的色差公式 Unknown metric: {value!r}, expected one of {METRICS}")
+        self._metric = value
+
+    @property
+    def has_image(self):
+        """是否已加载图片"""
+        return self.image_array is not None
+
+    @property
+    def size(self):
+        """图片尺寸 (宽, 高)"""
+        img_height, img_width = self.image_array.shape[:2]
+        return img_width, img_height
+
+    def decode_settings(self):
+        """影响解码与预计算结果的设置（作为缓存键的一部分）"""
+        return {'mode': 'RGB', 'lab': self.lab_mode, 'orientation': 'exif'}
+
+    def load_image(self, path):
+        """从文件加载图片（按 EXIF 方向摆正），返回PIL图片对象
+
+        启用缓存时，命中则以内存映射方式加载RGB与Lab数据，不再解码和转换。
+        """
+        prepared = self.prepare_image(path)
+        self.install(prepared)
+        return prepared['image']
+
+    def preview_factor(self, path):
+        """预览的缩小倍数（2的幂，只读文件头）；图片不超过 PREVIEW_PIXELS 时为1，不需要预览"""
+        with Image.open(path) as image:
+            pixels = image.width * image.height
+        factor = 1
+        while pixels > self.PREVIEW_PIXELS * factor ** 2:
+            factor *= 2
+        return factor
+
+    def load_preview(self, path, factor):
+        """载入长宽缩小 factor 倍的预览作为当前图片，之后的查找在预览上进行（坐标为预览坐标）
+
+        返回 (预览图片, 原图尺寸, 整幅图片或None)；整幅图片（非JPEG时已解码）交给 prepare_image 不必再解码。
+        """
+        image, full_size, full = decode_image(path, factor, self.tracer)
+        self.set_image(np.asarray(image))
+        self.image_path = path
+        return image, full_size, full
+
+    def prepare_image(self, path, image=None, checkpoint=None):
+        """解码并预计算Lab和块上下界，返回交给 install() 的字典；不修改引擎状态，可在后台线程中执行
+
+        image 为已解码并摆正的RGB图片时不再解码。启用缓存时命中则内存映射加载，否则写入缓存。
+        各步骤之间调用 checkpoint()，抛出 SearchCancelled 可中止。
+        """
+        checkpoint = checkpoint or (lambda: None)
+        lab_mode = self.lab_mode
+        cache_key = self.cache.key(path, self.decode_settings()) if self.cache else None
+        cached = None
+        if cache_key:
+            with self.tracer.span('cache_load') as span:
+                cached = self.cache.load(cache_key, ['rgb', 'lab'])
+                span.set(hit=cached is not None)
+        if cached is not None:
+            rgb, lab = cached['rgb'], cached['lab']
+            return {'path': path, 'image': Image.fromarray(np.asarray(rgb)), 'rgb': rgb, 'lab': lab,
+                    'lab_mode': lab_mode, 'tiles': self._tiles_for(lab), 'cache_key': cache_key}
+
+        checkpoint()
+        if image is None:
+            image = decode_image(path, tracer=self.tracer)[0]
+        # asarray 只复制一次像素（np.array 会再复制一次），得到只读数组
+        rgb = np.asarray(image)
+        checkpoint()
+        lab = self._lab_for(rgb, lab_mode)
+        checkpoint()
+        tiles = self._tiles_for(lab)
+        if cache_key:
+            with self.tracer.span('cache_store'):
+                self.cache.store(cache_key, {'rgb': rgb, 'lab': lab})
+        return {'path': path, 'image': image, 'rgb': rgb, 'lab': lab, 'lab_mode': lab_mode, 'tiles': tiles,
+                'cache_key': cache_key}
+
+    def install(self, prepared):
+        """使用 prepare_image() 的结果作为当前图片（丢弃之前图片的派生数据）"""
+        self.image_path = prepared['path']
+        self.image_array = prepared['rgb']
+        self.lab_image = prepared['lab']
+        self._reset_derived()
+        self._tiles = prepared['tiles']
+        self._cache_key = prepared['cache_key']
+        self._loaded_lab_mode = prepared['lab_mode']
+
+    def set_image(self, image_array):
+        """设置RGB图片数组并预计算Lab颜色空间"""
+        self.image_array = np.ascontiguousarray(image_array, dtype=np.uint8)
+        self.image_path = None
+        self._reset_derived()
+        self._cache_key = None
+        self.lab_image = self._lab_for(self.image_array, self.lab_mode)
+        self._loaded_lab_mode = self.lab_mode
+        self._tiles = self._tiles_for(self.lab_image)
+
+    def _lab_for(self, rgb, lab_mode):
+        """预计算Lab颜色空间（用于更准确的颜色差异计算），按存储方式编码"""
+        with self.tracer.span('lab', pixels=rgb.shape[0] * rgb.shape[1], mode=lab_mode):
+            return srgb_to_lab(rgb, lab_mode)
+
+    def clear_image(self):
+        """释放图片及所有预计算数据"""
+        self.image_path = None
+        self.image_array = None
+        self.lab_image = None
+        self._reset_derived()
+        self._cache_key = None
+        self._buffers = None
+
+    def _reset_derived(self):
+        """图片变化后丢弃按需构建的派生数据"""
+        self._color_table = None
+        self._integrals = {}
+        self._neighborhood_lab = None
+        self._tiles = None
+        self._palette = None
+        self._region = None
+        self._distance_key = None
+
+    def _tiles_for(self, lab_image):
+        """大图在加载时构建块上下界，小图返回None"""
+        img_height, img_width = lab_image.shape[:2]
+        if img_height * img_width < self.COARSE_MIN_PIXELS:
+            return None
+        with self.tracer.span('tiles'):
+            return LabTileBounds(lab_image, self.TILE)
+
+    def forget_distances(self):
+        """不再复用缓冲区中的色差，下一次查找重新计算（测量耗时用）"""
+        self._distance_key = None
+
+    def _checkpoint(self, fraction=None):
+        if self.checkpoint is not None:
+            self.checkpoint(fraction)
+
+    @property
+    def thread_count(self):
+        """实际使用的线程数"""
+        return max(1, int(self.threads or os.cpu_count() or 1))
+
+    def _bands(self, height, width):
+        """把 height 行分成条带 [(y0, y1), ...]；线程数为1或像素太少时只有一个条带"""
+        count = min(self.thread_count * self.BANDS_PER_THREAD, height * width // self.PARALLEL_BAND_PIXELS)
+        if self.thread_count <= 1 or count <= 1:
+            return [(0, height)]
+        edges = np.linspace(0, height, count + 1).astype(int)
+        return [(int(y0), int(y1)) for y0, y1 in zip(edges[:-1], edges[1:]) if y1 > y0]
+
+    def _run_bands(self, height, width, func):
+        """在线程池中对每个条带调用 func(y0, y1)，按条带顺序返回结果
+
+        NumPy/cv2 的计算释放GIL，各条带真正并行。每完成一个条带经过一次检查点；
+        取消或出错时先等已开始的条带结束（它们写的是共用的缓冲区），再抛出异常。
+        """
+        bands = self._bands(height, width)
+        if len(bands) == 1:
+            return [func(0, height)]
+        threads = self.thread_count
+        if self._pool is None or self._pool[0] != threads:
+            if self._pool is not None:
+                self._pool[1].shutdown(wait=False)
+            self._pool = (threads, ThreadPoolExecutor(threads, thread_name_prefix='color-match-band'))
+        futures = [self._pool[1].submit(func, y0, y1) for y0, y1 in bands]
+        try:
+            results = []
+            for future in futures:
+                results.append(future.result())
+                self._checkpoint()
+            return results
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            wait(futures)
+            raise
+
+    def rgb_to_lab(self, rgb):
+        """将RGB颜色转换为Lab颜色空间，返回 [L, a, b] 数组（与Lab图像同一公式）"""
+        return srgb_to_lab(np.asarray(rgb, dtype=np.float64)).astype(np.float64)
+
+    def integral_image(self, space='rgb'):
+        """每张图片只构建一次的积分图，形状 (高+1, 宽+1, 3)，float64
+
+        space='rgb' 对RGB求和；space='lab' 对Lab求和（uint8存储时对编码值求和，取均值后再解码）。
+        """
+        import cv2
+        if space not in self._integrals:
+            if space == 'rgb':
+                source = self.image_array
+            elif space == 'lab':
+                source = self.lab_image
+                if source.dtype == np.float16:
+                    source = source.astype(np.float32)
+            else:
+                raise ValueError(f"未知的颜色空间 Unknown color space: {space!r}, expected 'rgb' or 'lab'")
+            self._integrals[space] = cv2.integral(np.ascontiguousarray(source), sdepth=cv2.CV_64F)
+        return self._integrals[space]
+
+    def _mean_from_sums(self, sums, count, space):
+        """由积分图求得的和计算平均颜色（Lab需要解码）"""
+        mean = sums / count
+        if space == 'lab':
+            mean = decode_lab(mean, self._loaded_lab_mode).astype(np.float64)
+        return mean
+
+    def box_mean(self, x0, y0, x1, y1, space='rgb'):
+        """矩形 [x0, x1) x [y0, y1) 内的平均颜色（常数时间），区域为空时返回None"""
+        img_width, img_height = self.size
+        x0, y0 = max(0, x0), max(0, y0)
+        x1, y1 = min(img_width, x1), min(img_height, y1)
+        if x0 >= x1 or y0 >= y1:
+            return None
+        table = self.integral_image(space)
+        sums = table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+        return self._mean_from_sums(sums, (x1 - x0) * (y1 - y0), space)
+
+    def disc_mean(self, center_x, center_y, radius, space='rgb'):
+        """圆内（距离 <= 半径）的平均颜色，区域为空时返回None
+
+        圆按行分解为 2r+1 个单行矩形，每行在积分图上查4个值，与像素数无关。
+        """
+        img_width, img_height = self.size
+        dy = np.arange(-radius, radius + 1)
+        ys = center_y + dy
+        half = np.floor(np.sqrt(np.maximum(radius ** 2 - dy ** 2, 0))).astype(np.intp)
+        x0 = np.maximum(center_x - half, 0)
+        x1 = np.minimum(center_x + half + 1, img_width)
+        keep = (ys >= 0) & (ys < img_height) & (x0 < x1)
+        if not keep.any():
+            return None
+        ys, x0, x1 = ys[keep], x0[keep], x1[keep]
+        table = self.integral_image(space)
+        sums = (table[ys + 1, x1] - table[ys, x1] - table[ys + 1, x0] + table[ys, x0]).sum(axis=0)
+        return self._mean_from_sums(sums, int((x1 - x0).sum()), space)
+
+    def circle_mean_color(self, center_x, center_y, radius):
+        """计算圆形区域内的平均RGB颜色，区域为空时返回None
+
+        积分图已构建时直接查表；否则只在圆的外接矩形内计算，不为单次取样构建整幅积分图。
+        """
+        if 'rgb' in self._integrals:
+            return self.disc_mean(center_x, center_y, radius)
+
+        img_height, img_width = self.image_array.shape[:2]
+        # 只在圆的外接矩形内计算mask
+        y0 = max(0, center_y - radius)
+        y1 = min(img_height, center_y + radius + 1)
+        x0 = max(0, center_x - radius)
+        x1 = min(img_width, center_x + radius + 1)
+        if y0 >= y1 or x0 >= x1:
+            return None
+
+        y_indices, x_indices = np.ogrid[y0:y1, x0:x1]
+        mask = (y_indices - center_y) ** 2 + (x_indices - center_x) ** 2 <= radius ** 2
+        pixels_in_circle = self.image_array[y0:y1, x0:x1][mask]
+        if len(pixels_in_circle) == 0:
+            return None
+        return np.mean(pixels_in_circle, axis=0)
+
+    @staticmethod
+    def neighborhood_half_width(radius):
+        """与半径为 radius 的取样圆面积相同的方窗半宽（窗口边长 2h+1）"""
+        return max(0, int(round((radius * np.sqrt(np.pi) - 1) / 2)))
+
+    def neighborhood_lab(self, half_width):
+        """每个像素以其为中心、边长 2h+1 的方窗平均颜色的Lab图像（float32，按窗口缓存最近一个）
+
+        窗口在图片边缘截断，只对图内像素求平均；平均在RGB上进行，与圆形取样的目标颜色一致。
+        """
+        if self._neighborhood_lab is not None and self._neighborhood_lab[0] == half_width:
+            return self._neighborhood_lab[1]
+
+        with self.tracer.span('neighborhood', half_width=half_width):
+            table = self.integral_image('rgb')
+            img_width, img_height = self.size
+            cols = np.arange(img_width)
+            x0 = np.maximum(cols - half_width, 0)
+            x1 = np.minimum(cols + half_width + 1, img_width)
+            result = np.empty((img_height, img_width, 3), dtype=np.float32)
+            # 分行块计算，控制临时数组大小
+            rows_per_chunk = max(1, (1 << 20) // max(img_width, 1))
+            for start in range(0, img_height, rows_per_chunk):
+                # 中止时不保存未完成的结果
+                self._checkpoint()
+                rows = np.arange(start, min(start + rows_per_chunk, img_height))
+                y0 = np.maximum(rows - half_width, 0)[:, None]
+                y1 = np.minimum(rows + half_width + 1, img_height)[:, None]
+                sums = table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+                counts = ((y1 - y0) * (x1 - x0))[..., None]
+                result[start:start + len(rows)] = srgb_to_lab(sums / counts)
+        self._neighborhood_lab = (half_width, result)
+        return result
+
+    def find_similar_colors(self, x, y, lasso_points=None):
+        """查找相似颜色位置（单点模式）；lasso_points 为套索点列表或组合范围 RegionSet"""
+        if self.image_array is None:
+            return []
+
+        with self.tracer.span('query', sample='point', x=x, y=y):
+            # 获取选中的颜色
+            target_rgb = self.image_array[y, x]
+            self.last_target_rgb = tuple(int(c) for c in target_rgb)
+            target_lab_array = self.rgb_to_lab(target_rgb)
+
+            # 排除点击位置附近的像素（距离 < min_distance）
+            exclusion = (x, y, self.min_distance, False)
+            return self._rank(target_lab_array, exclusion, lasso_points)
+
+    def find_similar_colors_by_circle(self, center_x, center_y, radius, lasso_points=None):
+        """查找与圆形区域平均颜色相似的位置"""
+        if self.image_array is None:
+            return []
+
+        with self.tracer.span('query', sample='circle', x=center_x, y=center_y, radius=radius):
+            # 计算圆内区域的平均颜色
+            avg_color = self.circle_mean_color(center_x, center_y, radius)
+            self.last_target_rgb = None if avg_color is None else tuple(float(c) for c in avg_color)
+            if avg_color is None:
+                return []
+            target_lab_array = self.rgb_to_lab(avg_color)
+
+            # 排除圆形取样区域（距离 <= 半径 + min_distance）
+            exclusion = (center_x, center_y, radius + self.min_distance, True)
+            lab_source = None
+            if self.neighborhood:
+                lab_source = self.neighborhood_lab(self.neighborhood_half_width(radius))
+            return self._rank(target_lab_array, exclusion, lasso_points, lab_source)
+
+    def sample_target(self, sample):
+        """取样的目标颜色：返回 (RGB, Lab, 排除范围, 邻域平均Lab或None)，圆内没有像素时返回None
+
+        sample 与命令行取样相同：point（x, y）、circle（x, y, radius），或 color（rgb 或 lab，不排除任何位置）。
+        """
+        if sample['type'] == 'color':
+            target_lab_array = (np.asarray(sample['lab'], dtype=np.float64) if sample.get('lab') is not None
+                                else self.rgb_to_lab(sample['rgb']))
+            rgb = None if sample.get('rgb') is None else tuple(sample['rgb'])
+            return rgb, target_lab_array, (0, 0, 0, False), None
+        if sample['type'] == 'circle':
+            center_x, center_y, radius = sample['x'], sample['y'], sample['radius']
+            avg_color = self.circle_mean_color(center_x, center_y, radius)
+            if avg_color is None:
+                return None
+            lab_source = None
+            if self.neighborhood:
+                lab_source = self.neighborhood_lab(self.neighborhood_half_width(radius))
+            return (tuple(float(c) for c in avg_color), self.rgb_to_lab(avg_color),
+                    (center_x, center_y, radius + self.min_distance, True), lab_source)
+        target_rgb = self.image_array[sample['y'], sample['x']]
+        return (tuple(int(c) for c in target_rgb), self.rgb_to_lab(target_rgb),
+                (sample['x'], sample['y'], self.min_distance, False), None)
+
+    def find_multi_target(self, samples, lasso_points=None, max_distance=None):
+        """多目标查找：一次计算每个像素最近的目标（分类图），并返回每个目标最相似的N个位置
+
+        返回 (results, labels)：results[k] 为 {'target_rgb', 'matches', 'pixels'}（pixels 为分到该目标的像素数），
+        labels 为 int16 数组，值为最近目标的编号，搜索范围外或色差超过 max_distance 时为 -1。
+        最近目标在去重颜色上计算（代价为 颜色数×目标数），整幅图片只查表一次，与目标数无关；
+        各目标的前N名用颜色索引查找，与逐个查找的结果相同。
+        """
+        if self.image_array is None:
+            return [], None
+        if len(samples) > np.iinfo(np.int16).max:
+            raise ValueError(f"目标太多 Too many targets: {len(samples)}")
+        with self.tracer.span('query', sample='multi', targets=len(samples)):
+            targets = [self.sample_target(sample) for sample in samples]
+
+            index = self.palette()
+            with self.tracer.span('nearest_targets', colors=len(index.pixel_offsets) - 1):
+                nearest, nearest_d2 = self._nearest_targets(index, [None if t is None else t[1] for t in targets])
+            if max_distance is not None:
+                nearest[nearest_d2 > np.float32(max_distance) ** 2] = -1
+
+            # 分类图：每个像素查一次所属颜色的最近目标，只填搜索范围的外接矩形
+            labels = np.full(self.image_array.shape[:2], -1, dtype=np.int16)
+            region = self.search_region(lasso_points)
+            if region is None or not region.empty:
+                window = np.s_[:, :] if region is None else np.s_[region.y0:region.y1, region.x0:region.x1]
+                inside = np.take(nearest, self.color_table().inverse[window])
+                if region is not None:
+                    inside[~region.mask] = -1
+                labels[window] = inside
+                pixels = np.bincount(inside.ravel() + 1, minlength=len(targets) + 1)[1:]
+            else:
+                pixels = np.zeros(len(targets), dtype=np.int64)
+
+            results = []
+            for k, target in enumerate(targets):
+                self._checkpoint(0.5 + k / len(targets) / 2)
+                if target is None:
+                    results.append({'target_rgb': None, 'matches': [], 'pixels': 0})
+                    continue
+                target_rgb, target_lab_array, exclusion, lab_source = target
+                matches = None
+                if lab_source is None and self.match_mode == 'pixels' and not self.distinct:
+                    matches = self._rank_palette(target_lab_array, exclusion, lasso_points)
+                if matches is None:
+                    matches = self._rank(target_lab_array, exclusion, lasso_points, lab_source)
+                results.append({'target_rgb': target_rgb, 'matches': matches, 'pixels': int(pixels[k])})
+            return results, labels
+
+    def _nearest_targets(self, index, target_labs):
+        """每种去重颜色最近的目标编号（int16）及色差平方；target_labs 中为None的目标不参与，同色差取编号小的"""
+        num_colors = len(index.pixel_offsets) - 1
+        nearest = np.full(num_colors, -1, dtype=np.int16)
+        nearest_d2 = np.full(num_colors, np.inf, dtype=np.float32)
+        for start in range(0, num_colors, self.MULTI_COLOR_CHUNK):
+            self._checkpoint(start / num_colors / 2)
+            colors = np.arange(start, min(start + self.MULTI_COLOR_CHUNK, num_colors))
+            lab = self._color_lab(index, colors)
+            best = nearest[start:start + len(colors)]
+            best_d2 = nearest_d2[start:start + len(colors)]
+            for k, target_lab_array in enumerate(target_labs):
+                if target_lab_array is None:
+                    continue
+                d2 = self._color_squared_distances(index, colors, target_lab_array, lab)
+                closer = d2 < best_d2
+                best_d2[closer] = d2[closer]
+                best[closer] = k
+        return nearest, nearest_d2
+
+    def color_table(self):
+        """每张图片只构建一次的去重颜色表"""
+        if self._color_table is None:
+            cached = self.cache.load(self._cache_key, ['color_inverse', 'color_lab']) if self._cache_key else None
+            if cached is not None:
+                self._color_table = ColorTable.from_arrays(cached['color_inverse'], cached['color_lab'])
+            else:
+                with self.tracer.span('color_table'):
+                    self._color_table = ColorTable(self.image_array)
+                if self._cache_key:
+                    self.cache.update(self._cache_key, {'color_inverse': self._color_table.inverse,
+                                                        'color_lab': self._color_table.lab})
+        return self._color_table
+
+    def palette(self):
+        """每张图片只构建一次的颜色索引"""
+        if self._palette is None:
+            names = ['palette_pixel_order', 'palette_pixel_offsets', 'palette_bin_colors', 'palette_bin_offsets']
+            cached = self.cache.load(self._cache_key, names) if self._cache_key else None
+            if cached is not None:
+                self._palette = PaletteIndex.from_arrays(*(cached[name] for name in names))
+            else:
+                color_table = self.color_table()
+                with self.tracer.span('palette_index'):
+                    self._palette = PaletteIndex(color_table)
+                if self._cache_key:
+                    self.cache.update(self._cache_key, {'palette_' + name: array
+                                                        for name, array in self._palette.arrays().items()})
+        return self._palette
+
+    def search_region(self, lasso_points):
+        """套索（点列表）或组合范围（RegionSet）对应的搜索范围，不变时复用上次的结果；没有范围返回None"""
+        if lasso_points is None or len(lasso_points) == 0:
+            return None
+        if isinstance(lasso_points, RegionSet):
+            with self.tracer.span('region', shapes=len(lasso_points)):
+                return lasso_points.region(self.image_array.shape)
+        if self._region is None or not self._region.matches(lasso_points, self.image_array.shape):
+            with self.tracer.span('region', points=len(lasso_points)):
+                self._region = SearchRegion(lasso_points, self.image_array.shape)
+        return self._region
+
+    @property
+    def lab_bytes(self):
+        """常驻的Lab相关数据字节数"""
+        total = 0 if self.lab_image is None else self.lab_image.nbytes
+        if self._color_table is not None:
+            total += self._color_table.inverse.nbytes + self._color_table.lab.nbytes
+        total += sum(table.nbytes for table in self._integrals.values())
+        if self._neighborhood_lab is not None:
+            total += self._neighborhood_lab[1].nbytes
+        if self._tiles is not None:
+            total += self._tiles.nbytes
+        if self._palette is not None:
+            total += self._palette.nbytes
+        return total
+
+    def _query_buffers(self):
+        """查询用的预分配缓冲区（每种图片尺寸只分配一次）
+
+        dist    - 色差的平方（未屏蔽，供结果取值）
+        work    - 屏蔽后参与排序的色差平方
+        scratch - 逐通道计算和选择第N小值时的临时区
+        select  - 布尔临时区
+        labels  - 区域模式的连通区域编号（按需分配）
+        """
+        shape = self.lab_image.shape[:2]
+        if self._buffers is None or self._buffers['dist'].shape != shape:
+            self._distance_key = None
+            self._buffers = {
+                'dist': np.empty(shape, dtype=np.float32),
+                'work': np.empty(shape, dtype=np.float32),
+                'scratch': np.empty(shape, dtype=np.float32),
+                'select': np.empty(shape, dtype=bool),
+            }
+        if self.match_mode == 'regions' and 'labels' not in self._buffers:
+            self._buffers['labels'] = np.empty(shape, dtype=np.int32)
+        return self._buffers
+
+    def _squared_distances(self, target_lab_array, out, scratch, lab_source=None, region=None):
+        """将整幅图片（或套索外接矩形内）与目标颜色的色差平方写入 out（不对全图开方），按行条带并行
+
+        lab_source 为邻域平均后的Lab图像（float32）时在其上计算，不使用去重颜色表。
+        """
+        x0, y0 = (0, 0) if region is None else (region.x0, region.y0)
+        x1 = x0 + out.shape[1]
+
+        if lab_source is not None and self.metric != 'cie76':
+            # 平均后的颜色不在去重颜色表中，分块直接计算
+            def band(r0, r1):
+                flat_lab = lab_source[y0 + r0:y0 + r1, x0:x1].reshape(-1, 3)
+                flat_out = out[r0:r1].ravel()
+                for start in range(0, flat_out.size, 1 << 20):
+                    self._checkpoint(start / flat_out.size)
+                    chunk = delta_e(flat_lab[start:start + (1 << 20)], target_lab_array, self.metric)
+                    flat_out[start:start + len(chunk)] = np.square(chunk)
+        elif self.metric != 'cie76':
+            # 其他公式在去重颜色上计算后查表
+            table = self.color_table().delta_e(target_lab_array, self.metric, squared=True)
+            inverse = self.color_table().inverse
+
+            def band(r0, r1):
+                np.take(table, inverse[y0 + r0:y0 + r1, x0:x1], out=out[r0:r1])
+        else:
+            # 欧氏距离直接在（可能是压缩存储的）Lab图像上逐通道计算
+            lab_image = self.lab_image if lab_source is None else lab_source
+            scale, offset = LAB_ENCODINGS[self._loaded_lab_mode if lab_source is None else 'float32']
+            target_encoded = np.asarray(target_lab_array, dtype=np.float64) * scale + offset
+
+            def band(r0, r1):
+                _encoded_squared_distances(lab_image[y0 + r0:y0 + r1, x0:x1], target_encoded, scale,
+                                           out[r0:r1], scratch[r0:r1])
+
+        self._run_bands(out.shape[0], out.shape[1], band)
+        return out
+
+    def distances(self, target_lab_array):
+        """整幅图片与目标颜色的色差（按当前色差公式，返回新数组）"""
+        out = np.empty(self.lab_image.shape[:2], dtype=np.float32)
+        self._squared_distances(target_lab_array, out, np.empty_like(out))
+        return np.sqrt(out, out=out)
+
+    @staticmethod
+    def _apply_exclusion(work, exclusion):
+        """只在外接矩形内屏蔽取样点周围的圆形区域"""
+        center_x, center_y, radius, inclusive = exclusion
+        img_height, img_width = work.shape
+        y0 = max(0, int(center_y - radius))
+        y1 = min(img_height, int(center_y + radius) + 1)
+        x0 = max(0, int(center_x - radius))
+        x1 = min(img_width, int(center_x + radius) + 1)
+        if y0 >= y1 or x0 >= x1:
+            return
+        y_indices, x_indices = np.ogrid[y0:y1, x0:x1]
+        d2 = (y_indices - center_y) ** 2 + (x_indices - center_x) ** 2
+        inside = d2 <= radius ** 2 if inclusive else d2 < radius ** 2
+        work[y0:y1, x0:x1][inside] = np.inf
+
+    @staticmethod
+    def _select_top(work, num, scratch, select):
+        """在缓冲区内选出最小的N个有限值，返回按值（同值按位置）排序的扁平索引"""
+        flat = work.ravel()
+        num = min(num, flat.size)
+        if num <= 0:
+            return np.empty(0, dtype=np.intp)
+
+        # 在临时区中原地部分排序得到第N小的值，再取出所有不大于它的位置
+        kth_buf = scratch.ravel()
+        np.copyto(kth_buf, flat)
+        kth_buf.partition(num - 1)
+        kth = kth_buf[num - 1]
+        if np.isinf(kth):
+            np.less(work, np.inf, out=select)
+        else:
+            np.less_equal(work, kth, out=select)
+        candidates = np.flatnonzero(select)
+        order = np.argsort(flat[candidates], kind='stable')[:num]
+        return candidates[order]
+
+    def _select_top_bands(self, work, num, scratch, select):
+        """与 _select_top 结果相同，按行条带并行：各条带选出自己的前N名，再按（色差, 位置）合并"""
+        height, width = work.shape
+        if len(self._bands(height, width)) == 1:
+            return self._select_top(work, num, scratch, select)
+
+        def band(r0, r1):
+            return self._select_top(work[r0:r1], num, scratch[r0:r1], select[r0:r1]) + r0 * width
+
+        candidates = np.concatenate(self._run_bands(height, width, band))
+        order = np.lexsort((candidates, work.ravel()[candidates]))[:num]
+        return candidates[order]
+
+    def _select_distinct(self, work, num, min_distance, scratch, select):
+        """非极大值抑制：按色差从小到大贪心选取，结果两两间距不小于 min_distance
+
+        只取色差最小的一批候选（不够时候选池扩大4倍，前缀顺序不变，继续处理新增部分）。
+        已选点周围半径略小于 min_distance 的圆画入抑制图，候选先按块向量化过滤，
+        剩下的再用边长为 min_distance 的网格精确检查相邻9格，不对整幅图片排序。
+        """
+        import cv2
+        if num <= 0:
+            return np.empty(0, dtype=np.intp)
+        if min_distance <= 0:
+            return self._select_top_bands(work, num, scratch, select)
+
+        img_width = work.shape[1]
+        valid = int(np.count_nonzero(np.less(work, np.inf, out=select)))
+        min_d2 = min_distance ** 2
+        # 抑制图中画的圆半径（保守地小于 min_distance，圆内的点一定被抑制）
+        paint_radius = min_distance - 2
+
+        grid = {}
+        chosen = []
+        processed = 0
+        pool_size = max(num * 32, 512)
+        while True:
+            pool_size = min(pool_size, valid)
+            candidates = self._select_top_bands(work, pool_size, scratch, select)
+
+            # 复用布尔缓冲区作为抑制图
+            suppressed_map = select.view(np.uint8)
+            suppressed_map[...] = 0
+            if paint_radius > 0:
+                for y, x in chosen:
+                    cv2.circle(suppressed_map, (x, y), paint_radius, 1, -1)
+
+            for start in range(processed, pool_size, self.NMS_CHUNK):
+                chunk = candidates[start:start + self.NMS_CHUNK]
+                chunk = chunk[suppressed_map.ravel()[chunk] == 0]
+                ys, xs = np.divmod(chunk, img_width)
+                for idx, y, x in zip(chunk.tolist(), ys.tolist(), xs.tolist()):
+                    cy, cx = y // min_distance, x // min_distance
+                    if any((py - y) ** 2 + (px - x) ** 2 < min_d2
+                           for gy in (cy - 1, cy, cy + 1) for gx in (cx - 1, cx, cx + 1)
+                           for py, px in grid.get((gy, gx), ())):
+                        continue
+                    grid.setdefault((cy, cx), []).append((y, x))
+                    chosen.append((y, x))
+                    if len(chosen) == num:
+                        return np.array([y * img_width + x for y, x in chosen], dtype=np.intp)
+                    if paint_radius > 0:
+                        cv2.circle(suppressed_map, (x, y), paint_radius, 1, -1)
+
+            processed = pool_size
+            if pool_size >= valid:
+                return np.array([y * img_width + x for y, x in chosen], dtype=np.intp)
+            pool_size *= 4
+
+    def _rank(self, target_lab_array, exclusion, lasso_points=None, lab_source=None):
+        """计算色差并返回搜索范围内最相似的N个位置"""
+        if lab_source is None and self.match_mode == 'pixels' and not self.distinct:
+            locations = None
+            if self.palette_index:
+                with self.tracer.span('palette_rank') as span:
+                    locations = self._rank_palette(target_lab_array, exclusion, lasso_points)
+                    span.set(hit=locations is not None)
+            if locations is None and self.coarse_to_fine and self._tiles is not None and self.metric == 'cie76':
+                with self.tracer.span('coarse_rank') as span:
+                    locations = self._rank_coarse_to_fine(target_lab_array, exclusion, lasso_points)
+                    span.set(hit=locations is not None)
+            if locations is not None:
+                return locations
+
+        region = self.search_region(lasso_points)
+        if region is not None and region.empty:
+            return []
+
+        # 有套索时只在外接矩形内计算，缓冲区取前面一段当作矩形大小的数组
+        buffers = self._query_buffers()
+        if region is not None:
+            buffers = {name: buffer.ravel()[:region.mask.size].reshape(region.shape)
+                       for name, buffer in buffers.items()}
+        origin = (0, 0) if region is None else (region.x0, region.y0)
+        # 同一目标、公式和范围的色差已在缓冲区中时（如只改了数量、间距或阈值）直接重新排序；
+        # 区域模式每次按当前阈值重新阈值化（阈值不在缓存键中）
+        key = (np.asarray(target_lab_array, dtype=np.float64).tobytes(), self.metric, self._loaded_lab_mode)
+        cached = self._distance_key
+        if cached is not None and cached[0] == key and cached[1] is lab_source and cached[2] is region:
+            dist = buffers['dist']
+        else:
+            self._distance_key = None
+            self._checkpoint(0.0)
+            with self.tracer.span('distances', metric=self.metric, pixels=buffers['dist'].size,
+                                  threads=len(self._bands(*buffers['dist'].shape))):
+                dist = self._squared_distances(target_lab_array, buffers['dist'], buffers['scratch'],
+                                               lab_source, region)
+            self._distance_key = (key, lab_source, region)
+        self._checkpoint(0.8)
+
+        # 屏蔽套索外（按条带并行）和取样点附近的像素
+        work = buffers['work']
+
+        def prepare(r0, r1):
+            np.copyto(work[r0:r1], dist[r0:r1])
+            if region is not None:
+                np.copyto(work[r0:r1], np.inf, where=~region.mask[r0:r1])
+
+        with self.tracer.span('mask'):
+            self._run_bands(work.shape[0], work.shape[1], prepare)
+            center_x, center_y, radius, inclusive = exclusion
+            self._apply_exclusion(work, (center_x - origin[0], center_y - origin[1], radius, inclusive))
+
+        if self.match_mode == 'regions':
+            with self.tracer.span('regions'):
+                return self._regions(work, dist, buffers, origin)
+
+        with self.tracer.span('select', distinct=self.distinct):
+            if self.distinct:
+                flat_indices = self._select_distinct(work, self.num_similar, self.min_distance,
+                                                     buffers['scratch'], buffers['select'])
+            else:
+                flat_indices = self._select_top_bands(work, self.num_similar, buffers['scratch'], buffers['select'])
+        values = dist.ravel()[flat_indices]
+        if region is not None:
+            ys, xs = np.divmod(flat_indices, region.shape[1])
+            flat_indices = (ys + region.y0) * self.image_array.shape[1] + xs + region.x0
+        return self._locations(flat_indices, values)
+
+    def _rank_coarse_to_fine(self, target_lab_array, exclusion, lasso_points=None):
+        """由粗到细查找最相似的N个位置；需要细化的块太多时返回None（改为整图计算）
+
+        按色差下界从小到大逐批细化块，当前第N名的色差（减去 coarse_slack）不大于
+        剩余块的下界时停止。同色差按位置排序，与整图查找的顺序一致。
+        """
+        num = self.num_similar
+        if num <= 0:
+            return []
+        tiles = self._tiles
+        tile = tiles.tile
+        img_height, img_width = tiles.shape
+        tile_rows, tile_cols = tiles.grid
+        scale, offset = LAB_ENCODINGS[self._loaded_lab_mode]
+        target_encoded = np.asarray(target_lab_array, dtype=np.float64) * scale + offset
+        bounds = tiles.lower_bounds(target_encoded, scale)
+
+        # 套索：外接矩形以外的块不参与
+        region = self.search_region(lasso_points)
+        if region is not None and region.empty:
+            return []
+        if region is not None:
+            lx0, ly0, lx1, ly1 = region.x0, region.y0, region.x1, region.y1
+            bounds[:ly0 // tile] = np.inf
+            bounds[(ly1 - 1) // tile + 1:] = np.inf
+            bounds[:, :lx0 // tile] = np.inf
+            bounds[:, (lx1 - 1) // tile + 1:] = np.inf
+
+        order = np.argsort(bounds, axis=None, kind='stable')
+        sorted_bounds = bounds.ravel()[order]
+        max_tiles = max(1, int(len(order) * self.COARSE_MAX_FRACTION))
+        # 容许浮点舍入：块下界按 float64 计算，像素色差按 float32 计算
+        slack = max(0.0, float(self.coarse_slack))
+
+        best_d2 = np.empty(0, dtype=np.float32)
+        best_idx = np.empty(0, dtype=np.intp)
+        start = 0
+        batch = 16
+        while start < len(order) and np.isfinite(sorted_bounds[start]):
+            if len(best_d2) == num:
+                kth = float(np.sqrt(best_d2[-1])) - slack
+                limit = kth * kth * (1 + 1e-5) + 1e-6
+                if kth < 0 or sorted_bounds[start] > limit:
+                    break
+                # 下界不超过当前第N名的块都可能需要细化，太多时尽早改为整图计算
+                # （已细化一定数量的块后再判断，开始时第N名的色差还偏大）
+                if start >= max_tiles // 8 and np.searchsorted(sorted_bounds, limit, side='right') > max_tiles:
+                    return None
+            if start >= max_tiles:
+                return None
+
+            self._checkpoint()
+            chosen = order[start:start + batch]
+            start += len(chosen)
+            batch *= 2
+            ty, tx = np.divmod(chosen, tile_cols)
+            ys, xs, d2 = self._refine_tiles(ty, tx, target_encoded, scale)
+            best_d2, best_idx = self._merge_candidates(best_d2, best_idx, ys, xs, d2, exclusion, region)
+
+        return self._locations(best_idx, best_d2)
+
+    def _rank_palette(self, target_lab_array, exclusion, lasso_points=None):
+        """用颜色索引查找最相似的N个位置；需要检查的像素太多时返回None
+
+        按目标到格子的色差下界从小到大逐批计算格子中各颜色的色差，当前第N名的色差不大于
+        剩余格子的下界时停止，结果与整图查找完全相同。同一颜色的像素色差相同，
+        按位置顺序取到N个未被排除的像素即可。
+        CIE94 的下界：ΔE94² ≥ ΔL² + (Δa² + Δb²) / SC²（SC ≥ SH ≥ 1，SC 只取决于目标颜色）；
+        CIEDE2000 没有简单的下界，一次计算全部颜色。
+        """
+        num = self.num_similar
+        if num <= 0:
+            return []
+        region = self.search_region(lasso_points)
+        if region is not None and region.empty:
+            return []
+
+        index = self.palette()
+        bins = index.occupied_bins()
+        if self.metric == 'ciede2000':
+            bounds = np.zeros(len(bins))
+        else:
+            gaps = index.gaps(bins, target_lab_array)
+            if self.metric == 'cie76' and self._loaded_lab_mode != 'float32':
+                # 欧氏距离在压缩存储的Lab上计算，下界扣除编码误差（uint8 半个量化步长，float16 在±128内不超过1/32）
+                scale = LAB_ENCODINGS[self._loaded_lab_mode][0]
+                error = 0.5 / scale if self._loaded_lab_mode == 'uint8' else np.full(3, 1 / 32)
+                gaps = np.maximum(gaps - error, 0)
+            if self.metric == 'cie94':
+                chroma_scale = 1 + 0.045 * float(np.hypot(target_lab_array[1], target_lab_array[2]))
+                bounds = gaps[:, 0] ** 2 + (gaps[:, 1] ** 2 + gaps[:, 2] ** 2) / chroma_scale ** 2
+            else:
+                bounds = (gaps ** 2).sum(axis=1)
+        order = np.argsort(bounds, kind='stable')
+        bins, sorted_bounds = bins[order], bounds[order]
+
+        img_width = self.image_array.shape[1]
+        max_pixels = max(num, int(self.lab_image.shape[0] * img_width * self.PALETTE_MAX_FRACTION))
+        rows = (0, None) if region is None else (region.y0 * img_width, region.y1 * img_width)
+        scanned = 0
+        best_d2 = np.empty(0, dtype=np.float32)
+        best_idx = np.empty(0, dtype=np.intp)
+        start = 0
+        batch = len(bins) if self.metric == 'ciede2000' else 1
+        while start < len(bins):
+            if len(best_d2) == num:
+                # 容许浮点舍入：格子下界按 float64 计算，颜色色差按 float32 计算
+                if sorted_bounds[start] > float(best_d2[-1]) * (1 + 1e-5) + 1e-6:
+                    break
+
+            self._checkpoint()
+            chosen = bins[start:start + batch]
+            start += len(chosen)
+            batch *= 2
+            colors = index.colors(chosen)
+            color_d2 = self._color_squared_distances(index, colors, target_lab_array)
+            order = np.argsort(color_d2, kind='stable')
+            colors, color_d2 = colors[order], color_d2[order]
+            # 颜色按色差从小到大逐批处理，批大小逐批加倍，前N名确定后后面的颜色直接跳过
+            first = 0
+            chunk = 1
+            while first < len(colors):
+                chunk_colors = colors[first:first + chunk]
+                chunk_d2 = color_d2[first:first + chunk]
+                first += chunk
+                chunk = min(chunk * 2, self.PALETTE_COLOR_CHUNK)
+                if len(best_d2) == num:
+                    count = np.searchsorted(chunk_d2, best_d2[-1], side='right')
+                    if count == 0:
+                        break
+                    chunk_colors, chunk_d2 = chunk_colors[:count], chunk_d2[:count]
+
+                # 同一颜色的像素色差相同，按位置顺序取到N个未被排除的像素即可（有套索时只取外接矩形所在的行）：
+                # 每轮向量化地从所有未取够的颜色各取一段，段长逐轮加倍
+                begins, ends = index.segments(chunk_colors, *rows)
+                found = np.zeros(len(chunk_colors), dtype=np.int64)
+                pending = np.arange(len(chunk_colors))
+                window = num
+                while len(pending):
+                    if len(best_d2) == num:
+                        pending = pending[chunk_d2[pending] <= best_d2[-1]]
+                    pixels, owner, counts = index.take(begins[pending], ends[pending], window)
+                    scanned += len(pixels)
+                    if scanned > max_pixels:
+                        return None
+                    pixels = pixels.astype(np.intp)
+                    ys, xs = np.divmod(pixels, img_width)
+                    keep = self._candidate_mask(ys, xs, exclusion, region)
+                    best_d2, best_idx = self._keep_top(best_d2, best_idx, chunk_d2[pending[owner[keep]]], pixels[keep])
+                    found[pending] += np.bincount(owner[keep], minlength=len(pending))
+                    begins[pending] += counts
+                    pending = pending[(found[pending] < num) & (begins[pending] < ends[pending])]
+                    window *= 2
+
+        return self._locations(best_idx, best_d2)
+
+    def _color_lab(self, index, colors):
+        """指定去重颜色的Lab：欧氏距离取每种颜色第一个像素在（可能是压缩存储的）Lab图像中的值，其他公式取颜色表"""
+        if self.metric != 'cie76':
+            return self.color_table().lab[colors]
+        return self.lab_image.reshape(-1, 3)[index.pixel_order[index.pixel_offsets[colors]]]
+
+    def _color_squared_distances(self, index, colors, target_lab_array, lab=None):
+        """指定去重颜色与目标的色差平方（float32），与整图查找中这些颜色的像素的值逐位相同
+
+        lab 为 _color_lab 的结果，多个目标共用时只取一次。
+        """
+        if lab is None:
+            lab = self._color_lab(index, colors)
+        if self.metric != 'cie76':
+            return np.square(delta_e(lab, target_lab_array, self.metric)).astype(np.float32)
+        scale, offset = LAB_ENCODINGS[self._loaded_lab_mode]
+        target_encoded = np.asarray(target_lab_array, dtype=np.float64) * scale + offset
+        out = np.empty(len(colors), dtype=np.float32)
+        return _encoded_squared_distances(lab, target_encoded, scale, out, np.empty_like(out))
+
+    def _candidate_mask(self, ys, xs, exclusion, region):
+        """与整图查找相同的排除条件：取样点周围的圆形区域以外，且在套索内"""
+        center_x, center_y, radius, inclusive = exclusion
+        ed2 = (ys - center_y) ** 2 + (xs - center_x) ** 2
+        keep = ed2 > radius ** 2 if inclusive else ed2 >= radius ** 2
+        if region is not None:
+            keep &= region.contains(ys, xs)
+        return keep
+
+    def _merge_candidates(self, best_d2, best_idx, ys, xs, d2, exclusion, region):
+        """候选像素按与整图查找相同的排除条件过滤后与当前前N名合并"""
+        num = self.num_similar
+        img_width = self.image_array.shape[1]
+        # 只保留可能进入前N名的像素
+        keep = np.isfinite(d2)
+        if len(best_d2) == num:
+            keep &= d2 <= best_d2[-1]
+        keep &= self._candidate_mask(ys, xs, exclusion, region)
+        return self._keep_top(best_d2, best_idx, d2[keep], ys[keep] * img_width + xs[keep])
+
+    def _keep_top(self, best_d2, best_idx, d2, flat_indices):
+        """与当前前N名合并，按（色差, 位置）排序保留前N名"""
+        all_d2 = np.concatenate([best_d2, d2])
+        all_idx = np.concatenate([best_idx, flat_indices])
+        top = np.lexsort((all_idx, all_d2))[:self.num_similar]
+        return all_d2[top], all_idx[top]
+
+    def _refine_tiles(self, tile_ys, tile_xs, target_encoded, scale):
+        """在全分辨率下计算指定块内所有像素的色差平方，返回 (行坐标, 列坐标, 色差平方)
+
+        完整的块通过分块视图整块取出，图片右、下边缘不完整的块逐像素取出。
+        """
+        tile = self._tiles.tile
+        img_height, img_width = self._tiles.shape
+        full_rows, full_cols = img_height // tile, img_width // tile
+        offsets = np.arange(tile)
+        is_full = (tile_ys < full_rows) & (tile_xs < full_cols)
+
+        parts = []
+        if is_full.any():
+            ty, tx = tile_ys[is_full], tile_xs[is_full]
+            tiled = self.lab_image[:full_rows * tile, :full_cols * tile].reshape(
+                full_rows, tile, full_cols, tile, 3)
+            block = tiled[ty, :, tx]  # (块数, tile, tile, 3)
+            ys = np.broadcast_to((ty * tile)[:, None, None] + offsets[None, :, None], block.shape[:3])
+            xs = np.broadcast_to((tx * tile)[:, None, None] + offsets[None, None, :], block.shape[:3])
+            parts.append((ys.ravel(), xs.ravel(), block.reshape(-1, 3)))
+        if not is_full.all():
+            ty, tx = tile_ys[~is_full], tile_xs[~is_full]
+            ys = (ty * tile)[:, None, None] + offsets[None, :, None]
+            xs = (tx * tile)[:, None, None] + offsets[None, None, :]
+            ys, xs = np.broadcast_arrays(ys, xs)
+            valid = (ys < img_height) & (xs < img_width)
+            ys, xs = ys[valid], xs[valid]
+            parts.append((ys, xs, self.lab_image[ys, xs]))
+
+        ys = np.concatenate([p[0] for p in parts])
+        xs = np.concatenate([p[1] for p in parts])
+        lab = np.concatenate([p[2] for p in parts]) if len(parts) > 1 else parts[0][2]
+        d2 = np.empty(len(ys), dtype=np.float32)
+        _encoded_squared_distances(lab, target_encoded, scale, d2, np.empty_like(d2))
+        return ys, xs, d2
+
+    def _regions(self, work, squared_dist, buffers, origin=(0, 0)):
+        """区域模式：阈值化、连通区域标记，再用 bincount 一次统计各区域的色差与平均颜色
+
+        work 可以是图片中左上角在 origin 的矩形部分（套索外接矩形），结果坐标换算回整幅图片。
+        """
+        import cv2
+        foreground = buffers['select']
+        np.less_equal(work, np.float32(self.region_threshold) ** 2, out=foreground)
+        count, labels, stats, centroids = cv2.connectedComponentsWithStats(
+            foreground.view(np.uint8), labels=buffers['labels'], connectivity=8, ltype=cv2.CV_32S)
+        if count <= 1:
+            return []
+
+        # 前景像素及其区域编号（0为背景）
+        pixels = np.flatnonzero(foreground)
+        pixel_labels = labels.ravel()[pixels]
+        area = stats[:, cv2.CC_STAT_AREA]
+        distance_sum = np.bincount(pixel_labels, weights=np.sqrt(squared_dist.ravel()[pixels]), minlength=count)
+
+        # 按面积从大到小排序（同面积平均色差小的优先），取前N个；零散的噪点不会排在前面
+        candidates = np.flatnonzero(area >= max(1, self.region_min_area))
+        candidates = candidates[candidates != 0]
+        mean_distance = distance_sum[candidates] / area[candidates]
+        order = np.lexsort((mean_distance, -area[candidates]))[:self.num_similar]
+        selected = candidates[order]
+        if len(selected) == 0:
+            return []
+
+        # 只对选中区域的像素统计平均Lab和RGB
+        slot = np.full(count, -1, dtype=np.intp)
+        slot[selected] = np.arange(len(selected))
+        pixel_slot = slot[pixel_labels]
+        keep = pixel_slot >= 0
+        pixels = pixels[keep]
+        pixel_slot = pixel_slot[keep]
+        if work.shape != self.image_array.shape[:2]:
+            ys, xs = np.divmod(pixels, work.shape[1])
+            pixels = (ys + origin[1]) * self.image_array.shape[1] + xs + origin[0]
+        lab_values = decode_lab(self.lab_image.reshape(-1, 3)[pixels], self._loaded_lab_mode)
+        rgb_values = self.image_array.reshape(-1, 3)[pixels]
+        sizes = area[selected].astype(np.float64)
+        mean_lab = np.stack([np.bincount(pixel_slot, weights=lab_values[:, c], minlength=len(selected))
+                             for c in range(3)], axis=-1) / sizes[:, None]
+        mean_rgb = np.stack([np.bincount(pixel_slot, weights=rgb_values[:, c], minlength=len(selected))
+                             for c in range(3)], axis=-1) / sizes[:, None]
+
+        regions = []
+        for i, label in enumerate(selected):
+            distance = float(distance_sum[label] / area[label])
+            left, top, width, height = (int(v) for v in stats[label, :4])
+            regions.append({
+                'x': int(round(centroids[label][0] + origin[0])),
+                'y': int(round(centroids[label][1] + origin[1])),
+                'rgb': tuple(int(round(c)) for c in mean_rgb[i]),
+                'similarity': max(0.0, 100 - distance * 2),
+                'distance': distance,
+                'area': int(area[label]),
+                'bbox': (left + origin[0], top + origin[1], width, height),
+                'mean_lab': tuple(round(float(c), 3) for c in mean_lab[i]),
+            })
+        return regions
+
+    def _locations(self, flat_indices, squared_values):
+        """将扁平索引及其色差平方转换为结果记录（只对N个结果开方）"""
+        img_width = self.image_array.shape[1]
+        locations = []
+        for idx, squared in zip(flat_indices, squared_values):
+            flat_y, flat_x = divmod(int(idx), img_width)
+            distance = float(np.sqrt(squared))
+            locations.append({
+                'x': flat_x,
+                'y': flat_y,
+                'rgb': tuple(int(c) for c in self.image_array[flat_y, flat_x]),
+                'similarity': max(0.0, 100 - distance * 2),
+                'distance': distance
+            })
+        return locations
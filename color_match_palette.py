@@ -0,0 +1,292 @@
+"""
+参考色卡
+功能：命名色块及预先转换好的Lab（标准比色卡、ColorChecker 等），磁盘上的色卡库，
+      取样颜色对色卡的分类，以及按色块标称值（如浓度）插值的估计读数
+
+色卡文件：
+    JSON - {"name": "甲醛", "unit": "mg/L", "swatches": [
+               {"name": "0.1", "rgb": [236, 230, 200], "value": 0.1},
+               {"name": "0.3", "hex": "#d9c98f", "value": 0.3, "lab": [81.2, 1.5, 27.9]}, ...]}
+           或只有色块列表；lab 为实测参考值（可选，默认由 rgb 换算）
+    CSV  - 表头含 name 以及 r,g,b 或 hex 列，可选 value 列
+
+命令行：
+    python color_match_palette.py import scale.json --name formaldehyde
+    python color_match_palette.py list
+    python color_match_palette.py delete formaldehyde
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from color_match_color import METRICS, delta_e, srgb_to_lab
+
+# 色卡库文件格式版本
+PALETTE_VERSION = 1
+
+
+def default_palette_dir():
+    """默认色卡库目录（遵循 XDG_DATA_HOME）"""
+    base = os.environ.get('XDG_DATA_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'share')
+    return os.path.join(base, 'color-match', 'palettes')
+
+
+def parse_hex(text):
+    """解析 #RRGGBB / RRGGBB"""
+    text = text.strip().lstrip('#')
+    if len(text) != 6:
+        raise ValueError(f"无效的颜色 Invalid hex color: {text!r}")
+    return tuple(int(text[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def _swatch(entry, position):
+    """色卡文件中的一项 -> (名称, RGB, 标称值, 实测Lab或None)"""
+    if entry.get('rgb') not in (None, ''):
+        rgb = tuple(int(round(float(c))) for c in entry['rgb'])
+    elif entry.get('hex'):
+        rgb = parse_hex(entry['hex'])
+    elif all(entry.get(c) not in (None, '') for c in 'rgb'):
+        rgb = tuple(int(round(float(entry[c]))) for c in 'rgb')
+    else:
+        raise ValueError(f"色块 {position} 缺少颜色 Swatch {position} has no rgb/hex color")
+    if len(rgb) != 3 or not all(0 <= c <= 255 for c in rgb):
+        raise ValueError(f"色块 {position} 的颜色无效 Swatch {position} has an invalid color: {rgb}")
+    value = entry.get('value')
+    value = np.nan if value in (None, '') else float(value)
+    lab = entry.get('lab')
+    if lab is not None and len(lab) != 3:
+        raise ValueError(f"色块 {position} 的Lab无效 Swatch {position} has an invalid Lab: {lab}")
+    return str(entry.get('name') or position), rgb, value, lab
+
+
+class SwatchPalette:
+    """参考色卡：命名色块的RGB、预先转换的Lab，以及可选的标称值（如浓度）"""
+
+    def __init__(self, name, names, rgb, lab=None, values=None, unit=''):
+        self.name = name
+        self.names = [str(n) for n in names]
+        self.rgb = np.asarray(rgb, dtype=np.uint8).reshape(-1, 3)
+        # 与引擎中取样颜色相同的换算（rgb_to_lab），多目标查找的结果与按RGB取样相同
+        self.lab = (srgb_to_lab(self.rgb.astype(np.float64)).astype(np.float64) if lab is None
+                    else np.asarray(lab, dtype=np.float64).reshape(-1, 3))
+        self.values = (np.full(len(self.rgb), np.nan) if values is None
+                       else np.asarray(values, dtype=np.float64).reshape(-1))
+        self.unit = unit
+        if not (len(self.names) == len(self.rgb) == len(self.lab) == len(self.values)):
+            raise ValueError("色块的名称、颜色、标称值数量不一致 Swatch arrays differ in length")
+
+    @classmethod
+    def read(cls, path, name=None):
+        """读取色卡文件（JSON/CSV）；name 默认为文件中的名称或文件名"""
+        meta = {}
+        if os.path.splitext(path)[1].lower() == '.csv':
+            with open(path, newline='', encoding='utf-8-sig') as f:
+                entries = [{key.strip().lower(): value for key, value in row.items() if key}
+                           for row in csv.DictReader(f)]
+        else:
+            with open(path, encoding='utf-8') as f:
+                entries = json.load(f)
+            if isinstance(entries, dict):
+                meta = entries
+                entries = entries.get('swatches', [])
+        swatches = [_swatch(entry, position) for position, entry in enumerate(entries, 1)]
+        if not swatches:
+            raise ValueError(f"色卡文件中没有色块 No swatches in {path}")
+        names, rgb, values, labs = zip(*swatches)
+        # 部分色块给出实测Lab时，其余色块由RGB换算
+        lab = None
+        if any(l is not None for l in labs):
+            computed = srgb_to_lab(np.asarray(rgb, dtype=np.float64)).astype(np.float64)
+            lab = [computed[i] if l is None else l for i, l in enumerate(labs)]
+        name = name or meta.get('name') or os.path.splitext(os.path.basename(path))[0]
+        return cls(name, names, rgb, lab, values, meta.get('unit', ''))
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """由色卡库文件中的数组构造"""
+        return cls(str(arrays['name']), arrays['names'], arrays['rgb'], arrays['lab'], arrays['values'],
+                   str(arrays['unit']))
+
+    def arrays(self):
+        """写入色卡库文件的数组"""
+        return {'version': np.array(PALETTE_VERSION), 'name': np.array(self.name), 'unit': np.array(self.unit),
+                'names': np.array(self.names, dtype=str), 'rgb': self.rgb, 'lab': self.lab, 'values': self.values}
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def has_values(self):
+        """至少两个色块有标称值时可以插值估计读数"""
+        return int(np.count_nonzero(np.isfinite(self.values))) >= 2
+
+    def samples(self):
+        """作为多目标查找的目标颜色（带预先转换的Lab，不再换算）"""
+        samples = []
+        for i, name in enumerate(self.names):
+            sample = {'type': 'color', 'name': name, 'rgb': tuple(int(c) for c in self.rgb[i]),
+                      'lab': tuple(float(c) for c in self.lab[i])}
+            if np.isfinite(self.values[i]):
+                sample['value'] = float(self.values[i])
+            samples.append(sample)
+        return samples
+
+    def distances(self, lab, metric='cie76'):
+        """颜色 (..., 3) 与每个色块的色差 (..., 色块数)，色块作为参考色；一次广播计算"""
+        return delta_e(np.asarray(lab, dtype=np.float64)[..., None, :], self.lab, metric)
+
+    def classify(self, lab, metric='cie76', count=3):
+        """取样颜色（Lab）最接近的色块，按色差从小到大：[{'index', 'name', 'distance', 'value'}, ...]"""
+        distances = self.distances(lab, metric)
+        order = np.argsort(distances, kind='stable')[:count]
+        return [{'index': int(i), 'name': self.names[i], 'distance': float(distances[i]),
+                 'value': None if np.isnan(self.values[i]) else float(self.values[i])} for i in order]
+
+    def estimate(self, lab, metric='cie76'):
+        """按标称值排序的色块连成折线（Lab空间），取样颜色投影到最近的一段上按比例插值
+
+        返回 {'value', 'low', 'high', 'fraction', 'distance'}：low/high 为所在一段两端的色块名称，
+        distance 为取样颜色到插值点的色差（越大说明越不像色卡上的颜色）；标称值不足两个时返回None。
+        """
+        known = np.flatnonzero(np.isfinite(self.values))
+        if len(known) < 2:
+            return None
+        order = known[np.argsort(self.values[known], kind='stable')]
+        start, end = self.lab[order[:-1]], self.lab[order[1:]]
+        query = np.asarray(lab, dtype=np.float64)
+        direction = end - start
+        length2 = (direction ** 2).sum(axis=1)
+        fraction = np.clip(((query - start) * direction).sum(axis=1) / np.where(length2 > 0, length2, 1), 0, 1)
+        points = start + fraction[:, None] * direction
+        distances = delta_e(query, points, metric)
+        best = int(np.argmin(distances))
+        low, high = order[best], order[best + 1]
+        value = self.values[low] + fraction[best] * (self.values[high] - self.values[low])
+        return {'value': float(value), 'low': self.names[low], 'high': self.names[high],
+                'fraction': float(fraction[best]), 'distance': float(distances[best])}
+
+
+class PaletteStore:
+    """磁盘上的色卡库：每个色卡一个 .npz 文件（名称、RGB、Lab、标称值），加载只需读几个小数组"""
+
+    def __init__(self, directory=None):
+        self.directory = directory or default_palette_dir()
+        os.makedirs(self.directory, exist_ok=True)
+        self._loaded = {}  # 名称 -> (文件修改时间, SwatchPalette)
+
+    def path(self, name):
+        if not name or os.path.basename(name) != name or name.startswith('.'):
+            raise ValueError(f"无效的色卡名称 Invalid palette name: {name!r}")
+        return os.path.join(self.directory, name + '.npz')
+
+    def names(self):
+        """色卡库中的色卡名称"""
+        return sorted(f[:-4] for f in os.listdir(self.directory) if f.endswith('.npz'))
+
+    def __contains__(self, name):
+        try:
+            return os.path.isfile(self.path(name))
+        except ValueError:
+            return False
+
+    def load(self, name):
+        """加载色卡（文件未变化时复用上次的结果）"""
+        path = self.path(name)
+        mtime = os.stat(path).st_mtime_ns
+        cached = self._loaded.get(name)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['version']) != PALETTE_VERSION:
+                raise ValueError(f"不支持的色卡版本 Unsupported palette version in {path}")
+            palette = SwatchPalette.from_arrays(data)
+        palette.name = name
+        self._loaded[name] = (mtime, palette)
+        return palette
+
+    def save(self, palette, name=None):
+        """保存色卡（先写临时文件再替换，不会留下不完整的文件）"""
+        name = name or palette.name
+        path = self.path(name)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **palette.arrays())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self._loaded.pop(name, None)
+        return path
+
+    def import_file(self, path, name=None):
+        """读取色卡文件并存入色卡库，返回色卡"""
+        palette = SwatchPalette.read(path, name)
+        self.save(palette)
+        return palette
+
+    def delete(self, name):
+        os.unlink(self.path(name))
+        self._loaded.pop(name, None)
+
+    def resolve(self, name_or_path):
+        """色卡库中的名称或色卡文件路径 -> 色卡"""
+        if os.path.isfile(name_or_path):
+            return SwatchPalette.read(name_or_path)
+        if name_or_path in self:
+            return self.load(name_or_path)
+        raise ValueError(f"找不到色卡 Palette not found: {name_or_path}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="参考色卡库 Reference palette library")
+    parser.add_argument('--dir', default=None, help="色卡库目录，默认 ~/.local/share/color-match/palettes Palette directory")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    import_parser = subparsers.add_parser('import', help="导入色卡文件 Import a JSON/CSV swatch file")
+    import_parser.add_argument('file')
+    import_parser.add_argument('--name', default=None, help="色卡名称，默认取文件中的名称或文件名")
+    subparsers.add_parser('list', help="列出色卡 List palettes")
+    delete_parser = subparsers.add_parser('delete', help="删除色卡 Delete a palette")
+    delete_parser.add_argument('name')
+    classify_parser = subparsers.add_parser('classify', help="对RGB颜色分类 Classify an RGB color")
+    classify_parser.add_argument('name')
+    classify_parser.add_argument('rgb', help="R,G,B 或 #RRGGBB")
+    classify_parser.add_argument('--metric', choices=METRICS, default='ciede2000')
+    args = parser.parse_args(argv)
+
+    store = PaletteStore(args.dir)
+    try:
+        if args.command == 'import':
+            palette = store.import_file(args.file, args.name)
+            print(f"{palette.name}: {len(palette)} 个色块 swatches -> {store.path(palette.name)}")
+        elif args.command == 'list':
+            for name in store.names():
+                palette = store.load(name)
+                unit = f" ({palette.unit})" if palette.unit else ''
+                print(f"{name}: {len(palette)} 个色块 swatches{unit}")
+        elif args.command == 'delete':
+            store.delete(args.name)
+        else:
+            palette = store.resolve(args.name)
+            rgb = parse_hex(args.rgb) if ',' not in args.rgb else tuple(float(c) for c in args.rgb.split(','))
+            lab = srgb_to_lab(np.asarray(rgb, dtype=np.float64)).astype(np.float64)
+            for match in palette.classify(lab, args.metric):
+                print(f"{match['name']}: ΔE {match['distance']:.2f}")
+            estimate = palette.estimate(lab, args.metric)
+            if estimate is not None:
+                print(f"估计 Estimate: {estimate['value']:.4g} {palette.unit} "
+                      f"({estimate['low']}–{estimate['high']}, ΔE {estimate['distance']:.2f})")
+    except (OSError, ValueError) as e:
+        print(f"错误 Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
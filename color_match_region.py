@@ -0,0 +1,290 @@
+"""
+搜索范围
+功能：套索（多边形）搜索范围，以及由多边形、圆形、矩形按并入/挖去组合而成的搜索范围集合，
+      均按外接矩形缓存填充结果，供引擎与流式查找使用
+"""
+
+import numpy as np
+# OpenCV 在函数内用到时才导入（见 color_match_engine 开头的说明）
+
+# 可组合的形状
+REGION_SHAPES = ('polygon', 'circle', 'rect')
+
+
+class SearchRegion:
+    """搜索范围：外接矩形（已裁剪到图片内）及矩形内的填充结果
+
+    同一范围的多次查询共用一个对象，不必每次重新填充；整图查找只在外接矩形内计算。
+    """
+
+    def __init__(self, lasso_points=None, image_shape=None):
+        import cv2
+        if lasso_points is None:
+            return
+        img_height, img_width = image_shape[:2]
+        self.points = np.array(lasso_points, dtype=np.int32).reshape((-1, 2))
+        self.image_shape = (img_height, img_width)
+        x0, y0 = np.maximum(self.points.min(axis=0), 0)
+        x1, y1 = np.minimum(self.points.max(axis=0) + 1, (img_width, img_height))
+        self.x0, self.y0 = int(x0), int(y0)
+        self.x1, self.y1 = max(int(x1), self.x0), max(int(y1), self.y0)
+        mask = np.zeros(self.shape, dtype=np.uint8)
+        if not self.empty:
+            cv2.fillPoly(mask, [(self.points - (self.x0, self.y0)).reshape((-1, 1, 2))], 1)
+        self.mask = mask.view(bool)
+        self.area = int(np.count_nonzero(self.mask))
+
+    @classmethod
+    def from_mask(cls, x0, y0, mask, image_shape):
+        """由左上角在 (x0, y0) 的布尔数组构造（如组合后的范围）"""
+        region = cls()
+        region.points = None
+        region.image_shape = tuple(image_shape[:2])
+        region.x0, region.y0 = int(x0), int(y0)
+        region.x1, region.y1 = region.x0 + mask.shape[1], region.y0 + mask.shape[0]
+        region.mask = mask
+        region.area = int(np.count_nonzero(mask))
+        return region
+
+    def matches(self, lasso_points, image_shape):
+        """是否与给定的套索和图片尺寸相同（可以复用）"""
+        if self.points is None:
+            return False
+        points = np.array(lasso_points, dtype=np.int32).reshape((-1, 2))
+        return self.image_shape == tuple(image_shape[:2]) and np.array_equal(points, self.points)
+
+    @property
+    def shape(self):
+        """外接矩形的行数、列数"""
+        return self.y1 - self.y0, self.x1 - self.x0
+
+    @property
+    def empty(self):
+        """范围内没有像素（外接矩形为空）"""
+        return self.x0 >= self.x1 or self.y0 >= self.y1
+
+    @property
+    def nbytes(self):
+        return self.mask.nbytes
+
+    def contains(self, ys, xs):
+        """坐标是否在范围内"""
+        inside = (ys >= self.y0) & (ys < self.y1) & (xs >= self.x0) & (xs < self.x1)
+        inside[inside] = self.mask[ys[inside] - self.y0, xs[inside] - self.x0]
+        return inside
+
+
+def _shape_bounds(kind, params):
+    """形状的外接矩形 (左, 上, 右, 下)，右、下不含，未裁剪"""
+    if kind == 'polygon':
+        points = np.asarray(params)
+        x0, y0 = points.min(axis=0)
+        x1, y1 = points.max(axis=0) + 1
+    elif kind == 'circle':
+        cx, cy, radius = params
+        x0, y0 = int(np.ceil(cx - radius)), int(np.ceil(cy - radius))
+        x1, y1 = int(np.floor(cx + radius)) + 1, int(np.floor(cy + radius)) + 1
+    else:
+        x0, y0, x1, y1 = params
+        x1, y1 = x1 + 1, y1 + 1
+    return int(x0), int(y0), int(x1), int(y1)
+
+
+def _fill_shape(kind, params, out, x0, y0):
+    """把形状填入左上角在图片 (x0, y0) 的 uint8 数组（1=形状内）"""
+    import cv2
+    if kind == 'polygon':
+        points = np.asarray(params, dtype=np.int32)
+        cv2.fillPoly(out, [(points - (x0, y0)).reshape((-1, 1, 2))], 1)
+    elif kind == 'circle':
+        # 与圆形取样相同：到圆心的距离不超过半径
+        cx, cy, radius = params
+        ys, xs = np.ogrid[y0:y0 + out.shape[0], x0:x0 + out.shape[1]]
+        out[(xs - cx) ** 2 + (ys - cy) ** 2 <= radius ** 2] = 1
+    else:
+        rx0, ry0, rx1, ry1 = params
+        out[max(ry0 - y0, 0):max(ry1 + 1 - y0, 0), max(rx0 - x0, 0):max(rx1 + 1 - x0, 0)] = 1
+
+
+class RegionSet:
+    """组合搜索范围：按顺序并入（include）或挖去（exclude）多边形、圆形、矩形
+
+    第一个形状是挖去时从整幅图片开始。每个形状只在自己的外接矩形内填充一次，
+    按位打包（每字节8个像素，左边界按8对齐）后缓存；组合时在并入形状的外接矩形并集内
+    按字节做或、与非运算。形状和图片尺寸不变时直接复用组合结果。
+    """
+
+    def __init__(self, shapes=()):
+        self.shapes = []  # (形状, 参数, 是否挖去)
+        self._packed = {}  # (形状, 参数, 图片尺寸) -> (上, 左字节列, 打包的填充结果)
+        self._region = None  # 最近一次组合的结果 (图片尺寸, SearchRegion)
+        for shape in shapes:
+            self.add(*shape)
+
+    def add(self, kind, params, exclude=False):
+        """添加形状：polygon 为点列表，circle 为 (圆心x, 圆心y, 半径)，rect 为 (x0, y0, x1, y1)（含两端）"""
+        if kind not in REGION_SHAPES:
+            raise ValueError(f"未知的形状 Unknown region shape: {kind!r}, expected one of {REGION_SHAPES}")
+        if kind == 'polygon':
+            params = tuple((int(x), int(y)) for x, y in params)
+            if len(params) < 3:
+                raise ValueError("多边形至少需要3个点 A polygon needs at least 3 points")
+        elif kind == 'circle':
+            params = tuple(float(v) for v in params)
+        else:
+            x0, y0, x1, y1 = (int(v) for v in params)
+            params = (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+        self.shapes.append((kind, params, bool(exclude)))
+        self._region = None
+
+    def add_polygon(self, points, exclude=False):
+        self.add('polygon', points, exclude)
+
+    def add_circle(self, center_x, center_y, radius, exclude=False):
+        self.add('circle', (center_x, center_y, radius), exclude)
+
+    def add_rect(self, x0, y0, x1, y1, exclude=False):
+        self.add('rect', (x0, y0, x1, y1), exclude)
+
+    def pop(self):
+        """删除最后添加的形状"""
+        shape = self.shapes.pop()
+        self._region = None
+        return shape
+
+    def clear(self):
+        self.shapes = []
+        self._packed = {}
+        self._region = None
+
+    def __len__(self):
+        return len(self.shapes)
+
+    def snapshot(self):
+        """当前形状的副本（共用已填充的形状），之后对本对象的修改不影响副本，可交给后台线程查找"""
+        copy = RegionSet()
+        copy.shapes = list(self.shapes)
+        copy._packed = self._packed
+        return copy
+
+    def scaled(self, scale_x, scale_y):
+        """坐标按比例换算后的新组合范围（预览坐标换算到全分辨率等），圆的半径按两个比例的平均值"""
+        shapes = []
+        for kind, params, exclude in self.shapes:
+            if kind == 'polygon':
+                params = [(int((x + 0.5) * scale_x), int((y + 0.5) * scale_y)) for x, y in params]
+            elif kind == 'circle':
+                cx, cy, radius = params
+                params = ((cx + 0.5) * scale_x - 0.5, (cy + 0.5) * scale_y - 0.5, radius * (scale_x + scale_y) / 2)
+            else:
+                x0, y0, x1, y1 = params
+                params = (int(x0 * scale_x), int(y0 * scale_y), int((x1 + 1) * scale_x) - 1, int((y1 + 1) * scale_y) - 1)
+            shapes.append((kind, params, exclude))
+        return RegionSet(shapes)
+
+    def __getstate__(self):
+        # 传给工作进程时不带缓存
+        return {'shapes': self.shapes}
+
+    def __setstate__(self, state):
+        self.__init__(state['shapes'])
+
+    def counts(self):
+        """(并入形状数, 挖去形状数)"""
+        excluded = sum(1 for _, _, exclude in self.shapes if exclude)
+        return len(self.shapes) - excluded, excluded
+
+    def to_list(self):
+        """可写入JSON的形状列表"""
+        return [{'shape': kind, 'params': [list(p) for p in params] if kind == 'polygon' else list(params),
+                 'exclude': exclude} for kind, params, exclude in self.shapes]
+
+    def _packed_shape(self, kind, params, image_shape):
+        """形状在图片内的按位打包填充结果 (上, 左字节列, 数组)，完全在图片外时为None"""
+        key = (kind, params, image_shape)
+        if key not in self._packed:
+            img_height, img_width = image_shape
+            x0, y0, x1, y1 = _shape_bounds(kind, params)
+            x0, y0 = max(x0, 0) // 8 * 8, max(y0, 0)
+            x1, y1 = min(x1, img_width), min(y1, img_height)
+            packed = None
+            if x0 < x1 and y0 < y1:
+                mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+                _fill_shape(kind, params, mask, x0, y0)
+                packed = (y0, x0 // 8, np.packbits(mask, axis=1))
+            self._packed[key] = packed
+        return self._packed[key]
+
+    def region(self, image_shape):
+        """组合后的搜索范围（SearchRegion），按图片尺寸缓存"""
+        image_shape = tuple(image_shape[:2])
+        if self._region is not None and self._region[0] == image_shape:
+            return self._region[1]
+        img_height, img_width = image_shape
+        row_bytes = (img_width + 7) // 8
+
+        # 画布：第一个形状是挖去时为整幅图片，否则为并入形状的外接矩形并集
+        parts = [(exclude, self._packed_shape(kind, params, image_shape)) for kind, params, exclude in self.shapes]
+        if parts and parts[0][0]:
+            top, left, bottom, right = 0, 0, img_height, row_bytes
+            canvas = np.full((img_height, row_bytes), 0xFF, dtype=np.uint8)
+        else:
+            boxes = [(p[0], p[1], p[0] + p[2].shape[0], p[1] + p[2].shape[1])
+                     for exclude, p in parts if not exclude and p is not None]
+            top, left = (min(b[0] for b in boxes), min(b[1] for b in boxes)) if boxes else (0, 0)
+            bottom, right = (max(b[2] for b in boxes), max(b[3] for b in boxes)) if boxes else (0, 0)
+            canvas = np.zeros((bottom - top, right - left), dtype=np.uint8)
+
+        # 按顺序在重叠部分按字节合并
+        for exclude, packed in parts:
+            if packed is None:
+                continue
+            y0, b0, bits = packed
+            ty0, ty1 = max(y0, top), min(y0 + bits.shape[0], bottom)
+            tb0, tb1 = max(b0, left), min(b0 + bits.shape[1], right)
+            if ty0 >= ty1 or tb0 >= tb1:
+                continue
+            target = canvas[ty0 - top:ty1 - top, tb0 - left:tb1 - left]
+            source = bits[ty0 - y0:ty1 - y0, tb0 - b0:tb1 - b0]
+            if exclude:
+                target &= ~source
+            else:
+                target |= source
+
+        # 展开并裁剪到有像素的外接矩形
+        mask = np.unpackbits(canvas, axis=1)[:, :img_width - left * 8].view(bool)
+        rows = np.flatnonzero(mask.any(axis=1))
+        cols = np.flatnonzero(mask.any(axis=0))
+        if len(rows) == 0:
+            result = SearchRegion.from_mask(0, 0, np.zeros((0, 0), dtype=bool), image_shape)
+        else:
+            mask = mask[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+            result = SearchRegion.from_mask(left * 8 + cols[0], top + rows[0], np.ascontiguousarray(mask),
+                                            image_shape)
+        self._region = (image_shape, result)
+        return result
+
+    def row_range(self, image_shape):
+        """可能有像素的行范围 [first, last)"""
+        img_height = image_shape[0]
+        if self.shapes and self.shapes[0][2]:
+            return 0, img_height
+        rows = [_shape_bounds(kind, params)[1::2] for kind, params, exclude in self.shapes if not exclude]
+        if not rows:
+            return 0, 0
+        return max(0, min(r[0] for r in rows)), min(img_height, max(r[1] for r in rows))
+
+    def rows(self, y0, y1, img_width):
+        """图片第 y0 到 y1 行（全宽）的范围，用于按行条带处理（每个形状直接填入条带）"""
+        strip = np.zeros((y1 - y0, img_width), dtype=np.uint8)
+        if self.shapes and self.shapes[0][2]:
+            strip[...] = 1
+        shape_mask = np.empty_like(strip)
+        for kind, params, exclude in self.shapes:
+            shape_mask[...] = 0
+            _fill_shape(kind, params, shape_mask, 0, y0)
+            if exclude:
+                strip[shape_mask == 1] = 0
+            else:
+                strip |= shape_mask
+        return strip.view(bool)
@@ -0,0 +1,413 @@
+"""
+流式（按行条带）查找
+功能：按行条带读取、转换和查找，不在内存中保留整幅Lab图像，用于超出内存的超大图片（拼接全景等）。
+      未压缩的 BMP/PPM/TIFF 直接从文件按行读取；其他格式先整幅解码为8位RGB（3字节/像素，计入内存预算）。
+      像素模式在条带间维护前N名，区域模式跨条带合并连通区域及其统计量。
+"""
+
+import numpy as np
+from PIL import Image
+# OpenCV 在函数内用到时才导入（见 color_match_engine 开头的说明）
+
+from color_match_color import LAB_ENCODINGS, delta_e, srgb_to_lab
+from color_match_engine import ColorSearchEngine, _encoded_squared_distances, decode_image, exif_orientation
+from color_match_region import RegionSet
+
+DEFAULT_MEMORY_BUDGET = 256 * 1024 ** 2
+
+# 每个条带像素的工作内存（字节）：RGB 3 + 读取缓冲 6 + Lab 12 + 缓冲区 4*3 + 1 + 搜索范围 3，
+# 加上 srgb_to_lab 分块转换的临时数组（约 75）
+STRIP_BYTES_PER_PIXEL = 116
+# 与条带大小无关的固定开销（OpenCV内部缓冲、结果与未结束区域等）
+FIXED_BYTES = 8 * 1024 ** 2
+# 区域模式另外需要：区域编号 4 + 按编号累加时的float64权重 8 + 连通区域标记的临时数据
+REGION_BYTES_PER_PIXEL = 20
+
+# 可以直接按行读取的未压缩像素格式（通道顺序，每像素字节数）
+_RAW_MODES = {'RGB': ('RGB', 3), 'BGR': ('BGR', 3), 'RGBX': ('RGB', 4), 'RGBA': ('RGB', 4),
+              'BGRX': ('BGR', 4), 'BGRA': ('BGR', 4)}
+
+# 非CIE76公式逐块计算时的像素数（限制float64临时数组）
+_DELTA_E_CHUNK = 1 << 16
+
+
+class RowReader:
+    """按行读取图片为8位RGB
+
+    未压缩且整行存储的图片（PIL 'raw' 图块：BMP、PPM、未压缩TIFF）从文件按需读取行，
+    只占用读取的行；其他格式（以及带 EXIF 方向的图片）与引擎加载相同，整幅解码并摆正一次。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._array = None
+        with Image.open(path) as image:
+            self.size = image.size
+            self._layout = self._raw_layout(image) if exif_orientation(image) == 1 else None
+        if self._layout is None:
+            image, self.size, _ = decode_image(path)
+            self._array = np.asarray(image)
+        else:
+            self._file = open(path, 'rb')
+
+    @property
+    def streaming(self):
+        """是否从文件按行读取（不持有整幅图片）"""
+        return self._layout is not None
+
+    @property
+    def resident_bytes(self):
+        """常驻内存中的像素字节数"""
+        return 0 if self._array is None else self._array.nbytes
+
+    @staticmethod
+    def _raw_layout(image):
+        """未压缩整行图块的布局 [(起始行, 结束行, 文件偏移, 行字节数, 方向, 通道顺序, 每像素字节)]，不支持时返回None"""
+        width = image.size[0]
+        layout = []
+        for tile in image.tile:
+            codec, extents, offset, args = tile[0], tile[1], tile[2], tile[3]
+            if codec != 'raw':
+                return None
+            rawmode, stride, direction = (args, 0, 1) if isinstance(args, str) else (tuple(args) + (0, 1))[:3]
+            if rawmode not in _RAW_MODES:
+                return None
+            x0, y0, x1, y1 = extents
+            if x0 != 0 or x1 != width:
+                return None
+            order, pixel_bytes = _RAW_MODES[rawmode]
+            layout.append((y0, y1, offset, stride or width * pixel_bytes, direction, order, pixel_bytes))
+        return layout or None
+
+    def read(self, y0, y1):
+        """读取第 y0 到 y1（不含）行，返回 (行数, 宽, 3) 的uint8数组"""
+        if self._array is not None:
+            return self._array[y0:y1]
+
+        width = self.size[0]
+        out = np.empty((y1 - y0, width, 3), dtype=np.uint8)
+        for tile_y0, tile_y1, offset, stride, direction, order, pixel_bytes in self._layout:
+            start, stop = max(y0, tile_y0), min(y1, tile_y1)
+            if start >= stop:
+                continue
+            # 自下而上存储的图块（BMP）文件中的行顺序相反
+            if direction < 0:
+                first = (tile_y1 - stop)
+            else:
+                first = start - tile_y0
+            self._file.seek(offset + first * stride)
+            data = np.frombuffer(self._file.read((stop - start) * stride), dtype=np.uint8)
+            rows = data.reshape(stop - start, stride)[:, :width * pixel_bytes].reshape(stop - start, width, pixel_bytes)
+            if direction < 0:
+                rows = rows[::-1]
+            channels = [2, 1, 0] if order == 'BGR' else [0, 1, 2]
+            out[start - y0:stop - y0] = rows[:, :, channels]
+        return out
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._array = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def strip_bytes_per_pixel(match_mode='pixels'):
+    """每个条带像素的工作内存（字节）"""
+    return STRIP_BYTES_PER_PIXEL + (REGION_BYTES_PER_PIXEL if match_mode == 'regions' else 0)
+
+
+def strip_rows(width, memory_budget, resident_bytes=0, match_mode='pixels'):
+    """内存预算内每个条带的行数（至少1行）"""
+    available = memory_budget - resident_bytes - FIXED_BYTES
+    return max(1, int(available // (max(width, 1) * strip_bytes_per_pixel(match_mode))))
+
+
+class _RegionAccumulator:
+    """跨条带累计连通区域
+
+    只保留与当前条带最后一行相接、可能继续向下延伸的区域（最多约为图片宽度的一半）
+    和已结束区域中的前N名，内存与连通区域总数无关。
+    每个区域的统计量：[面积, 色差和, x和, y和, R和, G和, B和, L和, a和, b和] 与外接矩形 [左, 上, 右, 下]。
+    """
+
+    def __init__(self, width, num, min_area):
+        self.width = width
+        self.num = num
+        self.min_area = max(1, min_area)
+        self.open_sums = np.zeros((0, 10))
+        self.open_bounds = np.zeros((0, 4), dtype=np.int64)
+        self.previous_row = None  # 上一条带最后一行每个像素所属的未结束区域（-1为背景）
+        self.best_sums = np.zeros((0, 10))
+        self.best_bounds = np.zeros((0, 4), dtype=np.int64)
+
+    def add_strip(self, y0, labels, count, stats, centroids, distance, rgb, lab):
+        """加入一个条带的连通区域标记结果（编号0为背景）"""
+        import cv2
+        flat_labels = labels.ravel()
+        area = stats[:, cv2.CC_STAT_AREA].astype(np.float64)
+        sums = [area,
+                np.bincount(flat_labels, weights=distance.ravel(), minlength=count),
+                centroids[:, 0] * area,
+                (centroids[:, 1] + y0) * area]
+        # 直接对整个条带按编号累加（背景累加到编号0后丢弃），不取出前景像素的副本
+        for values in (rgb, lab):
+            sums.extend(np.bincount(flat_labels, weights=values[..., c].ravel(), minlength=count) for c in range(3))
+        left = stats[:, cv2.CC_STAT_LEFT]
+        top = stats[:, cv2.CC_STAT_TOP] + y0
+        bounds = np.stack([left, top, left + stats[:, cv2.CC_STAT_WIDTH], top + stats[:, cv2.CC_STAT_HEIGHT]], axis=1)
+        local_sums = np.stack(sums, axis=1)[1:]
+        local_bounds = bounds[1:].astype(np.int64)
+
+        # 节点：上一条带未结束的区域（0..G-1）和本条带的区域（G..G+count-2）
+        open_count = len(self.open_sums)
+        node_sums = np.concatenate([self.open_sums, local_sums])
+        node_bounds = np.concatenate([self.open_bounds, local_bounds])
+        root = np.arange(len(node_sums))
+
+        # 与上一条带最后一行8连通相接的区域合并
+        if self.previous_row is not None and open_count:
+            first_row = labels[0]
+            pairs = []
+            for dx in (-1, 0, 1):
+                upper = self.previous_row[max(0, dx):self.width + min(0, dx)]
+                lower = first_row[max(0, -dx):self.width + min(0, -dx)]
+                linked = (upper >= 0) & (lower > 0)
+                if linked.any():
+                    pairs.append(np.stack([upper[linked], open_count + lower[linked] - 1], axis=1))
+            if pairs:
+                pairs = np.unique(np.concatenate(pairs), axis=0)
+                root = self._merge(root, pairs[:, 0], pairs[:, 1])
+
+        # 按根节点汇总统计量
+        groups, slot = np.unique(root, return_inverse=True)
+        group_sums = np.zeros((len(groups), 10))
+        np.add.at(group_sums, slot, node_sums)
+        group_bounds = np.empty((len(groups), 4), dtype=np.int64)
+        group_bounds[:, :2] = np.iinfo(np.int64).max
+        group_bounds[:, 2:] = np.iinfo(np.int64).min
+        np.minimum.at(group_bounds[:, :2], slot, node_bounds[:, :2])
+        np.maximum.at(group_bounds[:, 2:], slot, node_bounds[:, 2:])
+
+        # 与本条带最后一行相接的区域未结束，其余区域结束
+        last_row = labels[-1]
+        open_groups = np.zeros(len(groups), dtype=bool)
+        touching = np.unique(last_row[last_row > 0])
+        open_groups[slot[open_count + touching - 1]] = True
+        self._finish(group_sums[~open_groups], group_bounds[~open_groups])
+
+        renumber = np.full(len(groups), -1, dtype=np.int64)
+        renumber[open_groups] = np.arange(np.count_nonzero(open_groups))
+        self.open_sums = group_sums[open_groups]
+        self.open_bounds = group_bounds[open_groups]
+        row_groups = np.full(self.width, -1, dtype=np.int64)
+        foreground = last_row > 0
+        row_groups[foreground] = renumber[slot[open_count + last_row[foreground] - 1]]
+        self.previous_row = row_groups
+
+    @staticmethod
+    def _merge(root, a, b):
+        """合并节点对（最小编号传播 + 指针跳跃），返回每个节点的根"""
+        while True:
+            low = np.minimum(root[a], root[b])
+            before = root.copy()
+            np.minimum.at(root, a, low)
+            np.minimum.at(root, b, low)
+            root = root[root]
+            if np.array_equal(root, before):
+                return root
+
+    def _finish(self, sums, bounds):
+        """已结束的区域并入前N名（按面积从大到小，同面积平均色差小的优先）"""
+        keep = sums[:, 0] >= self.min_area
+        sums = np.concatenate([self.best_sums, sums[keep]])
+        bounds = np.concatenate([self.best_bounds, bounds[keep]])
+        order = np.lexsort((sums[:, 1] / sums[:, 0], -sums[:, 0]))[:self.num]
+        self.best_sums, self.best_bounds = sums[order], bounds[order]
+
+    def regions(self):
+        """结束所有区域，返回前N名，格式与 ColorSearchEngine 的区域模式相同"""
+        self._finish(self.open_sums, self.open_bounds)
+        self.open_sums = self.open_sums[:0]
+        self.open_bounds = self.open_bounds[:0]
+        regions = []
+        for total, (x0, y0, x1, y1) in zip(self.best_sums, self.best_bounds):
+            area = total[0]
+            distance = float(total[1] / area)
+            regions.append({
+                'x': int(round(total[2] / area)),
+                'y': int(round(total[3] / area)),
+                'rgb': tuple(int(round(c)) for c in total[4:7] / area),
+                'similarity': max(0.0, 100 - distance * 2),
+                'distance': distance,
+                'area': int(area),
+                'bbox': (int(x0), int(y0), int(x1 - x0), int(y1 - y0)),
+                'mean_lab': tuple(round(float(c), 3) for c in total[7:10] / area),
+            })
+        return regions
+
+
+def _sample_target(reader, sample):
+    """取样的目标颜色（RGB）与排除区域；取样区域为空时返回 (None, None)"""
+    img_width, img_height = reader.size
+    x, y = sample['x'], sample['y']
+    if sample['type'] != 'circle':
+        rgb = reader.read(y, y + 1)[0, x].astype(np.float64)
+        return rgb, None
+    radius = sample['radius']
+    y0, y1 = max(0, y - radius), min(img_height, y + radius + 1)
+    x0, x1 = max(0, x - radius), min(img_width, x + radius + 1)
+    if y0 >= y1 or x0 >= x1:
+        return None, None
+    rows = reader.read(y0, y1)[:, x0:x1]
+    y_indices, x_indices = np.ogrid[y0:y1, x0:x1]
+    pixels = rows[(y_indices - y) ** 2 + (x_indices - x) ** 2 <= radius ** 2]
+    if len(pixels) == 0:
+        return None, None
+    return pixels.mean(axis=0), radius
+
+
+def _strip_squared_distances(lab, target_lab_array, metric, out, scratch):
+    """条带（float32 Lab）与目标颜色的色差平方"""
+    if metric == 'cie76':
+        scale, _ = LAB_ENCODINGS['float32']
+        return _encoded_squared_distances(lab, np.asarray(target_lab_array, dtype=np.float64), scale, out, scratch)
+    flat_lab = lab.reshape(-1, 3)
+    flat_out = out.ravel()
+    for start in range(0, flat_out.size, _DELTA_E_CHUNK):
+        chunk = delta_e(flat_lab[start:start + _DELTA_E_CHUNK], target_lab_array, metric)
+        flat_out[start:start + len(chunk)] = np.square(chunk)
+    return out
+
+
+def stream_search(engine, path, samples, lasso_points=None, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """按行条带对图片执行全部取样查询，不加载整幅Lab图像
+
+    engine 提供查询参数（num_similar、min_distance、metric、match_mode、区域阈值），不加载图片。
+    samples 为取样列表 {'type': 'point'/'circle', 'x', 'y', ['radius']}（原图坐标）。
+    lasso_points 为套索点列表或组合范围 RegionSet。
+    返回与 samples 对应的列表 {'target_rgb', 'matches'}，取样超出图片时为 {'error'}。
+    结果与 engine.find_similar_colors / find_similar_colors_by_circle 相同（float32 Lab）。
+    整幅解码的RGB与条带工作内存之和超过 memory_budget 时抛出 MemoryError。
+    """
+    import cv2
+    if engine.distinct or engine.neighborhood:
+        raise ValueError("流式查找不支持 Distinct / Neighborhood 模式 "
+                         "Streaming search does not support distinct or neighborhood matching")
+
+    with RowReader(path) as reader:
+        img_width, img_height = reader.size
+        rows_per_strip = strip_rows(img_width, memory_budget, reader.resident_bytes, engine.match_mode)
+        needed = reader.resident_bytes + FIXED_BYTES + img_width * strip_bytes_per_pixel(engine.match_mode)
+        if needed > memory_budget:
+            if reader.resident_bytes:
+                raise MemoryError(f"解码后的图片超出内存预算 Decoded image needs {needed / 1024 ** 2:.0f} MB, "
+                                  f"over the {memory_budget / 1024 ** 2:.0f} MB budget; "
+                                  f"convert it to uncompressed TIFF/BMP/PPM to stream it")
+            raise MemoryError(f"内存预算不足一行 A single row needs {needed / 1024 ** 2:.1f} MB, "
+                              f"over the {memory_budget / 1024 ** 2:.0f} MB budget")
+
+        # 各取样的目标颜色、排除区域与累计状态
+        queries = []
+        results = []
+        for sample in samples:
+            if not (0 <= sample['x'] < img_width and 0 <= sample['y'] < img_height):
+                results.append({'error': "取样位置超出图片范围 Sample outside image", 'matches': []})
+                continue
+            target_rgb, radius = _sample_target(reader, sample)
+            result = {'target_rgb': None, 'matches': []}
+            results.append(result)
+            if target_rgb is None:
+                continue
+            if radius is None:
+                result['target_rgb'] = [int(c) for c in target_rgb]
+                exclusion = (sample['x'], sample['y'], engine.min_distance, False)
+            else:
+                result['target_rgb'] = [round(float(c), 2) for c in target_rgb]
+                exclusion = (sample['x'], sample['y'], radius + engine.min_distance, True)
+            queries.append({
+                'result': result,
+                'target_lab': engine.rgb_to_lab(target_rgb),
+                'exclusion': exclusion,
+                'best_d2': np.empty(0, dtype=np.float32),
+                'best_idx': np.empty(0, dtype=np.intp),
+                'regions': (_RegionAccumulator(img_width, engine.num_similar, engine.region_min_area)
+                            if engine.match_mode == 'regions' else None),
+            })
+        if not queries:
+            return results
+
+        # 搜索范围统一按组合范围处理，每个条带直接填入；只读取范围所在的条带（条带位置不变）
+        search_area = None
+        first_row, last_row = 0, img_height
+        if lasso_points is not None and len(lasso_points):
+            search_area = (lasso_points if isinstance(lasso_points, RegionSet)
+                           else RegionSet([('polygon', lasso_points)]))
+            first_row, last_row = search_area.row_range((img_height, img_width))
+            first_row = first_row // rows_per_strip * rows_per_strip
+
+        threshold = np.float32(engine.region_threshold) ** 2
+        buffers = None
+        for y0 in range(first_row, max(first_row, last_row), rows_per_strip):
+            y1 = min(img_height, y0 + rows_per_strip)
+            rgb = reader.read(y0, y1)
+            lab = srgb_to_lab(rgb)
+            shape = (y1 - y0, img_width)
+            # 条带缓冲区（只有最后一个条带可能更矮）
+            if buffers is None or buffers['dist'].shape != shape:
+                buffers = {name: np.empty(shape, dtype=np.float32) for name in ('dist', 'work', 'scratch')}
+                buffers['select'] = np.empty(shape, dtype=bool)
+                if engine.match_mode == 'regions':
+                    buffers['labels'] = np.empty(shape, dtype=np.int32)
+
+            in_region = None if search_area is None else search_area.rows(y0, y1, img_width)
+
+            for query in queries:
+                dist = _strip_squared_distances(lab, query['target_lab'], engine.metric,
+                                                buffers['dist'], buffers['scratch'])
+                work = buffers['work']
+                np.copyto(work, dist)
+                center_x, center_y, radius, inclusive = query['exclusion']
+                ColorSearchEngine._apply_exclusion(work, (center_x, center_y - y0, radius, inclusive))
+                if in_region is not None:
+                    np.copyto(work, np.inf, where=~in_region)
+
+                if query['regions'] is not None:
+                    foreground = buffers['select']
+                    np.less_equal(work, threshold, out=foreground)
+                    count, labels, stats, centroids = cv2.connectedComponentsWithStats(
+                        foreground.view(np.uint8), labels=buffers['labels'], connectivity=8, ltype=cv2.CV_32S)
+                    np.sqrt(dist, out=buffers['scratch'])
+                    query['regions'].add_strip(y0, labels, count, stats, centroids, buffers['scratch'], rgb, lab)
+                    continue
+
+                # 条带内的前N名与累计的前N名合并，按（色差, 位置）保留前N名
+                local = ColorSearchEngine._select_top(work, engine.num_similar, buffers['scratch'], buffers['select'])
+                all_d2 = np.concatenate([query['best_d2'], dist.ravel()[local]])
+                all_idx = np.concatenate([query['best_idx'], local + y0 * img_width])
+                top = np.lexsort((all_idx, all_d2))[:engine.num_similar]
+                query['best_d2'], query['best_idx'] = all_d2[top], all_idx[top]
+
+        for query in queries:
+            if query['regions'] is not None:
+                query['result']['matches'] = query['regions'].regions()
+                continue
+            matches = []
+            for idx, squared in zip(query['best_idx'], query['best_d2']):
+                flat_y, flat_x = divmod(int(idx), img_width)
+                distance = float(np.sqrt(squared))
+                matches.append({
+                    'x': flat_x,
+                    'y': flat_y,
+                    'rgb': tuple(int(c) for c in reader.read(flat_y, flat_y + 1)[0, flat_x]),
+                    'similarity': max(0.0, 100 - distance * 2),
+                    'distance': distance,
+                })
+            query['result']['matches'] = matches
+        return results
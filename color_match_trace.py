@@ -0,0 +1,203 @@
+"""
+分阶段耗时与内存跟踪
+功能：不依赖Tk的轻量跟踪器——用 with TRACER.span('名称'): 包住解码、Lab转换、搜索范围、色差、选前N名、
+      渲染等阶段，运行中可随时开关（关闭时只多一次属性判断）；记录每个阶段最近一次的耗时，
+      导出为 Chrome 跟踪格式（chrome://tracing、Perfetto、speedscope 可直接打开）
+
+示例：
+    from color_match_trace import TRACER
+    TRACER.enabled = True
+    ...  # 查找、渲染
+    print(TRACER.summary())
+    TRACER.export_chrome('trace.json')
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+
+try:
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):  # Windows
+    _PAGE_SIZE = None
+
+
+# 打开的 /proc/self/statm：(进程号, 文件描述符)；fork 出的子进程重新打开（继承的描述符指向父进程）
+_statm = None
+
+
+def resident_bytes():
+    """当前进程的常驻内存（字节），平台不支持时返回None
+
+    保持 /proc/self/statm 打开，每次从头 pread（约1.5微秒，重新打开约10微秒）。
+    """
+    global _statm
+    if _PAGE_SIZE is None:
+        return None
+    try:
+        if _statm is None or _statm[0] != os.getpid():
+            _statm = (os.getpid(), os.open('/proc/self/statm', os.O_RDONLY))
+        return int(os.pread(_statm[1], 128, 0).split()[1]) * _PAGE_SIZE
+    except (OSError, AttributeError, IndexError, ValueError):
+        return None
+
+
+class _NullSpan:
+    """跟踪关闭时使用的空阶段（共用一个实例）"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'args', 'start', 'rss')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.rss = resident_bytes() if self.tracer.memory else None
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter_ns()
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer._record(self, end)
+        return False
+
+    def set(self, **args):
+        """补充阶段的参数（如像素数、选中的查找方式）"""
+        self.args.update(args)
+
+
+class Tracer:
+    """分阶段跟踪器：enabled 为 False 时 span() 返回空阶段，不计时也不记录
+
+    每个阶段记录为 Chrome 跟踪格式的完整事件（ph 'X'，时间单位微秒），最多保留 capacity 个；
+    memory 为 True 时阶段参数中附带开始和结束时的常驻内存（rss_mb / delta_mb）。
+    last 为每个阶段名最近一次的耗时（毫秒），供状态栏显示。线程安全。
+    """
+
+    def __init__(self, enabled=False, capacity=100_000, memory=True):
+        self.enabled = enabled
+        self.memory = memory
+        self.events = deque(maxlen=capacity)
+        self.last = {}
+        self._lock = threading.Lock()
+        self._threads = {}  # 线程 ident -> 线程名
+
+    def span(self, name, **args):
+        """阶段计时的上下文管理器：with tracer.span('distances', pixels=n) as span: ..."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def _record(self, span, end):
+        duration = end - span.start
+        args = span.args
+        if span.rss is not None:
+            rss = resident_bytes()
+            if rss is not None:
+                args['rss_mb'] = round(rss / 1024 ** 2, 1)
+                args['delta_mb'] = round((rss - span.rss) / 1024 ** 2, 1)
+        thread = threading.current_thread()
+        event = {'name': span.name, 'ph': 'X', 'ts': span.start / 1000, 'dur': duration / 1000,
+                 'pid': os.getpid(), 'tid': thread.ident, 'args': args}
+        with self._lock:
+            self._threads.setdefault(thread.ident, thread.name)
+            self.events.append(event)
+            self.last[span.name] = duration / 1e6
+
+    def children(self, name):
+        """最近一次名为 name 的阶段内（同一线程）各子阶段的耗时 {名称: 毫秒}（同名的累加），没有时返回空字典"""
+        stages = {}
+        with self._lock:
+            events = reversed(self.events)
+            parent = next((event for event in events if event['name'] == name and event['ph'] == 'X'), None)
+            if parent is None:
+                return stages
+            # 阶段结束时才记录，子阶段排在父阶段之前；遇到在父阶段开始前就结束的事件为止
+            for event in events:
+                if event['ph'] != 'X' or event['tid'] != parent['tid'] or event['pid'] != parent['pid']:
+                    continue
+                if event['ts'] + event['dur'] < parent['ts']:
+                    break
+                stages[event['name']] = stages.get(event['name'], 0.0) + event['dur'] / 1000
+        # 按结束的先后顺序
+        return dict(reversed(stages.items()))
+
+    def clear(self):
+        with self._lock:
+            self.events.clear()
+            self.last.clear()
+
+    def summary(self):
+        """已记录事件（含并入的）的各阶段统计 {名称: {'count', 'total_ms', 'mean_ms', 'max_ms'}}，按总耗时从大到小"""
+        totals = {}
+        with self._lock:
+            for event in self.events:
+                if event['ph'] == 'X':
+                    total = totals.setdefault(event['name'], [0, 0.0, 0.0])
+                    total[0] += 1
+                    total[1] += event['dur']
+                    total[2] = max(total[2], event['dur'])
+        items = sorted(totals.items(), key=lambda item: -item[1][1])
+        return {name: {'count': count, 'total_ms': total / 1000, 'mean_ms': total / count / 1000,
+                       'max_ms': longest / 1000}
+                for name, (count, total, longest) in items}
+
+    def _thread_names(self):
+        """线程名的元数据事件（时间线上按线程名显示）"""
+        return [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': ident, 'args': {'name': name}}
+                for ident, name in self._threads.items()]
+
+    def take_events(self):
+        """取出并清空已记录的事件（多进程时由工作进程传回主进程）"""
+        with self._lock:
+            events = list(self.events)
+            self.events.clear()
+            threads = self._thread_names()
+        return threads + events
+
+    def add_events(self, events):
+        """并入其他进程传回的事件"""
+        with self._lock:
+            self.events.extend(events)
+
+    def to_chrome(self):
+        """Chrome 跟踪格式的字典；有内存数据时附带常驻内存的计数器事件（在时间线上显示为曲线）"""
+        with self._lock:
+            events = list(self.events)
+            threads = self._thread_names()
+        counters = [{'name': 'memory', 'ph': 'C', 'ts': event['ts'] + event['dur'], 'pid': event['pid'],
+                     'args': {'rss_mb': event['args']['rss_mb']}}
+                    for event in events if event['ph'] == 'X' and 'rss_mb' in event['args']]
+        return {'traceEvents': threads + events + counters, 'displayTimeUnit': 'ms'}
+
+    def export_chrome(self, path):
+        """写出 Chrome 跟踪格式的JSON文件，返回事件数"""
+        trace = self.to_chrome()
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(trace, f)
+        return len(trace['traceEvents'])
+
+
+# 全局跟踪器（默认关闭）；引擎、视图渲染和界面共用，设置 COLOR_MATCH_TRACE=1 时启动即开启
+TRACER = Tracer(enabled=os.environ.get('COLOR_MATCH_TRACE', '') not in ('', '0'))
@@ -0,0 +1,178 @@
+"""
+图片视图渲染
+功能：不依赖Tk的缩放渲染——只对画布上可见的部分（含少量边距）重采样，
+      缩小时从缓存的金字塔层（每层长宽减半）开始，交互中用快速插值，停下后用高质量插值；
+      以及合并一帧内多次请求的帧调度器和帧耗时统计
+"""
+
+import math
+import time
+from collections import OrderedDict, deque
+
+from PIL import Image
+
+from color_match_trace import TRACER
+
+# 交互中（缩放、平移）用的快速插值；放大时最近邻即可看清像素
+FAST_RESAMPLE = Image.Resampling.BILINEAR
+FAST_UPSCALE_RESAMPLE = Image.Resampling.NEAREST
+# 停下后的高质量插值（与原来整图缩放相同）
+QUALITY_RESAMPLE = Image.Resampling.LANCZOS
+
+
+class ImagePyramid:
+    """图片的金字塔层：第k层为原图长宽各缩小 2^k 倍（盒式滤波），最近使用的几层缓存在内存中"""
+
+    def __init__(self, image, max_levels=4):
+        self.image = image
+        self.max_levels = max_levels
+        self._levels = OrderedDict()  # 层号 -> 图片（最近使用的在后）
+
+    def max_level(self):
+        """最高一层（短边不小于1个像素）"""
+        return max(0, int(math.log2(max(1, min(self.image.size)))))
+
+    def level(self, k):
+        """第k层图片，由已缓存的最接近的下层逐层缩小得到"""
+        if k <= 0:
+            return self.image
+        if k in self._levels:
+            self._levels.move_to_end(k)
+            return self._levels[k]
+        below = max((j for j in self._levels if j < k), default=0)
+        image = self.image if below == 0 else self._levels[below]
+        with TRACER.span('pyramid', level=k, start=below):
+            for j in range(below + 1, k + 1):
+                image = image.reduce(2)
+                self._store(j, image)
+        return image
+
+    def _store(self, k, image):
+        self._levels[k] = image
+        self._levels.move_to_end(k)
+        while len(self._levels) > self.max_levels:
+            self._levels.popitem(last=False)
+
+    @property
+    def cached_levels(self):
+        return list(self._levels)
+
+
+def choose_level(scale, max_level):
+    """缩放比例对应的金字塔层：层的尺寸不小于目标尺寸（只缩小不放大，最多缩小2倍）"""
+    if scale >= 1:
+        return 0
+    return min(max_level, max(0, int(math.floor(math.log2(1 / scale)))))
+
+
+def visible_box(image_size, scale, offset_x, offset_y, view_width, view_height, margin=0.0):
+    """画布视口（四周各扩展 margin 倍视口尺寸）内可见的原图范围 (x0, y0, x1, y1)，不可见时返回None
+
+    offset 为原图左上角在画布上的位置，原图坐标 x 对应画布坐标 offset_x + x * scale。
+    """
+    img_width, img_height = image_size
+    margin_x, margin_y = view_width * margin, view_height * margin
+    x0 = max(0, math.floor((-margin_x - offset_x) / scale))
+    y0 = max(0, math.floor((-margin_y - offset_y) / scale))
+    x1 = min(img_width, math.ceil((view_width + margin_x - offset_x) / scale))
+    y1 = min(img_height, math.ceil((view_height + margin_y - offset_y) / scale))
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return x0, y0, x1, y1
+
+
+def render_view(pyramid, scale, offset_x, offset_y, view_width, view_height, fast=False, margin=0.25):
+    """渲染视口内可见的部分：返回 (图片, 画布左, 画布上)，不可见时返回None
+
+    图片覆盖原图范围 visible_box(...)，位置与整图缩放后放在 offset 处一致（取整到像素）。
+    """
+    box = visible_box(pyramid.image.size, scale, offset_x, offset_y, view_width, view_height, margin)
+    if box is None:
+        return None
+    x0, y0, x1, y1 = box
+    left, top = round(offset_x + x0 * scale), round(offset_y + y0 * scale)
+    width = max(1, round(offset_x + x1 * scale) - left)
+    height = max(1, round(offset_y + y1 * scale) - top)
+
+    k = choose_level(scale, pyramid.max_level())
+    factor = 2 ** k
+    source = pyramid.level(k)
+    if fast:
+        resample = FAST_UPSCALE_RESAMPLE if scale >= 1 else FAST_RESAMPLE
+    else:
+        resample = QUALITY_RESAMPLE
+    # box 参数只对可见部分重采样，不复制裁剪结果
+    level_box = (x0 / factor, y0 / factor, min(x1 / factor, source.width), min(y1 / factor, source.height))
+    with TRACER.span('resize', fast=fast, level=k, width=width, height=height):
+        return source.resize((width, height), resample, box=level_box), left, top
+
+
+class FrameStats:
+    """最近若干帧的耗时统计，以及请求被合并的比例"""
+
+    def __init__(self, window=240):
+        self.durations = deque(maxlen=window)  # 每帧耗时（秒）
+        self.requests = 0  # 累计请求次数
+        self.frames = 0  # 累计绘制帧数
+
+    def record(self, seconds):
+        self.durations.append(seconds)
+        self.frames += 1
+
+    def summary(self):
+        """{'frames', 'requests', 'coalesced', 'mean_ms', 'p50_ms', 'p95_ms', 'max_ms'}；coalesced 为被合并掉的请求比例"""
+        result = {'frames': self.frames, 'requests': self.requests,
+                  'coalesced': 1 - self.frames / self.requests if self.requests else 0.0}
+        if self.durations:
+            ordered = sorted(self.durations)
+            result.update(mean_ms=sum(ordered) / len(ordered) * 1000,
+                          p50_ms=ordered[len(ordered) // 2] * 1000,
+                          p95_ms=ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+                          max_ms=ordered[-1] * 1000)
+        return result
+
+
+class FrameScheduler:
+    """帧调度：一帧内的多次 request() 合并为一次 callback()，两次绘制的间隔不小于 interval 秒
+
+    after(ms, func) / after_idle(func) / cancel(job) 与 Tk 的 after / after_idle / after_cancel 相同；
+    距上一帧已超过 interval 时在空闲时（处理完已排队的事件后）绘制，否则等到下一帧的时间。
+    """
+
+    def __init__(self, after, after_idle, cancel, callback, interval=1 / 60, clock=time.perf_counter):
+        self._after = after
+        self._after_idle = after_idle
+        self._cancel = cancel
+        self.callback = callback
+        self.interval = interval
+        self._clock = clock
+        self._job = None
+        self._last_frame = -math.inf
+        self.stats = FrameStats()
+
+    @property
+    def pending(self):
+        return self._job is not None
+
+    def request(self):
+        """请求绘制一帧（已有未绘制的请求时直接合并）"""
+        self.stats.requests += 1
+        if self._job is not None:
+            return
+        delay = self._last_frame + self.interval - self._clock()
+        if delay <= 0:
+            self._job = self._after_idle(self._run)
+        else:
+            self._job = self._after(max(1, int(delay * 1000 + 0.5)), self._run)
+
+    def cancel(self):
+        if self._job is not None:
+            self._cancel(self._job)
+            self._job = None
+
+    def _run(self):
+        self._job = None
+        start = self._clock()
+        self._last_frame = start
+        self.callback()
+        self.stats.record(self._clock() - start)
@@ -0,0 +1,169 @@
+"""
+后台查找
+功能：在工作线程中执行查找（NumPy/cv2 的计算会释放GIL，界面保持响应）；
+      每次提交使之前的查找过期：等待中的直接丢弃，正在执行的在引擎的下一个检查点中止，过期的结果不再交回；
+      以及在后台执行一次性任务（载入预览后的全分辨率解码与Lab预计算）
+"""
+
+import queue
+import threading
+import time
+
+from color_match_engine import SearchCancelled
+
+
+class SearchWorker:
+    """单个工作线程按顺序执行查找，只交回最新一次提交（代号 generation 最大）的结果
+
+    结果由界面线程调用 poll() 取回（Tk 不是线程安全的，不能在工作线程中更新界面）。
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.generation = 0  # 最新一次提交的代号
+        self._condition = threading.Condition()
+        self._job = None  # 等待执行的 (代号, 函数)
+        self._running = None  # 正在执行的代号
+        self._started = 0.0  # 正在执行的查找的开始时间
+        self._fraction = None  # 正在执行的查找的进度
+        self.elapsed = None  # 最近一次完成（未被取消）的查找的耗时（秒）
+        self._results = queue.SimpleQueue()  # (代号, 结果, 异常)
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop, name='color-match-search', daemon=True)
+        self._thread.start()
+        engine.checkpoint = self._checkpoint
+
+    def submit(self, func):
+        """提交查找 func()（在工作线程中调用），返回代号；之前未完成的查找被取消"""
+        with self._condition:
+            self.generation += 1
+            self._job = (self.generation, func)
+            self._condition.notify_all()
+            return self.generation
+
+    def cancel(self):
+        """取消等待中和正在执行的查找"""
+        with self._condition:
+            self.generation += 1
+            self._job = None
+
+    @property
+    def busy(self):
+        """是否有等待中或正在执行的查找"""
+        with self._condition:
+            return self._job is not None or self._running is not None
+
+    def wait_idle(self, timeout=None):
+        """等待当前查找结束（或中止），超时返回False"""
+        with self._condition:
+            return self._condition.wait_for(lambda: self._job is None and self._running is None, timeout)
+
+    def progress(self):
+        """正在执行的最新查找的 (进度 0~1 或 None, 已用秒数)，没有时返回None"""
+        with self._condition:
+            if self._running is None or self._running != self.generation:
+                return None
+            return self._fraction, time.perf_counter() - self._started
+
+    def poll(self):
+        """取回已完成的最新查找：返回 (结果, 异常)，没有时返回None；过期的结果直接丢弃"""
+        latest = None
+        while True:
+            try:
+                generation, result, error = self._results.get_nowait()
+            except queue.Empty:
+                return latest
+            if generation == self.generation:
+                latest = (result, error)
+
+    def close(self):
+        """取消查找并结束工作线程"""
+        with self._condition:
+            self.generation += 1
+            self._job = None
+            self._closed = True
+            self._condition.notify_all()
+        if self.engine.checkpoint == self._checkpoint:
+            self.engine.checkpoint = None
+
+    def _checkpoint(self, fraction):
+        # 只中止工作线程中的查找，其他线程直接调用引擎时不受影响
+        if threading.current_thread() is not self._thread:
+            return
+        if self._running != self.generation:
+            raise SearchCancelled()
+        if fraction is not None:
+            self._fraction = fraction
+
+    def _loop(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._job is not None or self._closed)
+                if self._closed:
+                    return
+                (generation, func), self._job = self._job, None
+                self._running = generation
+                self._started = time.perf_counter()
+                self._fraction = None
+            try:
+                result = func()
+                self.elapsed = time.perf_counter() - self._started
+                self._results.put((generation, result, None))
+            except SearchCancelled:
+                pass
+            except Exception as e:
+                self._results.put((generation, None, e))
+            finally:
+                with self._condition:
+                    self._running = None
+                    self._condition.notify_all()
+
+
+class BackgroundTask:
+    """在守护线程中执行一次 func(checkpoint)，界面线程调用 poll() 取回结果
+
+    cancel() 后结果不再交回，func 在下一次调用 checkpoint() 时以 SearchCancelled 中止。
+    """
+
+    def __init__(self, func, name='color-match-task'):
+        self._func = func
+        self._cancelled = threading.Event()
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+        self.started = time.perf_counter()
+        self.elapsed = None  # 完成时的耗时（秒）
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def poll(self):
+        """已完成且未取消时返回 (结果, 异常)，否则返回None"""
+        if not self._done.is_set() or self.cancelled:
+            return None
+        return self._result, self._error
+
+    def wait(self, timeout=None):
+        """等待任务结束（完成、出错或中止），超时返回False"""
+        return self._done.wait(timeout)
+
+    def _checkpoint(self):
+        if self._cancelled.is_set():
+            raise SearchCancelled()
+
+    def _run(self):
+        try:
+            self._result = self._func(self._checkpoint)
+        except SearchCancelled:
+            pass
+        except Exception as e:
+            self._error = e
+        finally:
+            self.elapsed = time.perf_counter() - self.started
+            self._done.set()